@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Bloger.settings')
 
-application = get_asgi_application()
+# As get_asgi_application(), with a handler that streams responses from
+# worker threads instead of iterating them on the event loop
+django.setup(set_prefix=False)
+
+from scraper.asgi import StreamingASGIHandler
+
+application = StreamingASGIHandler()
@@ -147,3 +147,111 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+
+# Scraper
+# HTML parser used by WebScraper ('html.parser' or the faster 'lxml')
+SCRAPER_HTML_PARSER = os.environ.get('SCRAPER_HTML_PARSER', 'html.parser')
+
+# Serve the scrape views as async views (run under ASGI, e.g. uvicorn)
+SCRAPER_ASYNC_VIEWS = os.environ.get('SCRAPER_ASYNC_VIEWS') == '1'
+
+# Revalidation cache for fetched pages (ETag / Last-Modified), stored in MongoDB
+SCRAPER_FETCH_CACHE = os.environ.get('SCRAPER_FETCH_CACHE', '1') == '1'
+SCRAPER_FETCH_CACHE_MAX_BYTES = int(os.environ.get('SCRAPER_FETCH_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+SCRAPER_FETCH_CACHE_TTL = int(os.environ.get('SCRAPER_FETCH_CACHE_TTL', 7 * 24 * 3600))
+
+# Shared HTTP client used for all page fetches
+SCRAPER_HTTP_POOL_CONNECTIONS = int(os.environ.get('SCRAPER_HTTP_POOL_CONNECTIONS', 100))  # hosts kept in the pool
+SCRAPER_HTTP_POOL_MAXSIZE = int(os.environ.get('SCRAPER_HTTP_POOL_MAXSIZE', 20))  # connections kept per host
+SCRAPER_HTTP_PER_HOST = int(os.environ.get('SCRAPER_HTTP_PER_HOST', 8))  # concurrent requests per host
+SCRAPER_HTTP_RETRIES = int(os.environ.get('SCRAPER_HTTP_RETRIES', 3))
+SCRAPER_HTTP_BACKOFF = float(os.environ.get('SCRAPER_HTTP_BACKOFF', 0.5))
+# Longest Retry-After honoured, in seconds; responses asking for longer fail instead of waiting
+SCRAPER_MAX_RETRY_AFTER = float(os.environ.get('SCRAPER_MAX_RETRY_AFTER', 60))
+SCRAPER_HTTP_CONNECT_TIMEOUT = float(os.environ.get('SCRAPER_HTTP_CONNECT_TIMEOUT', 5))
+SCRAPER_HTTP_READ_TIMEOUT = float(os.environ.get('SCRAPER_HTTP_READ_TIMEOUT', 10))
+
+# main_content / paragraphs larger than this many characters are stored compressed
+SCRAPER_COMPRESS_THRESHOLD = int(os.environ.get('SCRAPER_COMPRESS_THRESHOLD', 16 * 1024))
+# Compressed bodies larger than this many bytes are moved to GridFS
+SCRAPER_GRIDFS_THRESHOLD = int(os.environ.get('SCRAPER_GRIDFS_THRESHOLD', 4 * 1024 * 1024))
+
+# Batch scrape API (/api/scrape/batch/)
+SCRAPER_BATCH_MAX_URLS = int(os.environ.get('SCRAPER_BATCH_MAX_URLS', 500))
+SCRAPER_BATCH_CONCURRENCY = int(os.environ.get('SCRAPER_BATCH_CONCURRENCY', 16))
+
+# Politeness: requests per second to any one host (0 disables spacing) and robots.txt handling
+SCRAPER_HOST_RATE = float(os.environ.get('SCRAPER_HOST_RATE', 2))
+SCRAPER_OBEY_ROBOTS = os.environ.get('SCRAPER_OBEY_ROBOTS', '1') == '1'
+SCRAPER_ROBOTS_TTL = int(os.environ.get('SCRAPER_ROBOTS_TTL', 3600))  # seconds a parsed robots.txt is reused
+SCRAPER_MAX_CRAWL_DELAY = float(os.environ.get('SCRAPER_MAX_CRAWL_DELAY', 30))  # cap on a site's Crawl-delay
+
+# Largest page body downloaded, in bytes; bigger pages fail with an error
+# unless SCRAPER_TRUNCATE_OVERSIZED=1, which keeps and parses the first part
+SCRAPER_MAX_BODY_BYTES = int(os.environ.get('SCRAPER_MAX_BODY_BYTES', 10 * 1024 * 1024))
+SCRAPER_TRUNCATE_OVERSIZED = os.environ.get('SCRAPER_TRUNCATE_OVERSIZED') == '1'
+
+# How main content and paragraphs are found: 'heuristic' (content selectors and
+# class name rules) or 'density' (blocks scored by text and link density)
+SCRAPER_EXTRACTION_MODE = os.environ.get('SCRAPER_EXTRACTION_MODE', 'heuristic')
+
+# Remember which main content selector works for each host (hosts kept in memory)
+SCRAPER_SELECTOR_PROFILES = os.environ.get('SCRAPER_SELECTOR_PROFILES', '1') == '1'
+SCRAPER_SELECTOR_PROFILES_SIZE = int(os.environ.get('SCRAPER_SELECTOR_PROFILES_SIZE', 1000))
+
+# Characters of each page's main content kept uncompressed for the search index
+SCRAPER_SEARCH_CONTENT_CHARS = int(os.environ.get('SCRAPER_SEARCH_CONTENT_CHARS', 20000))
+
+# Seconds a successful scrape of a URL is reused instead of fetching it again (0 = always fetch)
+SCRAPER_FRESHNESS_WINDOW = int(os.environ.get('SCRAPER_FRESHNESS_WINDOW', 300))
+
+# Near-duplicate pages (SimHash of the main content): 'off', 'flag' (save with
+# duplicate_of set) or 'skip' (return the original instead of saving), and how
+# many of the 64 fingerprint bits may differ (at most 3)
+SCRAPER_DUPLICATES = os.environ.get('SCRAPER_DUPLICATES', 'flag')
+SCRAPER_DUPLICATE_DISTANCE = int(os.environ.get('SCRAPER_DUPLICATE_DISTANCE', 3))
+
+# MongoDB connection pool, opened per process on first use. These override the
+# same options in MONGODB_URI.
+SCRAPER_MONGO_MAX_POOL_SIZE = int(os.environ.get('SCRAPER_MONGO_MAX_POOL_SIZE', 50))
+SCRAPER_MONGO_MIN_POOL_SIZE = int(os.environ.get('SCRAPER_MONGO_MIN_POOL_SIZE', 0))
+SCRAPER_MONGO_MAX_IDLE_MS = int(os.environ.get('SCRAPER_MONGO_MAX_IDLE_MS', 60000))
+# How long a request waits for a free connection when the pool is exhausted
+SCRAPER_MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+SCRAPER_MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_CONNECT_TIMEOUT_MS', 5000))
+SCRAPER_MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000))
+SCRAPER_MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_SOCKET_TIMEOUT_MS', 60000))
+# Write concern: a number of nodes ('0', '1', ...) or 'majority'; 0 ms write timeout waits forever
+SCRAPER_MONGO_WRITE_CONCERN = os.environ.get('SCRAPER_MONGO_WRITE_CONCERN', '1')
+SCRAPER_MONGO_WRITE_TIMEOUT_MS = int(os.environ.get('SCRAPER_MONGO_WRITE_TIMEOUT_MS', 0))
+
+# Buffer saved scrapes and insert them in unordered batches of SCRAPER_BULK_BATCH_SIZE,
+# at least every SCRAPER_BULK_FLUSH_INTERVAL seconds. Ids are returned before the
+# document is written.
+SCRAPER_BUFFERED_WRITES = os.environ.get('SCRAPER_BUFFERED_WRITES', '0') == '1'
+SCRAPER_BULK_BATCH_SIZE = int(os.environ.get('SCRAPER_BULK_BATCH_SIZE', 100))
+SCRAPER_BULK_FLUSH_INTERVAL = float(os.environ.get('SCRAPER_BULK_FLUSH_INTERVAL', 1.0))
+# Write concern for the batches (empty: SCRAPER_MONGO_WRITE_CONCERN)
+SCRAPER_BULK_WRITE_CONCERN = os.environ.get('SCRAPER_BULK_WRITE_CONCERN', '')
+# Attempts per document the server rejects in a batch
+SCRAPER_BULK_RETRIES = int(os.environ.get('SCRAPER_BULK_RETRIES', 3))
+# Most documents buffered per process; saves wait up to SCRAPER_BULK_MAX_WAIT seconds for room
+SCRAPER_BULK_MAX_PENDING = int(os.environ.get('SCRAPER_BULK_MAX_PENDING', 1000))
+SCRAPER_BULK_MAX_WAIT = float(os.environ.get('SCRAPER_BULK_MAX_WAIT', 30))
+
+# Scraper logs, including one JSON line per scrape with its phase timings
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'scraper': {
+            'handlers': ['console'],
+            'level': os.environ.get('SCRAPER_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
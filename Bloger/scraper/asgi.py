@@ -0,0 +1,51 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+
+# Marks the end of a streaming response's parts
+END = object()
+
+
+def response_headers(response):
+    """Headers and cookies of response as ASGI header pairs, like ASGIHandler.send_response"""
+    headers = []
+    for header, value in response.items():
+        if isinstance(header, str):
+            header = header.encode('ascii')
+        if isinstance(value, str):
+            value = value.encode('latin1')
+        headers.append((bytes(header), bytes(value)))
+    for cookie in response.cookies.values():
+        headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+    return headers
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """ASGIHandler that reads streaming responses on worker threads.
+
+    Django 3.2 iterates a StreamingHttpResponse on the event loop, so a body
+    produced by blocking work (a batch scrape, GridFS reads) stalls every
+    other request the process is serving, or has to be built in full before
+    anything is sent. Here each part is produced by sync_to_async and sent
+    as soon as it is ready.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            await super().send_response(response, send)
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': response_headers(response),
+        })
+        parts = iter(response)
+        next_part = sync_to_async(next, thread_sensitive=False)
+        while True:
+            part = await next_part(parts, END)
+            if part is END:
+                break
+            for chunk, _ in self.chunk_bytes(part):
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body'})
+        await sync_to_async(response.close, thread_sensitive=True)()
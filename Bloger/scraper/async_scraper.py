@@ -0,0 +1,188 @@
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+from asgiref.sync import sync_to_async
+from .fetch_cache import FetchCache
+from .http_client import (CHUNK_SIZE, RETRY_STATUSES, ResponseTooLarge, UnsupportedContentType, USER_AGENT,
+                          get_setting)
+from .metrics import finish_scrape, observe_download, observe_phase, record_error, trace_scrape
+from .politeness import RobotsDisallowed
+from .utils import WebScraper
+
+# One client per event loop so connections are reused across requests
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Shared httpx client for the running event loop"""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers={'User-Agent': USER_AGENT},
+            follow_redirects=True,
+            timeout=httpx.Timeout(
+                get_setting('SCRAPER_HTTP_READ_TIMEOUT', 10),
+                connect=get_setting('SCRAPER_HTTP_CONNECT_TIMEOUT', 5),
+            ),
+            limits=httpx.Limits(
+                max_connections=get_setting('SCRAPER_HTTP_POOL_CONNECTIONS', 100) * 2,
+                max_keepalive_connections=get_setting('SCRAPER_HTTP_POOL_CONNECTIONS', 100),
+            ),
+        )
+        _clients[loop] = client
+    return client
+
+
+@asynccontextmanager
+async def host_slot(semaphore):
+    """Hold one of a host's HostLimiter slots without blocking the event loop.
+
+    The semaphores are shared with the threaded HttpClient, so both count
+    against the same per-host cap; they are polled rather than waited on so
+    a cancelled request can't leave a slot taken.
+    """
+    delay = 0.005
+    while not semaphore.acquire(blocking=False):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.1)
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+# httpcore trace events that end a timed phase, and the event that starts it.
+# The DNS lookup happens inside connect_tcp, so it is counted as 'connect'.
+TRACE_PHASES = {
+    'connection.connect_tcp.complete': ('connect', 'connection.connect_tcp.started'),
+    'connection.start_tls.complete': ('tls', 'connection.start_tls.started'),
+    'http11.receive_response_headers.complete': ('ttfb', 'http11.send_request_headers.started'),
+}
+
+
+class ConnectionTrace:
+    """httpcore trace hook timing connection setup and time to first byte"""
+
+    def __init__(self):
+        self.started = {}
+
+    async def __call__(self, event, info):
+        now = time.perf_counter()
+        if event in TRACE_PHASES:
+            phase, start_event = TRACE_PHASES[event]
+            if start_event in self.started:
+                observe_phase(phase, now - self.started.pop(start_event))
+        else:
+            self.started[event] = now
+
+
+class AsyncWebScraper(WebScraper):
+    """WebScraper that fetches with asyncio instead of blocking a thread.
+
+    Extraction is the same as WebScraper, so results are identical; it runs
+    in a worker thread to keep the event loop responsive on large pages.
+    """
+
+    def __init__(self, url, parser=None, use_cache=True, client=None, fields=None, http=None):
+        super().__init__(url, parser=parser, use_cache=use_cache, fields=fields, http=http)
+        # httpx.AsyncClient to fetch with; the process-wide one by default
+        self.client = client
+
+    async def scrape(self):
+        with trace_scrape(self.url) as trace:
+            try:
+                response, data = await self.revalidate()
+                if data is None:
+                    data = await sync_to_async(self.parse_response, thread_sensitive=False)(response)
+                    await sync_to_async(self.remember, thread_sensitive=False)(response, data)
+                    finish_scrape(trace, 'success')
+                else:
+                    finish_scrape(trace, 'not_modified')
+                return data, None
+
+            except (httpx.HTTPError, RobotsDisallowed, ResponseTooLarge, UnsupportedContentType) as e:
+                error = f"Request error: {str(e)}"
+                record_error('request', e)
+            except Exception as e:
+                error = f"Scraping error: {str(e)}"
+                record_error('scraping', e)
+            finish_scrape(trace, 'error', error)
+            return None, error
+
+    async def request(self, headers=None):
+        client = self.client or get_async_client()
+        # Same per-host spacing and robots.txt rules as the threaded client,
+        # but waiting on the event loop instead of sleeping a thread
+        http = self.http
+        scheduler = http.scheduler
+        started = time.monotonic()
+        delay = await sync_to_async(scheduler.reserve, thread_sensitive=False)(self.url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with host_slot(http.host_limiter.get(self.url)):
+            waited = time.monotonic() - started
+            scheduler.record_wait(self.url, waited)
+            observe_phase('queue_wait', waited)
+
+            fetch_started = time.perf_counter()
+            limit = http.body_limit(self.url)
+            response = await self.send(client, headers, http.retry)
+            try:
+                # Same size and content type checks as HttpClient.read_body
+                limit.check_headers(response.status_code, response.headers)
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    if not limit.add(chunk):
+                        break
+            finally:
+                await response.aclose()
+        limit.apply(response)
+        observe_phase('fetch', time.perf_counter() - fetch_started)
+        observe_download(len(response.content))
+        return response
+
+    async def send(self, client, headers, retry):
+        """Send the GET, retrying errors, 429 and 5xx like the threaded client (see CappedRetry)"""
+        failures = 0
+        while True:
+            request = client.build_request('GET', self.url, headers=headers, extensions={'trace': ConnectionTrace()})
+            try:
+                response = await client.send(request, stream=True)
+            except httpx.TransportError:
+                failures += 1
+                wait = retry.next_wait(failures)
+                if wait is None:
+                    raise
+                await asyncio.sleep(wait)
+                continue
+
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            failures += 1
+            wait = retry.next_wait(failures, response.headers.get('Retry-After'))
+            if wait is None:
+                # Out of retries, or asked to wait too long; raise_for_status reports it
+                return response
+            await response.aclose()
+            await asyncio.sleep(wait)
+
+    async def fetch(self):
+        """Download the page and return the raw response body"""
+        response = await self.request()
+        response.raise_for_status()
+        return response.content
+
+    async def revalidate(self):
+        """Conditional GET against the fetch cache, see WebScraper.revalidate"""
+        cached = await sync_to_async(self._cache_call, thread_sensitive=False)('lookup', self.url)
+        response = await self.request(FetchCache.conditional_headers(cached))
+
+        if cached and response.status_code == 304:
+            data = await sync_to_async(self.reuse_cached, thread_sensitive=False)(cached)
+            return response, data
+
+        response.raise_for_status()
+        return response, None
@@ -0,0 +1,114 @@
+from django.shortcuts import render, redirect
+from django.contrib import messages
+from django.http import JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from asgiref.sync import sync_to_async
+# Async counterparts of the scrape views in views.py, used when the app is
+# served over ASGI with SCRAPER_ASYNC_VIEWS enabled
+from .mongodb_client import AsyncMongoDBClient
+from .forms import URLForm
+from .coalesce import async_scrape_url, stored_fields
+from .extraction import parse_fields
+from .jobs import JobQueue
+from .views import batch_from_request
+import json
+
+async def index(request):
+    mongo_client = AsyncMongoDBClient()
+
+    if request.method == 'POST':
+        form = URLForm(request.POST)
+        if form.is_valid():
+            url = form.cleaned_data['url']
+
+            # Scrape without holding a worker thread, or reuse a recent or in-flight scrape
+            document_id, data, error, reused = await async_scrape_url(url, mongo_client)
+
+            if error:
+                # Save error to MongoDB
+                document_id = await mongo_client.save_scraped_data(
+                    url=url,
+                    data_dict={},
+                    status='error',
+                    error_message=error
+                )
+                messages.error(request, f'Error scraping URL: {error}')
+            # The history and detail pages read the result back straight away
+            await mongo_client.flush_writes()
+            if not error:
+                messages.success(request, 'Data scraped successfully!')
+                return redirect('scraper:detail', pk=document_id)
+    else:
+        form = URLForm()
+
+    # Get recent scraping history
+    recent_scrapes = await mongo_client.get_recent_scrapes(10)
+
+    context = {
+        'form': form,
+        'recent_scrapes': recent_scrapes
+    }
+    return render(request, 'scraper/index.html', context)
+
+async def api_scrape(request):
+    """API endpoint for scraping"""
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            url = data.get('url')
+
+            if not url:
+                return JsonResponse({'error': 'URL is required'}, status=400)
+
+            try:
+                fields = parse_fields(data.get('fields'))
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+            # Queue the job for the scrape workers and return immediately
+            if data.get('async'):
+                job_id = await sync_to_async(JobQueue().enqueue, thread_sensitive=False)(url, fields)
+                return JsonResponse({
+                    'success': True,
+                    'id': job_id,
+                    'status': 'pending',
+                    'status_url': reverse('scraper:job_status', kwargs={'pk': job_id})
+                }, status=202)
+
+            # Scrape and save, or reuse a recent or in-flight scrape of the same page
+            mongo_client = AsyncMongoDBClient()
+            document_id, scraped_content, error, reused = await async_scrape_url(url, mongo_client, fields)
+
+            if error:
+                return JsonResponse({'error': error}, status=400)
+            if scraped_content is None:
+                # Fresh enough copy already stored; only the requested fields are read
+                scraped_content = await mongo_client.get_scraped_content(document_id, stored_fields(fields))
+
+            return JsonResponse({
+                'success': True,
+                'id': document_id,
+                'reused': reused,
+                'data': scraped_content
+            })
+
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+async def api_scrape_batch(request):
+    """Batch scrape for ASGI, streaming one JSON line per result.
+
+    The lines come from a blocking iterator; Bloger.asgi's handler produces
+    each one on a worker thread, so the event loop is never held up.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    batch, error_response = batch_from_request(request)
+    if error_response:
+        return error_response
+    return StreamingHttpResponse(batch.iter_ndjson(), content_type='application/x-ndjson')
@@ -0,0 +1,79 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bson import ObjectId
+from django.core.serializers.json import DjangoJSONEncoder
+from pymongo.errors import PyMongoError
+from .politeness import HostQueue
+from .utils import WebScraper
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScrape:
+    """Scrapes a list of URLs concurrently, yielding each result as it finishes.
+
+    At most `concurrency` pages are fetched at once on the shared HTTP client.
+    Documents are written with MongoDBClient.save_many every `batch_size`
+    results; their ids are assigned up front so each record can reference
+    its document straight away.
+    """
+
+    def __init__(self, urls, concurrency, mongo_client, batch_size=50):
+        self.urls = urls
+        self.concurrency = max(1, concurrency)
+        self.mongo_client = mongo_client
+        self.batch_size = max(1, batch_size)
+        self.pending_documents = []
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(self.concurrency)
+        try:
+            # Submitted with hosts taking turns, so one slow host doesn't hold every worker
+            futures = [executor.submit(self.scrape, url) for url in HostQueue(self.urls)]
+            for future in as_completed(futures):
+                url, data, error = future.result()
+                yield self.record(url, data, error)
+        finally:
+            # Also runs when the client goes away mid-stream
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.flush()
+
+    def iter_ndjson(self):
+        """Results as newline-delimited JSON lines"""
+        for record in self:
+            yield json.dumps(record, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+    def scrape(self, url):
+        data, error = WebScraper(url).scrape()
+        return url, data, error
+
+    def record(self, url, data, error):
+        """Queue the document for saving and return the record sent to the client"""
+        if error:
+            document = self.mongo_client.build_document(url, {}, status='error', error_message=error)
+        else:
+            document = self.mongo_client.build_document(url, data, status='success')
+        document['_id'] = ObjectId()
+        # Near-duplicates are resolved here so the id sent is the one stored
+        original_id = self.mongo_client.skip_duplicate(document, pending=self.pending_documents)
+        if original_id:
+            return {'url': url, 'success': True, 'id': original_id, 'duplicate': True, 'data': data}
+        self.pending_documents.append(document)
+        if len(self.pending_documents) >= self.batch_size:
+            self.flush()
+
+        if error:
+            return {'url': url, 'success': False, 'id': str(document['_id']), 'error': error}
+        return {'url': url, 'success': True, 'id': str(document['_id']), 'data': data}
+
+    def flush(self):
+        if not self.pending_documents:
+            return
+        try:
+            self.mongo_client.save_many(self.pending_documents)
+        except PyMongoError as e:
+            # BulkWriteError included; the rest of the batch is still written
+            logger.error('Could not save %d batch results: %s', len(self.pending_documents), e)
+        self.pending_documents = []
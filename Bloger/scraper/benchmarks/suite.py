@@ -0,0 +1,227 @@
+import json
+import os
+import platform
+import statistics
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+import bs4
+from ..extraction import EXTRACTION_MODES, ExtractionEngine
+from ..mongodb_client import MongoDBClient
+from ..selector_profiles import SelectorProfiles
+from ..utils import WebScraper
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+REPORT_VERSION = 1
+
+# WebScraper methods timed on every fixture, each given the parsed page
+EXTRACTION_METHODS = (
+    'extract_main_content',
+    'extract_clean_paragraphs',
+    'extract_headings',
+    'count_words',
+)
+
+
+def load_fixtures(directory=FIXTURES_DIR):
+    """Saved pages keyed by file name without the extension"""
+    fixtures = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.html'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                fixtures[name[:-len('.html')]] = f.read()
+    return fixtures
+
+
+def load_expected(directory=FIXTURES_DIR):
+    """Hand-labelled main content of the fixtures, from expected.json.
+
+    Each entry names the CSS selector of the page's real content and
+    selectors of boilerplate inside it to leave out.
+    """
+    path = os.path.join(directory, 'expected.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def expected_text(content, spec):
+    soup = bs4.BeautifulSoup(content, 'html.parser')
+    root = soup.select_one(spec['content'])
+    for selector in spec.get('exclude', ()):
+        for tag in root.select(selector):
+            tag.decompose()
+    return root.get_text(' ')
+
+
+def text_accuracy(extracted, expected):
+    """Word-level precision, recall and F1 of extracted text against the labelled content"""
+    found = Counter(extracted.lower().split())
+    wanted = Counter(expected.lower().split())
+    overlap = sum((found & wanted).values())
+    precision = overlap / sum(found.values()) if found else 0.0
+    recall = overlap / sum(wanted.values()) if wanted else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'precision': round(precision, 4), 'recall': round(recall, 4), 'f1': round(f1, 4)}
+
+
+def time_call(func, repeat):
+    """Run func repeat times; min and median wall time in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {'min_ms': round(min(timings), 4), 'median_ms': round(statistics.median(timings), 4)}
+
+
+def peak_memory(func):
+    """Peak bytes allocated while func runs"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_page(content, repeat, parser=None, expected=None):
+    scraper = WebScraper('https://example.com/benchmark', parser=parser, use_cache=False)
+    soup = scraper.engine.parse(content)
+    # Candidate texts is_likely_navigation is asked about while walking a page
+    texts = [tag.get_text().strip() for tag in soup.find_all(['p', 'li', 'a'])]
+
+    methods = {'parse': time_call(lambda: scraper.engine.parse(content), repeat)}
+    for name in EXTRACTION_METHODS:
+        method = getattr(scraper, name)
+        methods[name] = time_call(lambda: method(soup), repeat)
+    methods['is_likely_navigation'] = time_call(
+        lambda: [scraper.is_likely_navigation(text) for text in texts], repeat)
+    # Repeat visits to a site, with the main content selector already learned
+    profiled = WebScraper('https://example.com/benchmark', parser=parser, use_cache=False)
+    profiled.engine.profiles = SelectorProfiles()
+    profiled.extract_main_content(soup)
+    methods['extract_main_content_profiled'] = time_call(lambda: profiled.extract_main_content(soup), repeat)
+    # Every field, with each extraction mode
+    engines = {mode: ExtractionEngine(parser, scraper.is_likely_navigation, mode=mode) for mode in EXTRACTION_MODES}
+    for mode, engine in engines.items():
+        methods[f'extract_{mode}'] = time_call(lambda: engine.extract(soup), repeat)
+    methods['scrape_total'] = time_call(lambda: scraper.parse(content), repeat)
+
+    result = {
+        'size_bytes': len(content),
+        'navigation_checks': len(texts),
+        'peak_memory_bytes': peak_memory(lambda: scraper.parse(content)),
+        'methods': methods,
+    }
+    if expected:
+        wanted = expected_text(content, expected)
+        result['accuracy'] = {mode: text_accuracy(engine.main_content(soup), wanted)
+                              for mode, engine in engines.items()}
+    return result
+
+
+def benchmark_extraction(fixtures, repeat, parser=None, expected=None):
+    expected = expected or {}
+    return {name: benchmark_page(content, repeat, parser, expected.get(name)) for name, content in fixtures.items()}
+
+
+def benchmark_storage(fixtures, repeat, mongodb_uri=None):
+    """Save and read timings for MongoDBClient.
+
+    Runs against mongodb_uri when given, otherwise an in-memory mongomock
+    database. Returns None when neither is available.
+    """
+    if mongodb_uri:
+        from pymongo import MongoClient
+        backend = 'mongodb'
+        connection = MongoClient(mongodb_uri, serverSelectionTimeoutMS=5000)
+    elif mongomock is not None:
+        backend = 'mongomock'
+        connection = mongomock.MongoClient()
+    else:
+        return None
+
+    db = connection['scraper_benchmark']
+    connection.drop_database(db.name)
+    try:
+        client = MongoDBClient.for_database(db)
+        results = {'backend': backend, 'pages': {}}
+        for name, content in fixtures.items():
+            data = WebScraper(f'https://example.com/{name}', use_cache=False).parse(content)
+            document_ids = []
+
+            def save():
+                document_ids.append(client.save_scraped_data(data['url'], data))
+
+            timings = {'save': time_call(save, repeat)}
+            document_id = document_ids[-1]
+            timings['read'] = time_call(lambda: dict(client.get_scraped_data(document_id)['json_content'].items()), repeat)
+            timings['read_fields'] = time_call(lambda: client.get_scraped_content(document_id, ['title', 'headings']), repeat)
+            batch = [client.build_document(data['url'], data) for _ in range(10)]
+            timings['save_many_10'] = time_call(lambda: client.save_many([dict(document) for document in batch]), repeat)
+            results['pages'][name] = timings
+        results['recent_scrapes'] = time_call(lambda: client.get_recent_scrapes(10), repeat)
+        return results
+    finally:
+        connection.drop_database(db.name)
+
+
+def run_benchmarks(repeat=20, parser=None, mongodb_uri=None, storage=True, fixtures=None, expected=None):
+    """Full report as a JSON-serializable dict"""
+    fixtures = fixtures or load_fixtures()
+    expected = load_expected() if expected is None else expected
+    scraper = WebScraper('https://example.com/', parser=parser, use_cache=False)
+    return {
+        'version': REPORT_VERSION,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'parser': scraper.engine.parser,
+            'beautifulsoup': bs4.__version__,
+        },
+        'repeat': repeat,
+        'extraction': benchmark_extraction(fixtures, repeat, parser, expected),
+        'storage': benchmark_storage(fixtures, repeat, mongodb_uri) if storage else None,
+    }
+
+
+def iter_timings(report):
+    """(key, median_ms) for every timing in a report"""
+    for page, result in report.get('extraction', {}).items():
+        for method, timing in result['methods'].items():
+            yield f'extraction.{page}.{method}', timing['median_ms']
+    storage = report.get('storage') or {}
+    for page, timings in storage.get('pages', {}).items():
+        for operation, timing in timings.items():
+            yield f'storage.{page}.{operation}', timing['median_ms']
+    if 'recent_scrapes' in storage:
+        yield 'storage.recent_scrapes', storage['recent_scrapes']['median_ms']
+
+
+def compare_reports(baseline, current, threshold=0.2, min_ms=0.05):
+    """Timings that got more than threshold slower than in baseline.
+
+    Timings under min_ms in both reports are ignored as noise. Returns a
+    list of (key, baseline_ms, current_ms, change) sorted by change.
+    """
+    before = dict(iter_timings(baseline))
+    regressions = []
+    for key, after in iter_timings(current):
+        if key not in before or max(before[key], after) < min_ms or not before[key]:
+            continue
+        change = after / before[key] - 1
+        if change > threshold:
+            regressions.append((key, before[key], after, change))
+    return sorted(regressions, key=lambda regression: regression[3], reverse=True)
@@ -0,0 +1,50 @@
+import hashlib
+import math
+
+from bson import Binary
+
+
+class BloomFilter:
+    """Compact set of strings for membership tests.
+
+    Never reports a stored item as missing; an item that was never added is
+    reported present with probability error_rate. At the default rate it
+    needs under 2 bytes per item however long the URLs are.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, capacity)
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """Add item; returns False if it was (probably) already present"""
+        added = False
+        for position in self._positions(item):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & mask:
+                self.bits[byte] |= mask
+                added = True
+        return added
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def to_document(self):
+        return {'num_bits': self.num_bits, 'num_hashes': self.num_hashes, 'bits': Binary(bytes(self.bits))}
+
+    @classmethod
+    def from_document(cls, document):
+        bloom = cls.__new__(cls)
+        bloom.num_bits = document['num_bits']
+        bloom.num_hashes = document['num_hashes']
+        bloom.bits = bytearray(document['bits'])
+        return bloom
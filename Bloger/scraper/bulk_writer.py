@@ -0,0 +1,207 @@
+import atexit
+import logging
+import threading
+import time
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.write_concern import WriteConcern
+from .metrics import Counter, record_error
+from .mongo_pool import parse_write_concern
+
+logger = logging.getLogger(__name__)
+
+BUFFERED_DOCUMENTS = Counter(
+    'scraper_buffered_documents_total', 'Documents written by the buffered writer by outcome', ['result'])
+
+DUPLICATE_KEY = 11000
+
+# Longest wait between attempts while MongoDB is unreachable, in seconds
+MAX_BACKOFF = 30
+
+
+class BufferFull(PyMongoError):
+    """The buffer stayed full for max_wait seconds, usually because MongoDB is unreachable"""
+
+
+class BulkWriter:
+    """Buffers scrape documents and writes them as unordered insert_many batches.
+
+    A batch is written once batch_size documents are waiting (by the thread
+    that adds the last one) or every flush_interval seconds (by a background
+    thread), and on close(), which also runs at interpreter exit. Documents
+    get their _id when added, so callers have an id straight away; the
+    document becomes readable when its batch is written.
+
+    Documents rejected with a write error are retried one at a time, up to
+    `retries` times with backoff. When the whole batch fails (connection
+    lost, no server available) it goes back to the front of the buffer and
+    the timer waits longer after each failure in a row; on the next attempt
+    duplicate key errors mark the documents the failed batch had written
+    after all. At most max_pending documents are buffered: add() waits up to
+    max_wait seconds for room and then raises BufferFull.
+    """
+
+    def __init__(self, mongo_client, batch_size=100, flush_interval=1.0, write_concern=None, retries=3,
+                 max_pending=None, max_wait=30.0):
+        self.mongo_client = mongo_client
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.write_concern = write_concern
+        self.retries = max(0, retries)
+        self.max_pending = max(self.batch_size, max_pending or self.batch_size * 10)
+        self.max_wait = max_wait
+        self.documents = []
+        # Batch currently being inserted
+        self.writing = []
+        self.lock = threading.Lock()
+        # Signalled when a write frees room in the buffer
+        self.room = threading.Condition(self.lock)
+        # Held from taking a batch until it is written, so flush() returning
+        # means every document added before the call has been tried once
+        self.write_lock = threading.Lock()
+        # Whole-batch failures in a row, and when the timer may try again
+        self.failures = 0
+        self.retry_at = 0
+        self.closed = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='scraper-bulk-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_settings(cls, mongo_client):
+        write_concern = getattr(settings, 'SCRAPER_BULK_WRITE_CONCERN', '')
+        write_timeout = getattr(settings, 'SCRAPER_MONGO_WRITE_TIMEOUT_MS', 0)
+        return cls(
+            mongo_client,
+            batch_size=getattr(settings, 'SCRAPER_BULK_BATCH_SIZE', 100),
+            flush_interval=getattr(settings, 'SCRAPER_BULK_FLUSH_INTERVAL', 1.0),
+            # Empty means the connection's write concern
+            write_concern=WriteConcern(w=parse_write_concern(write_concern), wtimeout=write_timeout or None)
+            if write_concern else None,
+            retries=getattr(settings, 'SCRAPER_BULK_RETRIES', 3),
+            max_pending=getattr(settings, 'SCRAPER_BULK_MAX_PENDING', 1000),
+            max_wait=getattr(settings, 'SCRAPER_BULK_MAX_WAIT', 30.0),
+        )
+
+    def add(self, document):
+        """Queue a document built with build_document; returns its id"""
+        document.setdefault('_id', ObjectId())
+        with self.room:
+            if not self.room.wait_for(lambda: len(self.documents) < self.max_pending, self.max_wait):
+                raise BufferFull(f'{len(self.documents)} documents are waiting to be written')
+            self.documents.append(document)
+            full = len(self.documents) >= self.batch_size
+        # While backing off the timer retries; adders don't each wait on a dead server
+        if full and time.monotonic() >= self.retry_at:
+            self.flush()
+        return str(document['_id'])
+
+    def pending(self):
+        """Documents added but not written yet"""
+        with self.lock:
+            return self.writing + self.documents
+
+    def run(self):
+        while not self.closed.wait(self.flush_interval):
+            if time.monotonic() < self.retry_at:
+                continue
+            try:
+                self.flush()
+            except Exception:
+                # Keep the timer alive; the documents were logged as failed
+                logger.exception('Buffered write failed')
+
+    def flush(self):
+        """Try once to write every waiting document, waiting for a batch another thread is writing"""
+        with self.write_lock:
+            with self.lock:
+                documents, self.documents = self.documents, []
+                self.writing = documents
+            requeued = []
+            try:
+                if documents:
+                    requeued = self.write(documents)
+            finally:
+                with self.room:
+                    self.writing = []
+                    # Ahead of anything added meanwhile, so order is kept
+                    self.documents[:0] = requeued
+                    self.room.notify_all()
+
+    def close(self):
+        """Stop the timer and write what is left"""
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
+        self.flush()
+        if self.documents:
+            BUFFERED_DOCUMENTS.inc(len(self.documents), result='failed')
+            logger.error('Could not save %d buffered documents before exit', len(self.documents))
+
+    def collection(self):
+        collection = self.mongo_client.collection
+        if self.write_concern is not None:
+            collection = collection.with_options(write_concern=self.write_concern)
+        return collection
+
+    def write(self, documents):
+        """Insert a batch; returns the documents to try again later"""
+        try:
+            with self.mongo_client.timed_operation('mongo_write', 'insert_many', len(documents)):
+                self.collection().insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            failed = [documents[error['index']] for error in errors if error.get('code') != DUPLICATE_KEY]
+            if e.details.get('writeConcernErrors'):
+                # Written, but not acknowledged by as many nodes as asked for
+                logger.warning('Write concern not met for %d buffered documents', len(documents) - len(errors))
+        except PyMongoError as e:
+            return self.back_off(documents, e)
+        else:
+            failed = []
+        self.failures = 0
+        self.retry_at = 0
+        BUFFERED_DOCUMENTS.inc(len(documents) - len(failed), result='written')
+        for position, document in enumerate(failed):
+            try:
+                self.retry(document)
+            except PyMongoError as e:
+                return self.back_off(failed[position:], e)
+        return []
+
+    def back_off(self, documents, error):
+        """Keep documents for a later attempt after the server could not be reached"""
+        self.failures += 1
+        delay = min(self.flush_interval * 2 ** self.failures, MAX_BACKOFF)
+        self.retry_at = time.monotonic() + delay
+        record_error('mongo', error)
+        BUFFERED_DOCUMENTS.inc(len(documents), result='requeued')
+        logger.warning('Buffered batch of %d documents failed, trying again in %.1fs: %s',
+                       len(documents), delay, error)
+        return documents
+
+    def retry(self, document):
+        """Insert one document the server rejected in a batch; connection errors are raised"""
+        error = None
+        for attempt in range(self.retries):
+            try:
+                self.collection().insert_one(document)
+                BUFFERED_DOCUMENTS.inc(result='retried')
+                return True
+            except DuplicateKeyError:
+                BUFFERED_DOCUMENTS.inc(result='written')
+                return True
+            except OperationFailure as e:
+                error = e
+                time.sleep(min(0.1 * 2 ** attempt, 1))
+        BUFFERED_DOCUMENTS.inc(result='failed')
+        if error is not None:
+            # Rejected by the server, so its GridFS files are unreferenced
+            self.mongo_client.discard_document(document)
+            record_error('mongo', error)
+        logger.error('Could not save buffered document %s for %s: %s', document['_id'], document.get('url'), error)
+        return False
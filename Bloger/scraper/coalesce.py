@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+from .async_scraper import AsyncWebScraper
+from .extraction import parse_fields
+from .http_client import get_setting
+from .url_utils import normalize_url
+from .utils import WebScraper
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers share its result.
+
+    The first caller for a key runs the function, later callers with the
+    same key block until it finishes and get the same return value (or
+    exception). Works across the threads of one process.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        """Returns (result, shared); shared is True for callers that waited on another's call"""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            call['done'].wait()
+        else:
+            try:
+                call['result'] = func()
+            except BaseException as e:
+                call['error'] = e
+            finally:
+                with self.lock:
+                    del self.calls[key]
+                call['done'].set()
+
+        if call['error'] is not None:
+            raise call['error']
+        return call['result'], not leader
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop"""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func):
+        task = self.calls.get(key)
+        if task is not None:
+            # shield: one waiter giving up must not cancel the others' scrape
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(func())
+        self.calls[key] = task
+        task.add_done_callback(lambda _: self.calls.pop(key, None))
+        return await asyncio.shield(task), False
+
+
+_flights = SingleFlight()
+_async_flights = AsyncSingleFlight()
+
+
+def freshness_window():
+    """Seconds a successful scrape is reused for instead of fetching the URL again"""
+    return get_setting('SCRAPER_FRESHNESS_WINDOW', 300)
+
+
+def stored_fields(fields):
+    """Keys of a saved result to read back for a request of fields"""
+    return ('url',) + tuple(fields) + ('truncated', 'scraped_at')
+
+
+def scrape_url(url, mongo_client, fields=None):
+    """Scrape url and save the result, sharing work with identical requests.
+
+    Returns (document_id, data, error, reused). A success from the last
+    freshness_window() seconds that has all the requested fields is
+    returned as is (reused=True, data=None); otherwise concurrent requests
+    for the same normalized URL and fields wait for a single fetch and one
+    saved document. Failed scrapes are not saved.
+    """
+    fields = parse_fields(fields)
+
+    def scrape():
+        window = freshness_window()
+        if window:
+            document_id = mongo_client.find_fresh(url, window, fields)
+            if document_id:
+                return document_id, None, None, True
+
+        data, error = WebScraper(url, fields=fields).scrape()
+        if error:
+            return None, None, error, False
+        document_id = mongo_client.save_scraped_data(url=url, data_dict=data, status='success')
+        return document_id, data, None, False
+
+    (document_id, data, error, reused), shared = _flights.do((normalize_url(url), fields), scrape)
+    return document_id, data, error, reused or shared
+
+
+async def async_scrape_url(url, mongo_client, fields=None):
+    """scrape_url for async views; mongo_client is an AsyncMongoDBClient"""
+    fields = parse_fields(fields)
+
+    async def scrape():
+        window = freshness_window()
+        if window:
+            document_id = await mongo_client.find_fresh(url, window, fields)
+            if document_id:
+                return document_id, None, None, True
+
+        data, error = await AsyncWebScraper(url, fields=fields).scrape()
+        if error:
+            return None, None, error, False
+        document_id = await mongo_client.save_scraped_data(url=url, data_dict=data, status='success')
+        return document_id, data, None, False
+
+    (document_id, data, error, reused), shared = await _async_flights.do((normalize_url(url), fields), scrape)
+    return document_id, data, error, reused or shared
@@ -0,0 +1,231 @@
+import hashlib
+import io
+import json
+import zlib
+
+import bson
+import gridfs
+from bson import Binary
+from django.conf import settings
+
+# Fields that grow with the page and are worth compressing
+LARGE_FIELDS = ('main_content', 'paragraphs')
+
+CODEC = 'zlib'
+
+# Bytes read per step when streaming compressed fields
+CHUNK_SIZE = 64 * 1024
+
+
+def _encode(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False).encode('utf-8'))
+
+
+def _decode(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+def _sources(blobs):
+    # Field name -> inline compressed bytes or GridFS file id
+    return blobs.get('data') or blobs.get('gridfs_ids') or {}
+
+
+def content_hash(content, blobs=None):
+    """Hash of a document's stored content, cheap enough to compute on every write"""
+    digest = hashlib.sha1()
+    if isinstance(content, str):
+        digest.update(content.encode('utf-8'))
+    else:
+        digest.update(bson.encode(content or {}))
+    if blobs:
+        for name, source in sorted(_sources(blobs).items()):
+            digest.update(name.encode('utf-8'))
+            # GridFS files are never rewritten, so the id identifies the body
+            digest.update(source if isinstance(source, bytes) else str(source).encode('ascii'))
+    return digest.hexdigest()
+
+
+class LazyScrapedContent(dict):
+    """Scraped content whose compressed fields are only decoded when read.
+
+    Behaves like the plain dict stored for small pages. Keys are known up
+    front; values of compressed fields are decompressed (or fetched from
+    GridFS) the first time they are accessed.
+    """
+
+    def __init__(self, content, pending, loader):
+        super().__init__(content)
+        self._pending = set(pending)
+        self._loader = loader
+
+    def _load(self, names):
+        names = [name for name in names if name in self._pending]
+        if not names:
+            return
+        for name, value in self._loader(names).items():
+            dict.__setitem__(self, name, value)
+        self._pending.difference_update(names)
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            self._load([key])
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __contains__(self, key):
+        return key in self._pending or super().__contains__(key)
+
+    def __iter__(self):
+        yield from super().__iter__()
+        yield from list(self._pending)
+
+    def __len__(self):
+        return super().__len__() + len(self._pending)
+
+    def keys(self):
+        return list(self)
+
+    def items(self):
+        self._load(list(self._pending))
+        return super().items()
+
+    def values(self):
+        self._load(list(self._pending))
+        return super().values()
+
+    def __eq__(self, other):
+        self._load(list(self._pending))
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def copy(self):
+        self._load(list(self._pending))
+        return dict(self)
+
+    def __repr__(self):
+        self._load(list(self._pending))
+        return super().__repr__()
+
+
+class ContentStorage:
+    """Transparent compression for large scraped documents.
+
+    main_content and paragraphs larger than compress_threshold bytes are
+    stored zlib-compressed in the document's content_blobs field. If the
+    compressed fields together exceed gridfs_threshold they are written to
+    GridFS instead (one file per field) and the document keeps references,
+    keeping documents far from the 16 MB BSON limit.
+    """
+
+    def __init__(self, db, compress_threshold=None, gridfs_threshold=None):
+        self.db = db
+        self.compress_threshold = compress_threshold or getattr(
+            settings, 'SCRAPER_COMPRESS_THRESHOLD', 16 * 1024)
+        self.gridfs_threshold = gridfs_threshold or getattr(
+            settings, 'SCRAPER_GRIDFS_THRESHOLD', 4 * 1024 * 1024)
+        self._fs = None
+
+    @property
+    def fs(self):
+        if self._fs is None:
+            self._fs = gridfs.GridFS(self.db, collection='scraped_content_fs')
+        return self._fs
+
+    def pack(self, data_dict):
+        """Split data_dict into the stored content and compressed blobs (or None)"""
+        content = dict(data_dict)
+        encoded = {}
+        for name in LARGE_FIELDS:
+            value = content.get(name)
+            if value and self._size(value) > self.compress_threshold:
+                encoded[name] = _encode(content.pop(name))
+
+        if not encoded:
+            return content, None
+
+        if sum(len(blob) for blob in encoded.values()) > self.gridfs_threshold:
+            file_ids = {name: self.fs.put(blob) for name, blob in encoded.items()}
+            return content, {'codec': CODEC, 'fields': sorted(encoded), 'gridfs_ids': file_ids}
+
+        return content, {
+            'codec': CODEC,
+            'fields': sorted(encoded),
+            'data': {name: Binary(blob) for name, blob in encoded.items()},
+        }
+
+    def unpack(self, content, blobs):
+        """Content dict with compressed fields decoded on first access"""
+        if not blobs:
+            return content
+
+        sources = _sources(blobs)
+
+        def loader(names):
+            return {name: _decode(self._open(blobs, name).read()) for name in names if name in sources}
+
+        # Fields left out by a projection are not offered
+        pending = [name for name in blobs.get('fields', []) if name in sources]
+        return LazyScrapedContent(content, pending, loader)
+
+    def iter_json(self, content, blobs=None, indent=2):
+        """Serialize stored content as UTF-8 JSON chunks without building the whole string.
+
+        Compressed fields already hold JSON, so they are decompressed straight
+        into the output instead of being parsed and encoded again.
+        """
+        if isinstance(content, str):
+            # Legacy documents store the JSON text itself
+            body = content.encode('utf-8')
+            for start in range(0, len(body), CHUNK_SIZE):
+                yield body[start:start + CHUNK_SIZE]
+            return
+
+        content = content or {}
+        sources = _sources(blobs) if blobs else {}
+        compressed = [name for name in blobs.get('fields', []) if name in sources] if blobs else []
+        names = list(content) + compressed
+        if not names:
+            yield b'{}'
+            return
+
+        encoder = json.JSONEncoder(indent=indent, ensure_ascii=False)
+        newline = '\n' + ' ' * indent
+        for position, name in enumerate(names):
+            key = json.dumps(name, ensure_ascii=False)
+            yield f'{"{" if position == 0 else ","}{newline}{key}: '.encode('utf-8')
+            if name in content:
+                # Raw newlines only come from indentation, so nest them one level
+                for chunk in encoder.iterencode(content[name]):
+                    yield chunk.replace('\n', newline).encode('utf-8')
+            else:
+                yield from self._iter_decompressed(self._open(blobs, name))
+        yield b'\n}'
+
+    def delete(self, blobs):
+        """Remove the GridFS files referenced by a document's blobs"""
+        if blobs:
+            for file_id in blobs.get('gridfs_ids', {}).values():
+                self.fs.delete(file_id)
+
+    def _open(self, blobs, name):
+        if 'gridfs_ids' in blobs:
+            return self.fs.get(blobs['gridfs_ids'][name])
+        return io.BytesIO(blobs['data'][name])
+
+    @staticmethod
+    def _iter_decompressed(stream):
+        decompressor = zlib.decompressobj()
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        yield decompressor.flush()
+
+    @staticmethod
+    def _size(value):
+        if isinstance(value, str):
+            return len(value)
+        return sum(len(item) for item in value if isinstance(item, str))
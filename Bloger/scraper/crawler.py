@@ -0,0 +1,267 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import requests
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+from .bloom import BloomFilter
+from .http_client import UnsupportedContentType
+from .mongodb_client import MongoDBClient
+from .url_utils import normalize_url
+from .utils import WebScraper, mark_truncated
+
+# Crawl lifecycle: running -> finished (frontier exhausted) or limited (page budget
+# spent). Interrupted crawls stay running; all but finished ones can be resumed.
+RUNNING = 'running'
+FINISHED = 'finished'
+LIMITED = 'limited'
+
+# Frontier entries: pending -> claimed -> done / failed / skipped
+PENDING = 'pending'
+CLAIMED = 'claimed'
+
+# Links to files that are never HTML pages
+SKIP_EXTENSIONS = {
+    '.pdf', '.zip', '.gz', '.tar', '.rar', '.7z', '.exe', '.dmg', '.iso',
+    '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico', '.bmp',
+    '.mp3', '.mp4', '.avi', '.mov', '.webm', '.css', '.js', '.json', '.xml',
+}
+
+# Seen-set size per page in the budget; pages link to many more URLs than get crawled
+LINKS_PER_PAGE = 20
+
+
+def seen_capacity(max_pages):
+    """URLs the seen set of a crawl with a budget of max_pages is sized for"""
+    return max(10000, max_pages * LINKS_PER_PAGE)
+
+
+class SiteCrawler:
+    """Breadth-first crawl of a single site, resumable after a restart.
+
+    The frontier is stored in the crawl_frontier collection and claimed in
+    (depth, _id) order, so pages are visited level by level. URLs already
+    queued are tracked in a Bloom filter saved with the crawl; the unique
+    (crawl_id, url) index backs it up, so a URL is never queued twice.
+    """
+
+    def __init__(self, crawl, mongo_client=None):
+        self.mongo_client = mongo_client or MongoDBClient()
+        self.crawls = self.mongo_client.db['crawls']
+        self.frontier = self.mongo_client.db['crawl_frontier']
+        self.crawl = crawl
+        self.crawl_id = crawl['_id']
+        self.host = urlsplit(crawl['seed']).hostname
+        self.seen = BloomFilter.from_document(crawl['seen'])
+
+    @classmethod
+    def create(cls, seed, max_depth, max_pages, path_prefix='', mongo_client=None):
+        """Start a new crawl from seed"""
+        mongo_client = mongo_client or MongoDBClient()
+        seed = normalize_url(seed)
+        crawl = {
+            '_id': ObjectId(),
+            'seed': seed,
+            'max_depth': max_depth,
+            'max_pages': max_pages,
+            'path_prefix': path_prefix or '',
+            'status': RUNNING,
+            'pages': 0,
+            'failed': 0,
+            'created_at': datetime.now(),
+            'seen': BloomFilter(seen_capacity(max_pages)).to_document(),
+        }
+        mongo_client.db['crawls'].insert_one(crawl)
+        crawler = cls(crawl, mongo_client)
+        crawler.ensure_indexes()
+        crawler.discover([seed], 0)
+        return crawler
+
+    @classmethod
+    def load(cls, crawl_id, mongo_client=None):
+        """Resume a crawl, or None if there is no such crawl"""
+        mongo_client = mongo_client or MongoDBClient()
+        try:
+            crawl = mongo_client.db['crawls'].find_one({'_id': ObjectId(crawl_id)})
+        except Exception:
+            return None
+        if not crawl:
+            return None
+        crawler = cls(crawl, mongo_client)
+        crawler.ensure_indexes()
+        # Pages that were in flight when the previous run stopped
+        crawler.frontier.update_many(
+            {'crawl_id': crawler.crawl_id, 'status': CLAIMED},
+            {'$set': {'status': PENDING}}
+        )
+        return crawler
+
+    def ensure_indexes(self):
+        self.frontier.create_index([('crawl_id', ASCENDING), ('url', ASCENDING)], unique=True)
+        # Next page to crawl: shallowest first, then in discovery order
+        self.frontier.create_index([('crawl_id', ASCENDING), ('status', ASCENDING),
+                                    ('depth', ASCENDING), ('_id', ASCENDING)])
+
+    def in_scope(self, url):
+        """Same host, under the path prefix, and not an obvious non-HTML file"""
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or parts.hostname != self.host:
+            return False
+        if not parts.path.startswith(self.crawl['path_prefix'] or '/'):
+            return False
+        return os.path.splitext(parts.path)[1].lower() not in SKIP_EXTENSIONS
+
+    def discover(self, urls, depth):
+        """Queue the in-scope URLs that haven't been seen; returns how many were new"""
+        entries = []
+        for url in urls:
+            url = normalize_url(url)
+            if self.in_scope(url) and self.seen.add(url):
+                entries.append({'crawl_id': self.crawl_id, 'url': url, 'depth': depth, 'status': PENDING})
+        if not entries:
+            return 0
+        try:
+            self.frontier.insert_many(entries, ordered=False)
+            return len(entries)
+        except BulkWriteError as e:
+            # Duplicates queued before a restart; the unique index rejects them
+            return e.details.get('nInserted', 0)
+
+    def claim(self):
+        """Take the next page to crawl, or None if the frontier is empty"""
+        return self.frontier.find_one_and_update(
+            {'crawl_id': self.crawl_id, 'status': PENDING},
+            {'$set': {'status': CLAIMED}},
+            sort=[('depth', ASCENDING), ('_id', ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def fetch(self, entry):
+        """Download and extract one page; returns (entry, data, error, links)"""
+        scraper = WebScraper(entry['url'])
+        try:
+            response = scraper.request()
+            response.raise_for_status()
+            if 'html' not in response.headers.get('Content-Type', 'text/html'):
+                return entry, None, None, []
+
+            soup = scraper.engine.parse(response.content, response.declared_encoding)
+            data = mark_truncated(scraper.extract_data(soup), response)
+            scraper.remember(response, data)
+            # Resolve relative links against the final URL after redirects
+            scraper.url = response.url
+            links = [link['absolute_url'] for link in scraper.extract_links(soup)]
+            return entry, data, None, links
+        except UnsupportedContentType:
+            return entry, None, None, []
+        except requests.exceptions.RequestException as e:
+            return entry, None, f"Request error: {str(e)}", []
+        except Exception as e:
+            return entry, None, f"Scraping error: {str(e)}", []
+
+    def run(self, workers=8, batch_size=50, on_page=None):
+        """Crawl until the frontier is empty or the page budget is spent.
+
+        on_page(url, depth, error) is called after each page. Returns the
+        updated crawl document.
+        """
+        max_depth = self.crawl['max_depth']
+        stats = {'pages': 0, 'failed': 0}
+        documents = []
+        # Frontier entry ids by their final status, set once their documents are saved
+        finished = {}
+        stopped = False
+
+        def flush():
+            if documents:
+                self.mongo_client.save_many(documents)
+                documents.clear()
+            # Only now, so pages lost in a crash stay claimed and are crawled again on resume
+            for status, ids in finished.items():
+                self.frontier.update_many({'_id': {'$in': ids}}, {'$set': {'status': status}})
+            finished.clear()
+            self.save_state(stats)
+
+        def remaining():
+            return self.crawl['max_pages'] - self.crawl['pages'] - stats['pages']
+
+        try:
+            with ThreadPoolExecutor(workers) as fetchers:
+                in_flight = set()
+                while True:
+                    while len(in_flight) < workers and len(in_flight) < remaining():
+                        entry = self.claim()
+                        if entry is None:
+                            break
+                        in_flight.add(fetchers.submit(self.fetch, entry))
+                    if not in_flight:
+                        stopped = True
+                        break
+
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        entry, data, error, links = future.result()
+                        if error:
+                            status = 'failed'
+                            stats['failed'] += 1
+                            documents.append(self.build_document(entry, {}, 'error', error))
+                        elif data is None:
+                            status = 'skipped'
+                        else:
+                            status = 'done'
+                            documents.append(self.build_document(entry, data, 'success'))
+                        if status != 'skipped':
+                            stats['pages'] += 1
+                        if entry['depth'] < max_depth:
+                            self.discover(links, entry['depth'] + 1)
+                        finished.setdefault(status, []).append(entry['_id'])
+                        if on_page:
+                            on_page(entry['url'], entry['depth'], error)
+
+                    if len(documents) >= batch_size:
+                        flush()
+        finally:
+            # Keep what was crawled if the run is interrupted
+            flush()
+
+        if stopped:
+            self.crawl['status'] = LIMITED if self.pending() else FINISHED
+            self.crawls.update_one({'_id': self.crawl_id}, {'$set': {
+                'status': self.crawl['status'], 'stopped_at': datetime.now()}})
+        return self.crawl
+
+    def extend(self, max_pages):
+        """Raise the page budget of a resumed crawl, growing the seen set to match"""
+        self.crawl['max_pages'] = max_pages
+        self.crawl['status'] = RUNNING
+        update = {'max_pages': max_pages, 'status': RUNNING}
+        seen = BloomFilter(seen_capacity(max_pages))
+        if seen.num_bits > self.seen.num_bits:
+            # A Bloom filter can't be resized; every queued URL is in the frontier
+            for entry in self.frontier.find({'crawl_id': self.crawl_id}, {'url': 1}):
+                seen.add(entry['url'])
+            self.seen = seen
+            self.crawl['seen'] = update['seen'] = seen.to_document()
+        self.crawls.update_one({'_id': self.crawl_id}, {'$set': update})
+
+    def build_document(self, entry, data, status, error=''):
+        document = self.mongo_client.build_document(entry['url'], data, status=status, error_message=error)
+        document['crawl_id'] = self.crawl_id
+        return document
+
+    def save_state(self, stats):
+        """Persist progress and the seen set so a restart picks up here"""
+        self.crawl['seen'] = self.seen.to_document()
+        self.crawls.update_one({'_id': self.crawl_id}, {
+            '$set': {'seen': self.crawl['seen'], 'updated_at': datetime.now()},
+            '$inc': {'pages': stats['pages'], 'failed': stats['failed']},
+        })
+        self.crawl['pages'] += stats['pages']
+        self.crawl['failed'] += stats['failed']
+        stats['pages'] = stats['failed'] = 0
+
+    def pending(self):
+        return self.frontier.count_documents({'crawl_id': self.crawl_id, 'status': PENDING})
@@ -0,0 +1,155 @@
+from bs4.element import NavigableString, CData, Tag
+
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Always boilerplate, whatever their text looks like. Not <form>: some
+# sites (ASP.NET WebForms, CMS templates) wrap the whole page in one, so
+# forms are judged by their link density like other blocks
+NOISE_TAGS = frozenset(['head', 'nav', 'header', 'footer', 'aside', 'noscript'])
+
+# Elements scored as blocks; the rest (spans, links, ...) count towards the enclosing block
+BLOCK_TAGS = frozenset([
+    'body', 'main', 'article', 'section', 'div', 'td', 'th', 'table', 'ul', 'ol', 'li',
+    'dl', 'blockquote', 'figure', 'form',
+]) | NOISE_TAGS
+
+# Blocks that can be returned as the main content
+CANDIDATE_TAGS = frozenset(['body', 'main', 'article', 'section', 'div', 'td'])
+
+# Share of a block's text inside links above which it is a menu or link list
+MAX_LINK_DENSITY = 0.5
+
+# Blocks with less text than this are checked against the boilerplate matcher
+SHORT_BLOCK_CHARS = 120
+
+MIN_MAIN_CONTENT_LENGTH = 100
+
+_TEXT_TYPES = (NavigableString, CData)
+
+
+class Block:
+    __slots__ = ('piece_start', 'paragraph_start', 'chars', 'link_chars', 'dropped_chars')
+
+    def __init__(self, piece_start, paragraph_start):
+        self.piece_start = piece_start
+        self.paragraph_start = paragraph_start
+        self.chars = 0
+        self.link_chars = 0
+        self.dropped_chars = 0
+
+
+class DensityClassifier:
+    """Boilerplate removal by text and link density, in one pass over the tree.
+
+    Instead of CSS selectors and class name rules, every block element is
+    judged by its own statistics once its subtree has been walked: noise
+    tags, blocks whose text is mostly links, and short blocks the
+    boilerplate matcher flags are dropped, along with their text
+    and paragraphs. The main content is the block with the most kept text
+    net of the boilerplate text inside it. Work is linear in the size of
+    the tree and does not grow with the number of rules.
+    """
+
+    def __init__(self, is_navigation, is_boilerplate):
+        self.is_navigation = is_navigation
+        self.is_boilerplate = is_boilerplate
+
+    def extract(self, soup):
+        """Same fields as ExtractionEngine.extract"""
+        title = None
+        headings = {name: [] for name in HEADING_TAGS}
+        paragraphs = []
+        # Kept text in document order; dropped blocks are cut off the end
+        pieces = []
+        blocks = [Block(0, 0)]
+        open_paragraphs = []
+        links = 0
+        # (score, piece range) of kept candidate blocks in the order they closed
+        candidates = []
+
+        stack = [(soup, False)]
+        while stack:
+            node, closing = stack.pop()
+
+            if not isinstance(node, Tag):
+                if type(node) in _TEXT_TYPES:
+                    for parts in open_paragraphs:
+                        parts.append(node)
+                    text = node.strip()
+                    if text:
+                        pieces.append(text)
+                        blocks[-1].chars += len(text)
+                        if links:
+                            blocks[-1].link_chars += len(text)
+                continue
+
+            name = node.name
+            if not closing:
+                if name == 'title' and title is None:
+                    title = node.get_text().strip()
+                elif name in headings:
+                    headings[name].append(node.get_text().strip())
+                elif name == 'a':
+                    links += 1
+                elif name == 'p':
+                    open_paragraphs.append([])
+                if name in BLOCK_TAGS:
+                    blocks.append(Block(len(pieces), len(paragraphs)))
+                stack.append((node, True))
+                children = node.contents
+                for i in range(len(children) - 1, -1, -1):
+                    stack.append((children[i], False))
+                continue
+
+            if name == 'a':
+                links -= 1
+            elif name == 'p':
+                text = ''.join(open_paragraphs.pop()).strip()
+                if len(text) > 20 and not self.is_navigation(text):
+                    paragraphs.append(text)
+            if name not in BLOCK_TAGS:
+                continue
+
+            block = blocks.pop()
+            parent = blocks[-1]
+            if self.is_boilerplate_block(name, block, pieces):
+                del pieces[block.piece_start:]
+                del paragraphs[block.paragraph_start:]
+                parent.dropped_chars += block.chars + block.dropped_chars
+                # Candidates inside the dropped block closed last, so they are at the end
+                while candidates and candidates[-1][1][0] >= block.piece_start:
+                    candidates.pop()
+                continue
+
+            score = block.chars - block.dropped_chars
+            if name in CANDIDATE_TAGS and score > 0:
+                candidates.append((score, (block.piece_start, len(pieces))))
+            parent.chars += block.chars
+            parent.link_chars += block.link_chars
+            parent.dropped_chars += block.dropped_chars
+
+        best_score, best_range = 0, None
+        for score, piece_range in candidates:
+            # Ties go to the innermost block, which closes first
+            if score > best_score:
+                best_score, best_range = score, piece_range
+        main_content = '\n\n'.join(pieces[best_range[0]:best_range[1]]) if best_range else ''
+        if len(main_content) < MIN_MAIN_CONTENT_LENGTH:
+            main_content = '\n\n'.join(pieces)
+
+        return {
+            'title': title or '',
+            'main_content': main_content,
+            'paragraphs': paragraphs,
+            'headings': headings,
+            'word_count': len(main_content.split()),
+        }
+
+    def is_boilerplate_block(self, name, block, pieces):
+        if name in NOISE_TAGS:
+            return True
+        if block.link_chars > block.chars * MAX_LINK_DENSITY:
+            return True
+        if 0 < block.chars < SHORT_BLOCK_CHARS:
+            return self.is_boilerplate(' '.join(pieces[block.piece_start:]))
+        return False
@@ -0,0 +1,342 @@
+import re
+import time
+
+import soupsieve
+from bs4 import BeautifulSoup
+from bs4.element import NavigableString, CData, Tag
+from django.conf import settings
+from .density import DensityClassifier
+from .metrics import observe_extractor
+
+HEADING_TAGS = ('h1', 'h2', 'h3', 'h4', 'h5', 'h6')
+
+# Elements dropped before collecting paragraphs
+PARAGRAPH_NOISE_TAGS = frozenset(['nav', 'header', 'footer', 'aside', 'script', 'style', 'noscript'])
+
+# Class substrings that mark ad/navigation blocks
+AD_CLASSES = ('ad', 'advertisement', 'sidebar', 'navigation', 'nav', 'menu', 'footer', 'header')
+
+# Elements dropped inside a main content candidate
+MAIN_NOISE_TAGS = frozenset(['script', 'style', 'nav', 'aside', 'footer', 'header'])
+
+# Elements dropped from <body> when no candidate had enough text
+BODY_NOISE_TAGS = frozenset(['nav', 'header', 'footer', 'aside', 'script', 'style'])
+
+MAIN_SELECTORS = [
+    'main',
+    'article',
+    '[role="main"]',
+    '.content',
+    '.main-content',
+    '.article-content',
+    '.post-content',
+    '.entry-content',
+    '.text',  # GfG specific
+    '#content',
+    '.container .row .col'  # Bootstrap pattern
+]
+
+# Compile once instead of on every select_one call
+_COMPILED_SELECTORS = [(selector, soupsieve.compile(selector)) for selector in MAIN_SELECTORS]
+_SELECTORS_BY_NAME = dict(_COMPILED_SELECTORS)
+
+MIN_MAIN_CONTENT_LENGTH = 100
+
+# Text that marks menus, footers and share bars
+NAVIGATION_KEYWORDS = (
+    'home', 'about', 'contact', 'login', 'register', 'subscribe',
+    'menu', 'navigation', 'skip to', 'breadcrumb', 'previous', 'next',
+    'share on', 'follow us', 'copyright', '©', 'privacy policy',
+    'terms of service', 'cookie policy', 'all rights reserved'
+)
+
+# Text that marks ad slots, checked by the density classifier on short blocks
+AD_KEYWORDS = ('advertisement', 'sponsored', 'promoted', 'related articles')
+
+# One alternation per keyword list, so a text is scanned once rather than
+# once per keyword
+NAVIGATION_PATTERN = re.compile('|'.join(re.escape(keyword) for keyword in NAVIGATION_KEYWORDS))
+BOILERPLATE_PATTERN = re.compile('|'.join(re.escape(keyword) for keyword in NAVIGATION_KEYWORDS + AD_KEYWORDS))
+
+EXTRACTION_MODES = ('heuristic', 'density')
+
+# Fields a scrape can be asked for; the first five are returned by default
+FIELDS = ('title', 'main_content', 'paragraphs', 'headings', 'word_count', 'links', 'images', 'meta')
+DEFAULT_FIELDS = FIELDS[:5]
+
+# Fields ExtractionEngine.extract produces; the rest need the page URL
+ENGINE_FIELDS = frozenset(DEFAULT_FIELDS)
+
+_DEFAULT_STRING_TYPES = (NavigableString, CData)
+
+
+def get_default_parser():
+    """HTML parser backend configured in settings"""
+    return getattr(settings, 'SCRAPER_HTML_PARSER', 'html.parser')
+
+
+def get_default_mode():
+    """Extraction mode configured in settings"""
+    return getattr(settings, 'SCRAPER_EXTRACTION_MODE', 'heuristic')
+
+
+def parse_fields(value):
+    """Requested fields in FIELDS order, from a comma separated string or a list.
+
+    Nothing requested means DEFAULT_FIELDS. Raises ValueError for unknown fields.
+    """
+    if not value:
+        return DEFAULT_FIELDS
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)) or not all(isinstance(field, str) for field in value):
+        raise ValueError('fields must be a list of field names')
+    requested = {field.strip() for field in value} - {''}
+    unknown = requested.difference(FIELDS)
+    if unknown:
+        raise ValueError(f'Unknown fields {", ".join(sorted(unknown))}, expected some of {", ".join(FIELDS)}')
+    return tuple(field for field in FIELDS if field in requested) or DEFAULT_FIELDS
+
+
+def is_boilerplate_text(text):
+    return BOILERPLATE_PATTERN.search(text.lower()) is not None
+
+
+def _is_text(node, types):
+    """Mirror the string type filter Tag.get_text() applies"""
+    if isinstance(types, type):
+        return type(node) is types
+    return type(node) in types
+
+
+def _has_ad_class(tag):
+    classes = tag.get('class')
+    if not classes:
+        return False
+    if isinstance(classes, (list, tuple)):
+        classes = ' '.join(classes)
+    classes = str(classes).lower()
+    return any(class_name in classes for class_name in AD_CLASSES)
+
+
+class ExtractionEngine:
+    """Parses a page once and extracts every field from the same tree.
+
+    The extraction rules are the ones WebScraper has always used, but
+    instead of decomposing elements on reparsed copies of the document,
+    the engine skips them while walking, so the tree is never copied or
+    modified. With profiles (a SelectorProfiles), the main content
+    selector that worked for a host before is tried first.
+
+    In 'density' mode the selectors and class name rules are replaced by
+    DensityClassifier, which scores blocks by text and link density.
+    """
+
+    def __init__(self, parser=None, is_navigation=None, profiles=None, mode=None):
+        self.parser = parser or get_default_parser()
+        self.is_navigation = is_navigation or (lambda text: False)
+        self.profiles = profiles
+        self.mode = mode or get_default_mode()
+        if self.mode not in EXTRACTION_MODES:
+            raise ValueError(f'Unknown extraction mode {self.mode!r}, expected one of {EXTRACTION_MODES}')
+        self.density = DensityClassifier(self.is_navigation, is_boilerplate_text) if self.mode == 'density' else None
+
+    @property
+    def cache_key(self):
+        """Identifies the settings results were extracted with"""
+        return self.parser if self.mode == 'heuristic' else f'{self.parser}:{self.mode}'
+
+    def parse(self, content, encoding=None):
+        # A charset known up front spares BeautifulSoup guessing it from the whole page
+        if encoding and isinstance(content, bytes):
+            return BeautifulSoup(content, self.parser, from_encoding=encoding)
+        return BeautifulSoup(content, self.parser)
+
+    def extract(self, soup, host=None, fields=DEFAULT_FIELDS):
+        """Extract the requested fields among title, headings, paragraphs, main content and word count.
+
+        Only the passes those fields need are run: the tree walk for
+        headings and paragraphs, the content selectors for main content
+        and word count.
+        """
+        needed = ENGINE_FIELDS.intersection(fields)
+        if not needed:
+            return {}
+        if self.density is not None:
+            # One pass yields every field
+            started = time.perf_counter()
+            extracted = self.density.extract(soup)
+            observe_extractor('density', time.perf_counter() - started)
+            return {field: extracted[field] for field in fields if field in needed}
+
+        extracted = {}
+        started = time.perf_counter()
+        if 'paragraphs' in needed or 'headings' in needed:
+            # walk() collects the title, headings and paragraphs in one pass
+            extracted['title'], extracted['headings'], extracted['paragraphs'] = self.walk(soup)
+            observe_extractor('walk', time.perf_counter() - started)
+        elif 'title' in needed:
+            title_tag = soup.find('title')
+            extracted['title'] = title_tag.get_text().strip() if title_tag else ''
+            observe_extractor('title', time.perf_counter() - started)
+
+        if 'main_content' in needed or 'word_count' in needed:
+            started = time.perf_counter()
+            main_content = self.main_content(soup, host)
+            observe_extractor('main_content', time.perf_counter() - started)
+            extracted['main_content'] = main_content
+            extracted['word_count'] = len(main_content.split())
+        return {field: extracted[field] for field in fields if field in needed}
+
+    def walk(self, soup):
+        """Single pass over the tree collecting title, headings and clean paragraphs"""
+        title = None
+        headings = {name: [] for name in HEADING_TAGS}
+        paragraphs = []
+
+        # (string types, text buffer, slot in paragraphs) of the <p> elements we are inside.
+        # html.parser nests unclosed <p> tags and an inner one closes first, so
+        # each paragraph keeps the slot reserved when it opened: document order,
+        # as find_all('p') returns them
+        open_paragraphs = []
+        close_marker = object()
+
+        stack = [(soup, False)]
+        while stack:
+            node, excluded = stack.pop()
+
+            if node is close_marker:
+                _, parts, slot = open_paragraphs.pop()
+                text = ''.join(parts).strip()
+                if len(text) > 20 and not self.is_navigation(text):
+                    paragraphs[slot] = text
+                continue
+
+            if not isinstance(node, Tag):
+                if not excluded:
+                    for types, parts, _ in open_paragraphs:
+                        if _is_text(node, types):
+                            parts.append(node)
+                continue
+
+            name = node.name
+            if name == 'title' and title is None:
+                title = node.get_text().strip()
+            elif name in headings:
+                headings[name].append(node.get_text().strip())
+
+            if not excluded and (name in PARAGRAPH_NOISE_TAGS or _has_ad_class(node)):
+                excluded = True
+
+            if name == 'p' and not excluded:
+                open_paragraphs.append((node.interesting_string_types, [], len(paragraphs)))
+                paragraphs.append(None)
+                stack.append((close_marker, excluded))
+
+            children = node.contents
+            for i in range(len(children) - 1, -1, -1):
+                stack.append((children[i], excluded))
+
+        return title or '', headings, [text for text in paragraphs if text is not None]
+
+    def clean_paragraphs(self, soup):
+        if self.density is not None:
+            return self.density.extract(soup)['paragraphs']
+        return self.walk(soup)[2]
+
+    def main_content(self, soup, host=None):
+        """Text of the first content area with enough text, falling back to <body>"""
+        if self.density is not None:
+            return self.density.extract(soup)['main_content']
+        profiles = self.profiles if host else None
+        if profiles is not None:
+            compiled = _SELECTORS_BY_NAME.get(profiles.preferred(host))
+            if compiled is not None:
+                content_area = compiled.select_one(soup)
+                if content_area is not None:
+                    main_content = self.gather_text(content_area, MAIN_NOISE_TAGS)
+                    if len(main_content) > MIN_MAIN_CONTENT_LENGTH:
+                        profiles.hit(host)
+                        return main_content
+
+        main_content, selector = self.scan_main_content(soup)
+        if profiles is not None:
+            profiles.learn(host, selector)
+        return main_content
+
+    def scan_main_content(self, soup):
+        """Try every selector in order; returns (text, selector that produced it or None)"""
+        # Elements the original implementation decomposed; later selectors
+        # must not match inside them
+        removed = set()
+        main_content = ""
+
+        for selector, compiled in _COMPILED_SELECTORS:
+            content_area = self._select_first(soup, compiled, removed)
+            if content_area is not None:
+                main_content = self.gather_text(content_area, MAIN_NOISE_TAGS, removed)
+                if len(main_content) > MIN_MAIN_CONTENT_LENGTH:
+                    return main_content, selector
+
+        if not main_content or len(main_content) < MIN_MAIN_CONTENT_LENGTH:
+            body = self._find_first(soup, 'body', removed)
+            if body is not None:
+                main_content = self.gather_text(body, BODY_NOISE_TAGS, removed)
+
+        return main_content, None
+
+    def gather_text(self, root, skip_tags, removed=None, separator='\n\n'):
+        """Equivalent of root.get_text(strip=True, separator=...) with
+        descendants named in skip_tags (and anything in removed) left out"""
+        if removed is None:
+            removed = set()
+        types = root.interesting_string_types or _DEFAULT_STRING_TYPES
+        parts = []
+
+        stack = list(reversed(root.contents))
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Tag):
+                if id(node) in removed:
+                    continue
+                if node.name in skip_tags:
+                    removed.add(id(node))
+                    continue
+                stack.extend(reversed(node.contents))
+            elif _is_text(node, types):
+                text = node
+                # Serializing and reparsing used to merge adjacent strings
+                # (e.g. around a stray end tag); keep that behaviour
+                while (stack and type(stack[-1]) is type(node)
+                       and stack[-1] is node.next_sibling):
+                    node = stack.pop()
+                    text += node
+                text = text.strip()
+                if text:
+                    parts.append(text)
+
+        return separator.join(parts)
+
+    def _select_first(self, soup, compiled, removed):
+        if not removed:
+            return compiled.select_one(soup)
+        for tag in compiled.iselect(soup):
+            if not self._is_removed(tag, removed):
+                return tag
+        return None
+
+    def _find_first(self, soup, name, removed):
+        if not removed:
+            return soup.find(name)
+        for tag in soup.find_all(name):
+            if not self._is_removed(tag, removed):
+                return tag
+        return None
+
+    @staticmethod
+    def _is_removed(tag, removed):
+        while tag is not None:
+            if id(tag) in removed:
+                return True
+            tag = tag.parent
+        return False
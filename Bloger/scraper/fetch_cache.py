@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime, timedelta
+
+from bson import Binary
+from django.conf import settings
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from .mongodb_client import MongoDBClient
+from .url_utils import normalize_url
+
+# Skip pages whose compressed body and extraction result would take up a
+# large part of the 16 MB document limit
+MAX_ENTRY_BYTES = 8 * 1024 * 1024
+
+# Check the total cache size every this many stores
+EVICT_INTERVAL = 20
+
+
+class FetchCache:
+    """Persistent HTTP revalidation cache for fetched pages.
+
+    Entries are keyed by normalized URL and hold the response validators
+    (ETag / Last-Modified), the compressed body and the extraction result.
+    On a 304 the stored result is reused without downloading or parsing the
+    page again. Entries expire after a TTL, and the least recently used ones
+    are evicted once the cache grows past max_bytes.
+    """
+    _instance = None
+
+    def __init__(self, collection, max_bytes, ttl_seconds):
+        self.collection = collection
+        self.max_bytes = max_bytes
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.pid = os.getpid()
+        self.stores_since_evict = 0
+        self.collection.create_index([('last_used_at', ASCENDING)])
+        try:
+            # Let MongoDB drop expired entries in the background
+            self.collection.create_index([('stored_at', ASCENDING)], expireAfterSeconds=ttl_seconds)
+        except OperationFailure:
+            # Index exists with another TTL; lookup() still enforces ours
+            pass
+
+    @classmethod
+    def get_default(cls):
+        """Process-wide cache configured in settings, or None if disabled"""
+        if not getattr(settings, 'SCRAPER_FETCH_CACHE', True):
+            return None
+        # Rebuilt in forked processes, which open their own MongoDB connection
+        if cls._instance is None or cls._instance.pid != os.getpid():
+            cls._instance = cls(
+                MongoDBClient().db['fetch_cache'],
+                max_bytes=getattr(settings, 'SCRAPER_FETCH_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+                ttl_seconds=getattr(settings, 'SCRAPER_FETCH_CACHE_TTL', 7 * 24 * 3600),
+            )
+        return cls._instance
+
+    @staticmethod
+    def make_key(url):
+        return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+    def lookup(self, url):
+        """Cached entry for url, or None if missing or expired"""
+        entry = self.collection.find_one({'_id': self.make_key(url)})
+        if entry and datetime.now() - entry['stored_at'] > self.ttl:
+            return None
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    @staticmethod
+    def body(entry):
+        return zlib.decompress(entry['body'])
+
+    def store(self, url, headers, content, data, parser):
+        """Cache a full response; pages without validators can't be revalidated"""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+
+        body = zlib.compress(content)
+        # The result is stored uncompressed and can outweigh the body
+        size = len(body) + len(json.dumps(data))
+        if size > MAX_ENTRY_BYTES:
+            return
+
+        now = datetime.now()
+        entry = {
+            'url': normalize_url(url),
+            'etag': etag,
+            'last_modified': last_modified,
+            'body': Binary(body),
+            'result': data,
+            'parser': parser,
+            'size': size,
+            'stored_at': now,
+            'last_used_at': now,
+        }
+        self.collection.replace_one({'_id': self.make_key(url)}, entry, upsert=True)
+
+        self.stores_since_evict += 1
+        if self.stores_since_evict >= EVICT_INTERVAL:
+            self.stores_since_evict = 0
+            self.evict()
+
+    def revalidated(self, entry, data=None, parser=None):
+        """Mark an entry as confirmed fresh by a 304 (optionally with a new result)"""
+        now = datetime.now()
+        update = {'stored_at': now, 'last_used_at': now}
+        if data is not None:
+            size = len(entry['body']) + len(json.dumps(data))
+            # Too large to keep; the old result stays and the page is parsed again next time
+            if size <= MAX_ENTRY_BYTES:
+                update.update(result=data, parser=parser, size=size)
+        self.collection.update_one({'_id': entry['_id']}, {'$set': update})
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        totals = list(self.collection.aggregate([
+            {'$group': {'_id': None, 'size': {'$sum': '$size'}}}
+        ]))
+        total = totals[0]['size'] if totals else 0
+        if total <= self.max_bytes:
+            return
+
+        stale_ids = []
+        for entry in self.collection.find({}, {'size': 1}).sort('last_used_at', ASCENDING):
+            if total <= self.max_bytes:
+                break
+            stale_ids.append(entry['_id'])
+            total -= entry.get('size', 0)
+        if stale_ids:
+            self.collection.delete_many({'_id': {'$in': stale_ids}})
@@ -0,0 +1,393 @@
+import codecs
+import os
+import re
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import ConnectTimeoutError, InvalidHeader, MaxRetryError, NewConnectionError, ResponseError
+from urllib3.util.connection import allowed_gai_family
+from urllib3.util.retry import Retry
+from .metrics import observe_download, observe_phase
+from .politeness import HostScheduler, RobotsCache
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Content types worth downloading; responses without a Content-Type are let through
+PAGE_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/xml', 'application/xml', 'text/plain')
+
+# Small enough that one decompressed chunk of a gzip bomb stays manageable
+CHUNK_SIZE = 16 * 1024
+
+# Like browsers, look for a <meta charset> only in the first 1024 bytes
+SNIFF_BYTES = 1024
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([a-zA-Z0-9_:.-]+)', re.IGNORECASE)
+BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+ROBOTS_MAX_BYTES = 500 * 1024
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """The response body is bigger than the configured limit"""
+
+
+class UnsupportedContentType(requests.exceptions.RequestException):
+    """The response is not a page the scraper can parse"""
+
+
+def known_encoding(name):
+    try:
+        return codecs.lookup(name.decode('ascii') if isinstance(name, bytes) else name).name
+    except (LookupError, UnicodeDecodeError):
+        return None
+
+
+def declared_encoding(content_type, head):
+    """Charset from a byte order mark, the Content-Type header or a <meta> tag, in that order"""
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    _, _, params = content_type.partition(';')
+    for param in params.split(';'):
+        name, _, value = param.partition('=')
+        if name.strip().lower() == 'charset' and value.strip(' "\''):
+            encoding = known_encoding(value.strip(' "\''))
+            if encoding:
+                return encoding
+    match = META_CHARSET.search(head[:SNIFF_BYTES])
+    return known_encoding(match.group(1)) if match else None
+
+
+class BodyLimit:
+    """Collects a streamed response body, up to max_bytes of it.
+
+    check_headers runs before the body is downloaded and rejects pages of
+    the wrong type or with a Content-Length over the limit. add takes the
+    decoded body chunk by chunk; past max_bytes it either raises
+    ResponseTooLarge or, with truncate, keeps the first max_bytes and asks
+    the caller to stop reading. The charset is worked out as soon as the
+    first SNIFF_BYTES have arrived.
+    """
+
+    def __init__(self, url, max_bytes, truncate=False, content_types=PAGE_CONTENT_TYPES):
+        self.url = url
+        self.max_bytes = max_bytes
+        self.truncate = truncate
+        self.content_types = content_types
+        self.content_type = ''
+        self.chunks = []
+        self.size = 0
+        self.truncated = False
+        self.encoding = None
+        self.sniffed = False
+
+    def check_headers(self, status_code, headers):
+        self.content_type = headers.get('Content-Type', '')
+        # Error pages are left for raise_for_status to report
+        if not 200 <= status_code < 300:
+            return
+        media_type = self.content_type.split(';')[0].strip().lower()
+        if self.content_types and media_type and media_type not in self.content_types:
+            raise UnsupportedContentType(f'Unsupported content type {media_type}: {self.url}')
+        length = headers.get('Content-Length', '')
+        if length.isdigit() and int(length) > self.max_bytes and not self.truncate:
+            raise ResponseTooLarge(f'Response of {length} bytes exceeds the {self.max_bytes} byte limit: {self.url}')
+
+    def add(self, chunk):
+        """Keep a chunk of the body; returns False once no more should be read"""
+        if self.size + len(chunk) > self.max_bytes:
+            if not self.truncate:
+                raise ResponseTooLarge(f'Response exceeds the {self.max_bytes} byte limit: {self.url}')
+            chunk = chunk[:self.max_bytes - self.size]
+            self.truncated = True
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        if not self.sniffed and (self.size >= SNIFF_BYTES or self.truncated):
+            self.sniff()
+        return not self.truncated
+
+    def sniff(self):
+        self.sniffed = True
+        self.encoding = declared_encoding(self.content_type, b''.join(self.chunks)[:SNIFF_BYTES])
+
+    @property
+    def body(self):
+        if not self.sniffed:
+            self.sniff()
+        return b''.join(self.chunks)
+
+    def apply(self, response):
+        """Attach the collected body and what was learned about it to response"""
+        response._content = self.body
+        response.declared_encoding = self.encoding
+        response.truncated = self.truncated
+        return response
+
+
+class HostLimiter:
+    """Caps the number of concurrent requests to each host"""
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.semaphores[host]
+
+
+class TimedConnectionMixin:
+    """Records DNS lookup, TCP connect and TLS handshake time for new connections"""
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(self._dns_host, self.port, allowed_gai_family(), socket.SOCK_STREAM)
+        except OSError:
+            # Let urllib3 report the failed lookup as usual
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        observe_phase('dns', resolved - started)
+
+        # Connect to the address we just resolved instead of resolving again
+        dns_host = self._dns_host
+        self._dns_host = addresses[0][4][0]
+        try:
+            conn = super()._new_conn()
+        except (ConnectTimeoutError, NewConnectionError):
+            if len(addresses) == 1:
+                raise
+            # Try the remaining addresses the way urllib3 normally would
+            self._dns_host = dns_host
+            conn = super()._new_conn()
+        finally:
+            self._dns_host = dns_host
+        self._connected_at = time.perf_counter()
+        observe_phase('connect', self._connected_at - resolved)
+        return conn
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        super().connect()
+        observe_phase('tls', time.perf_counter() - self._connected_at)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report their setup time"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+class CappedRetry(Retry):
+    """Retry that gives up on a response asking to wait longer than max_retry_after.
+
+    urllib3 sleeps for whatever Retry-After says; a site answering 503 with
+    Retry-After: 3600 would hold the worker for an hour. Such responses are
+    returned as they are instead (and fail the scrape), rather than retried
+    sooner than the site asked.
+    """
+
+    def __init__(self, *args, max_retry_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_retry_after = max_retry_after
+
+    def new(self, **kwargs):
+        kwargs.setdefault('max_retry_after', self.max_retry_after)
+        return super().new(**kwargs)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if (response is not None and self.max_retry_after is not None
+                and response.status in (self.status_forcelist or ())):
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None and retry_after > self.max_retry_after:
+                raise MaxRetryError(_pool, url, ResponseError(
+                    f'Retry-After of {retry_after:.0f}s is over the {self.max_retry_after:g}s limit'))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    def next_wait(self, failures, retry_after=None):
+        """Seconds to wait after `failures` failed attempts in a row, or None to give up.
+
+        The policy urllib3 applies with this Retry, for clients that retry
+        by themselves (AsyncWebScraper). retry_after is the response's
+        Retry-After header, if any.
+        """
+        if failures > self.total:
+            return None
+        if retry_after:
+            try:
+                seconds = self.parse_retry_after(retry_after)
+            except InvalidHeader:
+                seconds = None
+            if seconds is not None:
+                if self.max_retry_after is not None and seconds > self.max_retry_after:
+                    return None
+                return seconds
+        if failures <= 1:
+            return 0
+        return min(self.DEFAULT_BACKOFF_MAX, self.backoff_factor * 2 ** (failures - 1))
+
+
+class HttpClient:
+    """Process-wide pooled HTTP client shared by every WebScraper.
+
+    Keeps connections alive across scrapes, so repeated requests to a host
+    skip the TCP/TLS handshake. Connection errors, 429 and 5xx responses are
+    retried with exponential backoff (honouring Retry-After up to
+    max_retry_after seconds, see CappedRetry), and each host
+    gets at most per_host concurrent requests, spaced out by the scheduler
+    according to host_rate and the site's robots.txt. Bodies are streamed
+    and capped at max_body_bytes, see BodyLimit.
+    """
+    _instance = None
+    _pid = None
+
+    def __init__(self, pool_connections, pool_maxsize, per_host, retries, backoff_factor,
+                 connect_timeout, read_timeout, host_rate=0, obey_robots=False, robots_ttl=3600,
+                 max_crawl_delay=30, max_body_bytes=10 * 1024 * 1024, truncate_oversized=False,
+                 max_retry_after=60):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_body_bytes = max_body_bytes
+        self.truncate_oversized = truncate_oversized
+        self.host_limiter = HostLimiter(per_host)
+        robots = RobotsCache(self.fetch_robots, USER_AGENT, robots_ttl) if obey_robots else None
+        self.scheduler = HostScheduler(host_rate, robots, max_crawl_delay)
+
+        # Also used by AsyncWebScraper, which retries by itself
+        self.retry = retry = CappedRetry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'HEAD']),
+            respect_retry_after_header=True,
+            max_retry_after=max_retry_after,
+            # Hand the last response back so raise_for_status reports it
+            raise_on_status=False,
+        )
+        adapter = TimedHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+        )
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': USER_AGENT
+        })
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        """New client configured from settings, with any of them overridden"""
+        options = dict(
+            pool_connections=get_setting('SCRAPER_HTTP_POOL_CONNECTIONS', 100),
+            pool_maxsize=get_setting('SCRAPER_HTTP_POOL_MAXSIZE', 20),
+            per_host=get_setting('SCRAPER_HTTP_PER_HOST', 8),
+            retries=get_setting('SCRAPER_HTTP_RETRIES', 3),
+            backoff_factor=get_setting('SCRAPER_HTTP_BACKOFF', 0.5),
+            connect_timeout=get_setting('SCRAPER_HTTP_CONNECT_TIMEOUT', 5),
+            read_timeout=get_setting('SCRAPER_HTTP_READ_TIMEOUT', 10),
+            host_rate=get_setting('SCRAPER_HOST_RATE', 2.0),
+            obey_robots=get_setting('SCRAPER_OBEY_ROBOTS', True),
+            robots_ttl=get_setting('SCRAPER_ROBOTS_TTL', 3600),
+            max_crawl_delay=get_setting('SCRAPER_MAX_CRAWL_DELAY', 30),
+            max_body_bytes=get_setting('SCRAPER_MAX_BODY_BYTES', 10 * 1024 * 1024),
+            truncate_oversized=get_setting('SCRAPER_TRUNCATE_OVERSIZED', False),
+            max_retry_after=get_setting('SCRAPER_MAX_RETRY_AFTER', 60),
+        )
+        options.update(overrides)
+        return cls(**options)
+
+    @classmethod
+    def get_default(cls):
+        """Shared client configured from settings, one per process"""
+        # Pooled sockets must not be shared with forked children
+        if cls._instance is None or cls._pid != os.getpid():
+            cls._instance = cls.from_settings()
+            cls._pid = os.getpid()
+        return cls._instance
+
+    def get(self, url, headers=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.monotonic()
+        self.scheduler.acquire(url)
+        with self.host_limiter.get(url):
+            waited = time.monotonic() - started
+            self.scheduler.record_wait(url, waited)
+            observe_phase('queue_wait', waited)
+
+            fetch_started = time.perf_counter()
+            response = self.session.get(url, headers=headers, stream=True, **kwargs)
+            # Request sent until the response headers arrived
+            observe_phase('ttfb', response.elapsed.total_seconds())
+            self.read_body(response, self.body_limit(url))
+            observe_phase('fetch', time.perf_counter() - fetch_started)
+            observe_download(len(response.content))
+            return response
+
+    def body_limit(self, url):
+        return BodyLimit(url, self.max_body_bytes, self.truncate_oversized)
+
+    def read_body(self, response, limit):
+        """Download a streamed response's body within limit"""
+        try:
+            limit.check_headers(response.status_code, response.headers)
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if not limit.add(chunk):
+                    break
+        finally:
+            # Returns the connection to the pool, or drops it if the body
+            # wasn't read to the end
+            response.close()
+        limit.apply(response)
+        response._content_consumed = True
+        if limit.encoding:
+            response.encoding = limit.encoding
+        return response
+
+    def fetch_robots(self, url):
+        # Straight to the session; robots.txt itself isn't rate limited
+        response = self.session.get(url, timeout=self.timeout, stream=True)
+        return self.read_body(response, BodyLimit(url, ROBOTS_MAX_BYTES, truncate=True, content_types=None))
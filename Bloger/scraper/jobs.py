@@ -0,0 +1,115 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidDocument
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import OperationFailure
+from .extraction import DEFAULT_FIELDS
+from .mongodb_client import MongoDBClient
+
+# Job lifecycle: pending -> running -> success / error
+PENDING = 'pending'
+RUNNING = 'running'
+
+
+class JobQueue:
+    """Scrape jobs stored as documents in the scraped_data collection.
+
+    The API inserts a pending document and returns straight away; worker
+    processes (manage.py scrape_workers) claim jobs with an atomic
+    find_one_and_update, so no external broker is needed.
+    """
+
+    def __init__(self, mongo_client=None):
+        self.mongo_client = mongo_client or MongoDBClient()
+
+    @property
+    def collection(self):
+        # Looked up on use, so creating a queue doesn't connect to MongoDB
+        return self.mongo_client.collection
+
+    def ensure_indexes(self):
+        # Workers claim the oldest pending job first using (status, created_at)
+        self.mongo_client.ensure_indexes()
+
+    def enqueue(self, url, fields=DEFAULT_FIELDS):
+        """Insert a pending job for the given fields (see extraction.parse_fields) and return its id"""
+        document = self.mongo_client.build_document(url, {}, status=PENDING)
+        # Read back by the worker that scrapes the page
+        document['requested_fields'] = list(fields)
+        result = self.collection.insert_one(document)
+        return str(result.inserted_id)
+
+    def claim(self, worker_id):
+        """Atomically take the oldest pending job, or None if the queue is empty"""
+        return self.collection.find_one_and_update(
+            {'status': PENDING},
+            {'$set': {
+                'status': RUNNING,
+                'worker_id': worker_id,
+                'claimed_at': datetime.now(),
+            }},
+            sort=[('created_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def complete(self, job_id, data, error=None):
+        """Store the scrape result on a claimed job"""
+        if error:
+            document = self.mongo_client.build_document('', {}, status='error', error_message=error)
+        else:
+            document = self.mongo_client.build_document('', data, status='success')
+        # Keep the original url and enqueue time
+        document.pop('url')
+        document.pop('normalized_url')
+        document.pop('created_at')
+        document['completed_at'] = datetime.now()
+        # The job document already exists, so near-duplicates are only flagged
+        self.mongo_client.skip_duplicate(document)
+
+        try:
+            result = self.collection.update_one(
+                {'_id': ObjectId(job_id), 'status': RUNNING},
+                {'$set': document}
+            )
+        except (OperationFailure, InvalidDocument):
+            self.mongo_client.discard_document(document)
+            raise
+        if not result.matched_count:
+            # No longer running here (requeued after its lease ran out); nothing references the files
+            self.mongo_client.discard_document(document)
+
+    def requeue_stale(self, lease_seconds):
+        """Return jobs claimed by workers that died to the queue"""
+        cutoff = datetime.now() - timedelta(seconds=lease_seconds)
+        result = self.collection.update_many(
+            {'status': RUNNING, 'claimed_at': {'$lt': cutoff}},
+            {'$set': {'status': PENDING}, '$unset': {'worker_id': '', 'claimed_at': ''}}
+        )
+        return result.modified_count
+
+    def get_status(self, job_id):
+        """Job status without the scraped content, or None if unknown"""
+        try:
+            object_id = ObjectId(job_id)
+        except Exception:
+            return None
+        document = self.collection.find_one(
+            {'_id': object_id},
+            {'url': 1, 'status': 1, 'error_message': 1, 'created_at': 1, 'completed_at': 1}
+        )
+        if document:
+            document['id'] = str(document.pop('_id'))
+        return document
+
+    def depth(self):
+        """Number of jobs waiting and in progress"""
+        return {
+            PENDING: self.collection.count_documents({'status': PENDING}),
+            RUNNING: self.collection.count_documents({'status': RUNNING}),
+        }
+
+
+def make_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from scraper.benchmarks.suite import FIXTURES_DIR, compare_reports, load_expected, load_fixtures, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Time extraction and storage on the saved HTML fixtures and write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Runs per timing; the median is compared')
+        parser.add_argument('--parser', default=None,
+                            help='HTML parser to benchmark (default: SCRAPER_HTML_PARSER)')
+        parser.add_argument('--fixtures', default=FIXTURES_DIR,
+                            help='Directory of .html pages to benchmark')
+        parser.add_argument('--mongodb-uri', default=None,
+                            help='Time storage against this server instead of mongomock '
+                                 '(uses and then drops the scraper_benchmark database)')
+        parser.add_argument('--no-storage', action='store_true',
+                            help='Skip the MongoDB timings')
+        parser.add_argument('--output', '-o', default=None,
+                            help='Write the JSON report to this file')
+        parser.add_argument('--compare', metavar='BASELINE', default=None,
+                            help='Report from an earlier run to check for regressions')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Slowdown that counts as a regression (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        fixtures = load_fixtures(options['fixtures'])
+        if not fixtures:
+            raise CommandError(f'No .html fixtures in {options["fixtures"]}')
+
+        report = run_benchmarks(
+            repeat=max(1, options['repeat']),
+            parser=options['parser'],
+            mongodb_uri=options['mongodb_uri'],
+            storage=not options['no_storage'],
+            fixtures=fixtures,
+            expected=load_expected(options['fixtures']),
+        )
+        self.print_report(report)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f'\nReport written to {options["output"]}')
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_reports(baseline, report, options['threshold'])
+            if regressions:
+                self.stdout.write(self.style.ERROR(f'\n{len(regressions)} timings regressed:'))
+                for key, before, after, change in regressions:
+                    self.stdout.write(f'  {key}: {before:.3f} ms -> {after:.3f} ms (+{change:.0%})')
+                raise CommandError('Performance regressed against the baseline')
+            self.stdout.write(self.style.SUCCESS('\nNo regressions against the baseline'))
+
+    def print_report(self, report):
+        self.stdout.write(f'Parser: {report["environment"]["parser"]}, {report["repeat"]} runs per timing (median ms)')
+        for page, result in report['extraction'].items():
+            self.stdout.write(f'\n{page} ({result["size_bytes"] / 1024:.0f} KB, '
+                              f'peak {result["peak_memory_bytes"] / (1024 * 1024):.1f} MB)')
+            for method, timing in result['methods'].items():
+                self.stdout.write(f'  {method:<30} {timing["median_ms"]:>10.3f}')
+            for mode, scores in result.get('accuracy', {}).items():
+                self.stdout.write(f'  accuracy ({mode}): precision {scores["precision"]:.2f}  '
+                                  f'recall {scores["recall"]:.2f}  F1 {scores["f1"]:.2f}')
+
+        storage = report['storage']
+        if storage is None:
+            self.stdout.write('\nStorage: skipped (no --mongodb-uri and mongomock is not installed)')
+            return
+        self.stdout.write(f'\nStorage ({storage["backend"]})')
+        for page, timings in storage['pages'].items():
+            row = '  '.join(f'{operation} {timing["median_ms"]:.3f}' for operation, timing in timings.items())
+            self.stdout.write(f'  {page:<12} {row}')
+        self.stdout.write(f'  recent_scrapes {storage["recent_scrapes"]["median_ms"]:.3f}')
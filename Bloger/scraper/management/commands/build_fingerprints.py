@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from scraper.mongodb_client import MongoDBClient
+from scraper.simhash import fingerprint_fields
+
+# Successful scrapes saved before content fingerprints were stored
+MISSING_FILTER = {'status': 'success', 'simhash': {'$exists': False}, 'simhash_checked': {'$exists': False}}
+
+
+class Command(BaseCommand):
+    help = 'Add near-duplicate fingerprints to scrapes saved before they were computed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Documents updated per bulk write')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the documents that need fingerprints')
+
+    def handle(self, *args, **options):
+        mongo_client = MongoDBClient()
+        collection = mongo_client.collection
+        batch_size = max(1, options['batch_size'])
+
+        remaining = collection.count_documents(MISSING_FILTER)
+        self.stdout.write(f'{remaining} documents have no fingerprint')
+        if options['dry_run'] or not remaining:
+            return
+
+        updated = 0
+        operations = []
+        cursor = collection.find(MISSING_FILTER, {'scraped_content': 1, 'content_blobs': 1}).batch_size(batch_size)
+        for document in cursor:
+            content = mongo_client.load_content(document.get('scraped_content'), document.get('content_blobs'))
+            # Pages too short to fingerprint are marked so later runs skip them
+            fields = fingerprint_fields(content) or {'simhash_checked': True}
+            operations.append(UpdateOne({'_id': document['_id']}, {'$set': fields}))
+            if len(operations) >= batch_size:
+                updated += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+                self.stdout.write(f'Fingerprinted {updated} documents...')
+
+        if operations:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS(f'Fingerprinted {updated} documents'))
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from scraper.mongodb_client import MongoDBClient
+from scraper.search import search_fields
+
+# Successful scrapes saved before search fields were stored
+MISSING_FILTER = {'status': 'success', 'search': {'$exists': False}}
+
+
+class Command(BaseCommand):
+    help = 'Add search fields to scrapes saved before search was available'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Documents updated per bulk write')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the documents that need indexing')
+
+    def handle(self, *args, **options):
+        mongo_client = MongoDBClient()
+        collection = mongo_client.collection
+        batch_size = max(1, options['batch_size'])
+
+        remaining = collection.count_documents(MISSING_FILTER)
+        self.stdout.write(f'{remaining} documents have no search fields')
+        if options['dry_run'] or not remaining:
+            return
+
+        indexed = 0
+        operations = []
+        cursor = collection.find(MISSING_FILTER, {'scraped_content': 1, 'content_blobs': 1}).batch_size(batch_size)
+        for document in cursor:
+            content = mongo_client.load_content(document.get('scraped_content'), document.get('content_blobs'))
+            operations.append(UpdateOne(
+                {'_id': document['_id'], 'search': {'$exists': False}},
+                {'$set': {'search': search_fields(content)}}
+            ))
+            if len(operations) >= batch_size:
+                indexed += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+                self.stdout.write(f'Indexed {indexed} documents...')
+
+        if operations:
+            indexed += collection.bulk_write(operations, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} documents'))
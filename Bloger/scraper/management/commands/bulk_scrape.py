@@ -0,0 +1,143 @@
+import logging
+import os
+import sys
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import BulkWriteError, PyMongoError
+from scraper.extraction import DEFAULT_FIELDS
+from scraper.mongodb_client import MongoDBClient
+from scraper.pipeline import ScrapePipeline
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Scrape many URLs concurrently from a file or stdin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-',
+                            help='File with one URL per line ("-" reads stdin)')
+        parser.add_argument('--workers', type=int, default=16,
+                            help='Concurrent fetches')
+        parser.add_argument('--per-host', type=int, default=None,
+                            help='Maximum concurrent connections per host (default: SCRAPER_HTTP_PER_HOST)')
+        parser.add_argument('--parse-workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used for HTML extraction (0 parses in the fetch threads)')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Documents per MongoDB write')
+        parser.add_argument('--queue-size', type=int, default=None,
+                            help='Pages buffered between the fetch and parse stages '
+                                 '(default: twice the larger worker count)')
+        parser.add_argument('--fields', default=None,
+                            help='Comma separated fields to extract, e.g. title,main_content,links '
+                                 f'(default: {",".join(DEFAULT_FIELDS)})')
+
+    def handle(self, *args, **options):
+        urls = self.read_urls(options['input'])
+        if not urls:
+            raise CommandError('No URLs to scrape')
+
+        workers = max(1, options['workers'])
+        batch_size = max(1, options['batch_size'])
+        mongo_client = MongoDBClient()
+
+        try:
+            pipeline = ScrapePipeline(
+                fetch_workers=workers,
+                parse_workers=options['parse_workers'],
+                queue_size=options['queue_size'],
+                fields=options['fields'],
+                per_host=options['per_host'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'Scraping {len(urls)} URLs with {workers} fetch workers '
+                          f'and {pipeline.parse_workers} parse processes')
+
+        stats = Counter()
+        failures = Counter()
+        pending_documents = []
+        started = time.monotonic()
+
+        def flush():
+            if not pending_documents:
+                return
+            try:
+                mongo_client.save_many(pending_documents)
+                stats['saved'] += len(pending_documents)
+            except BulkWriteError as e:
+                written = e.details.get('nInserted', 0)
+                stats['saved'] += written
+                failures['Database error'] += len(pending_documents) - written
+            except PyMongoError as e:
+                # Keep scraping; the server may be back by the next batch
+                logger.error('Could not save %d documents: %s', len(pending_documents), e)
+                failures['Database error'] += len(pending_documents)
+                # Scraped but lost, so no longer a success
+                unsaved = sum(document['status'] == 'success' for document in pending_documents)
+                stats['succeeded'] -= unsaved
+                stats['failed'] += unsaved
+            pending_documents.clear()
+
+        for url, data, error, size, not_modified in pipeline.run(urls):
+            stats['bytes'] += size
+            stats['not_modified'] += not_modified
+            if error:
+                stats['failed'] += 1
+                failures[error.split(':', 1)[0]] += 1
+                pending_documents.append(mongo_client.build_document(
+                    url, {}, status='error', error_message=error))
+            else:
+                stats['succeeded'] += 1
+                pending_documents.append(mongo_client.build_document(
+                    url, data, status='success'))
+
+            if len(pending_documents) >= batch_size:
+                flush()
+        flush()
+
+        elapsed = time.monotonic() - started
+        self.print_summary(len(urls), stats, failures, elapsed, pipeline.http)
+
+    def read_urls(self, source):
+        stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+        try:
+            urls = []
+            for line in stream:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    urls.append(line)
+            return urls
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    def print_summary(self, total, stats, failures, elapsed, http):
+        rate = total / elapsed if elapsed else 0
+        megabytes = stats['bytes'] / (1024 * 1024)
+
+        self.stdout.write('')
+        self.stdout.write(f'URLs:        {total}')
+        self.stdout.write(self.style.SUCCESS(f'Succeeded:   {stats["succeeded"]}'))
+        if stats['failed']:
+            self.stdout.write(self.style.ERROR(f'Failed:      {stats["failed"]}'))
+        else:
+            self.stdout.write('Failed:      0')
+        self.stdout.write(f'Saved:       {stats["saved"]}')
+        self.stdout.write(f'Unchanged:   {stats["not_modified"]}')
+        self.stdout.write(f'Downloaded:  {megabytes:.1f} MB')
+        self.stdout.write(f'Elapsed:     {elapsed:.1f}s ({rate:.1f} URLs/s)')
+
+        for reason, count in failures.most_common():
+            self.stdout.write(f'  {reason}: {count}')
+
+        waits = http.scheduler.stats()
+        slowest = sorted(waits.items(), key=lambda item: item[1]['wait_seconds'], reverse=True)[:5]
+        if slowest and slowest[0][1]['wait_seconds'] >= 0.1:
+            self.stdout.write('Host queue wait:')
+            for host, counters in slowest:
+                self.stdout.write(f'  {host}: {counters["wait_seconds"]:.1f}s over '
+                                  f'{counters["requests"]} requests (max {counters["max_wait_seconds"]:.1f}s)')
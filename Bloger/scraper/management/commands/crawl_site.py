@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from scraper.crawler import SiteCrawler, FINISHED
+
+
+class Command(BaseCommand):
+    help = 'Crawl a site breadth-first from a seed URL, following same-host links'
+
+    def add_arguments(self, parser):
+        parser.add_argument('seed', nargs='?', help='URL to start crawling from')
+        parser.add_argument('--max-depth', type=int, default=3,
+                            help='Links to follow away from the seed page')
+        parser.add_argument('--max-pages', type=int, default=None,
+                            help='Stop after crawling this many pages (default 500; '
+                                 'with --resume, raises the crawl\'s budget)')
+        parser.add_argument('--path-prefix', default='',
+                            help='Only follow links whose path starts with this, e.g. /python-tutorial/')
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent fetches')
+        parser.add_argument('--batch-size', type=int, default=50,
+                            help='Documents per MongoDB write')
+        parser.add_argument('--resume', metavar='CRAWL_ID',
+                            help='Continue an interrupted crawl instead of starting a new one')
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            crawler = SiteCrawler.load(options['resume'])
+            if crawler is None:
+                raise CommandError(f'No crawl with id {options["resume"]}')
+            if crawler.crawl['status'] == FINISHED:
+                raise CommandError('That crawl has already finished')
+            if options['max_pages']:
+                crawler.extend(options['max_pages'])
+            self.stdout.write(f'Resuming crawl {crawler.crawl_id} of {crawler.crawl["seed"]} '
+                              f'({crawler.crawl["pages"]} pages done)')
+        elif options['seed']:
+            crawler = SiteCrawler.create(
+                options['seed'],
+                max_depth=max(0, options['max_depth']),
+                max_pages=max(1, options['max_pages'] or 500),
+                path_prefix=options['path_prefix'],
+            )
+            self.stdout.write(f'Started crawl {crawler.crawl_id} of {crawler.crawl["seed"]}')
+        else:
+            raise CommandError('Give a seed URL or --resume CRAWL_ID')
+
+        def on_page(url, depth, error):
+            if error:
+                self.stdout.write(self.style.ERROR(f'[{depth}] {url}: {error}'))
+            else:
+                self.stdout.write(f'[{depth}] {url}')
+
+        try:
+            crawl = crawler.run(
+                workers=max(1, options['workers']),
+                batch_size=max(1, options['batch_size']),
+                on_page=on_page,
+            )
+        except KeyboardInterrupt:
+            self.stdout.write(f'Interrupted; resume with --resume {crawler.crawl_id}')
+            return
+
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'Pages:   {crawl["pages"]}'))
+        self.stdout.write(f'Failed:  {crawl["failed"]}')
+        self.stdout.write(f'Queued:  {crawler.pending()}')
+        if crawl['status'] != FINISHED:
+            self.stdout.write(f'Page budget spent; continue with --resume {crawler.crawl_id} --max-pages N')
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand
+from pymongo import UpdateOne
+from scraper.mongodb_client import MongoDBClient
+
+# BSON type of documents still storing scraped_content as a JSON string
+LEGACY_FILTER = {'scraped_content': {'$type': 'string'}}
+
+
+class Command(BaseCommand):
+    help = 'Convert scraped_content stored as JSON strings into native subdocuments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Documents converted per bulk write')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the documents that need converting')
+
+    def handle(self, *args, **options):
+        collection = MongoDBClient().collection
+        batch_size = max(1, options['batch_size'])
+
+        remaining = collection.count_documents(LEGACY_FILTER)
+        self.stdout.write(f'{remaining} documents use the legacy string format')
+        if options['dry_run'] or not remaining:
+            return
+
+        converted = 0
+        invalid = 0
+        operations = []
+
+        cursor = collection.find(LEGACY_FILTER, {'scraped_content': 1}).batch_size(batch_size)
+        for document in cursor:
+            try:
+                content = json.loads(document['scraped_content'])
+            except ValueError:
+                # Leave unreadable documents as they are
+                invalid += 1
+                continue
+
+            # Match on the string type again so reruns and concurrent writers are safe
+            operations.append(UpdateOne(
+                {'_id': document['_id'], **LEGACY_FILTER},
+                {'$set': {'scraped_content': content}}
+            ))
+            if len(operations) >= batch_size:
+                converted += collection.bulk_write(operations, ordered=False).modified_count
+                operations = []
+                self.stdout.write(f'Converted {converted} documents...')
+
+        if operations:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+
+        self.stdout.write(self.style.SUCCESS(f'Converted {converted} documents'))
+        if invalid:
+            self.stdout.write(self.style.WARNING(f'Skipped {invalid} documents with invalid JSON'))
@@ -1,45 +1,51 @@
-from django.core.management.base import BaseCommand
-from scraper.models import ScrapedData
+from django.core.management.base import BaseCommand, CommandError
+from scraper.extraction import DEFAULT_FIELDS
+from scraper.mongodb_client import MongoDBClient
 from scraper.utils import WebScraper
-from django.core.files.base import ContentFile
-import json
 
 class Command(BaseCommand):
     help = 'Scrape a URL from command line'
 
     def add_arguments(self, parser):
         parser.add_argument('url', type=str, help='URL to scrape')
+        parser.add_argument('--fields', default=None,
+                            help='Comma separated fields to extract, e.g. title,main_content,links '
+                                 f'(default: {",".join(DEFAULT_FIELDS)})')
 
     def handle(self, *args, **options):
         url = options['url']
         
+        try:
+            scraper = WebScraper(url, fields=options['fields'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        
         self.stdout.write(f'Scraping: {url}')
         
-        scraper = WebScraper(url)
         data, error = scraper.scrape()
         
+        mongo_client = MongoDBClient()
+        
         if error:
+            mongo_client.save_scraped_data(
+                url=url,
+                data_dict={},
+                status='error',
+                error_message=error
+            )
             self.stdout.write(
                 self.style.ERROR(f'Error: {error}')
             )
             return
         
-        # Save to database
-        scraped_data = ScrapedData.objects.create(
+        # Save to MongoDB, same as the web interface
+        document_id = mongo_client.save_scraped_data(
             url=url,
-            title=data.get('title', 'No title')[:200],
+            data_dict=data,
             status='success'
         )
         
-        json_content = json.dumps(data, indent=2, ensure_ascii=False)
-        filename = f"scraped_{scraped_data.id}_{scraped_data.created_at.strftime('%Y%m%d_%H%M%S')}.json"
-        
-        scraped_data.json_file.save(
-            filename,
-            ContentFile(json_content.encode('utf-8'))
-        )
-        
         self.stdout.write(
             self.style.SUCCESS(f'Successfully scraped and saved data for {url}')
         )
-        self.stdout.write(f'Data ID: {scraped_data.id}')
\ No newline at end of file
+        self.stdout.write(f'Data ID: {document_id}')
@@ -0,0 +1,94 @@
+import logging
+import multiprocessing
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from scraper.jobs import JobQueue, make_worker_id
+from scraper.utils import WebScraper
+
+logger = logging.getLogger(__name__)
+
+
+def run_job(queue, job):
+    """Scrape a claimed job's page and store the result on the job"""
+    # Jobs queued before fields could be chosen get the defaults
+    scraper = WebScraper(job['url'], fields=job.get('requested_fields'))
+    data, error = scraper.scrape()
+    queue.complete(job['_id'], data, error)
+
+
+def run_worker(poll_interval, lease_seconds):
+    """Claim and run scrape jobs until interrupted"""
+    # The inherited client is not reused; the first query opens this process's pool
+    queue = JobQueue()
+    worker_id = make_worker_id()
+    last_requeue = 0
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *args: stopping.append(True))
+
+    while not stopping:
+        try:
+            # Recover jobs from workers that died mid-scrape
+            if time.monotonic() - last_requeue > lease_seconds:
+                queue.requeue_stale(lease_seconds)
+                last_requeue = time.monotonic()
+
+            job = queue.claim(worker_id)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            run_job(queue, job)
+        except Exception:
+            # e.g. MongoDB unreachable; a claimed job is requeued once its lease runs out
+            logger.exception('Scrape worker %s failed, retrying in %ss', worker_id, poll_interval)
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Run local worker processes for queued scrape jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds after which a running job is considered abandoned')
+        parser.add_argument('--stats', action='store_true',
+                            help='Print the queue depth and exit')
+
+    def handle(self, *args, **options):
+        queue = JobQueue()
+
+        if options['stats']:
+            depth = queue.depth()
+            self.stdout.write(f'Pending: {depth["pending"]}')
+            self.stdout.write(f'Running: {depth["running"]}')
+            return
+
+        queue.ensure_indexes()
+
+        processes = []
+        for _ in range(max(1, options['processes'])):
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(options['poll_interval'], options['lease'])
+            )
+            process.start()
+            processes.append(process)
+
+        self.stdout.write(self.style.SUCCESS(f'Started {len(processes)} scrape workers'))
+
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping workers...')
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                process.join()
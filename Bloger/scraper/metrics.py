@@ -0,0 +1,234 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('scraper.metrics')
+
+# Seconds; from a cached DNS answer up to a slow page on a slow host
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 250 * 1024, 500 * 1024,
+                1024 * 1024, 5 * 1024 * 1024, 20 * 1024 * 1024)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _collect(self, value, labels):
+        observations = _collected.get()
+        if observations is not None:
+            observations.append((self.name, value, labels))
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self.render_value(list(zip(self.labelnames, key)), value))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+        self._collect(amount, labels)
+
+    record = inc
+
+    def render_value(self, labels, value):
+        return [f'{self.name}{_format_labels(labels)} {value}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # Per-bucket counts, then sum and count
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+        self._collect(value, labels)
+
+    record = observe
+
+    def render_value(self, labels, counts):
+        lines = []
+        for bound, count in zip(self.buckets, counts):
+            lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", bound)])} {count}')
+        lines.append(f'{self.name}_bucket{_format_labels(labels + [("le", "+Inf")])} {counts[-1]}')
+        lines.append(f'{self.name}_sum{_format_labels(labels)} {counts[-2]}')
+        lines.append(f'{self.name}_count{_format_labels(labels)} {counts[-1]}')
+        return lines
+
+
+# Metrics of this process only. Under several gunicorn/uvicorn workers each
+# serves its own /metrics/; worker processes that report back use collect()
+REGISTRY = []
+
+# Observations made inside collect(), to be replayed in another process
+_collected = contextvars.ContextVar('collected_metrics', default=None)
+
+PHASE_SECONDS = Histogram(
+    'scraper_phase_seconds', 'Time spent in each phase of a scrape', ['phase'])
+EXTRACTOR_SECONDS = Histogram(
+    'scraper_extractor_seconds', 'Time spent in each content extractor', ['extractor'])
+DOWNLOADED_BYTES = Histogram(
+    'scraper_downloaded_bytes', 'Size of downloaded pages in bytes', buckets=SIZE_BUCKETS)
+SCRAPES = Counter(
+    'scraper_scrapes_total', 'Finished scrapes by outcome', ['status'])
+ERRORS = Counter(
+    'scraper_errors_total', 'Errors by the stage they happened in and exception type', ['stage', 'exception'])
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+@contextmanager
+def collect():
+    """Also keep the observations made in the block, as (metric name, value, labels) tuples.
+
+    For worker processes, whose own registry nobody reads: the list can be
+    sent back to the parent and applied there with replay().
+    """
+    observations = []
+    token = _collected.set(observations)
+    try:
+        yield observations
+    finally:
+        _collected.reset(token)
+
+
+def replay(observations):
+    """Apply observations collected in another process to this process's metrics"""
+    metrics = {metric.name: metric for metric in REGISTRY}
+    for name, value, labels in observations:
+        metric = metrics.get(name)
+        if metric is not None:
+            metric.record(value, **labels)
+
+
+class ScrapeTrace:
+    """Timings of one scrape, collected from every layer it passes through"""
+
+    def __init__(self, url):
+        self.url = url
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.bytes = 0
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def as_log(self, status, error=None):
+        record = {
+            'event': 'scrape',
+            'url': self.url,
+            'status': status,
+            'bytes': self.bytes,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'timings_ms': {name: round(seconds * 1000, 2) for name, seconds in self.timings.items()},
+        }
+        if error:
+            record['error'] = error
+        return record
+
+
+_current_trace = contextvars.ContextVar('scrape_trace', default=None)
+
+
+@contextmanager
+def trace_scrape(url):
+    """Collect the phases of the scrape running in this thread or task"""
+    trace = ScrapeTrace(url)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def observe_phase(phase, seconds):
+    PHASE_SECONDS.observe(seconds, phase=phase)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(phase, seconds)
+
+
+def observe_extractor(extractor, seconds):
+    EXTRACTOR_SECONDS.observe(seconds, extractor=extractor)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(f'extract.{extractor}', seconds)
+
+
+def observe_download(size):
+    DOWNLOADED_BYTES.observe(size)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.bytes += size
+
+
+def record_error(stage, exception):
+    ERRORS.inc(stage=stage, exception=type(exception).__name__)
+
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(phase, time.perf_counter() - started)
+
+
+def log_event(event, **fields):
+    """Write a structured (JSON) log line"""
+    logger.info(json.dumps({'event': event, **fields}, default=str))
+
+
+def finish_scrape(trace, status, error=None):
+    """Count a finished scrape and write its structured log line"""
+    SCRAPES.inc(status=status)
+    logger.info(json.dumps(trace.as_log(status, error), default=str))
@@ -0,0 +1,94 @@
+import os
+import threading
+
+from django.conf import settings
+from pymongo import monitoring
+
+
+def parse_write_concern(value):
+    """w option from a setting: a number of nodes ('0', '1', ...) or a tag like 'majority'"""
+    value = str(value)
+    return int(value) if value.isdigit() else value
+
+
+def client_options():
+    """MongoClient keyword arguments from settings; they override options in MONGODB_URI"""
+    options = {
+        'maxPoolSize': getattr(settings, 'SCRAPER_MONGO_MAX_POOL_SIZE', 50),
+        'minPoolSize': getattr(settings, 'SCRAPER_MONGO_MIN_POOL_SIZE', 0),
+        'maxIdleTimeMS': getattr(settings, 'SCRAPER_MONGO_MAX_IDLE_MS', 60000),
+        'waitQueueTimeoutMS': getattr(settings, 'SCRAPER_MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000),
+        'connectTimeoutMS': getattr(settings, 'SCRAPER_MONGO_CONNECT_TIMEOUT_MS', 5000),
+        'serverSelectionTimeoutMS': getattr(settings, 'SCRAPER_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        'socketTimeoutMS': getattr(settings, 'SCRAPER_MONGO_SOCKET_TIMEOUT_MS', 60000),
+    }
+    options['w'] = parse_write_concern(getattr(settings, 'SCRAPER_MONGO_WRITE_CONCERN', '1'))
+    write_timeout = getattr(settings, 'SCRAPER_MONGO_WRITE_TIMEOUT_MS', 0)
+    if write_timeout:
+        options['wTimeoutMS'] = write_timeout
+    return options
+
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connection pool usage of one MongoClient, from its pool events.
+
+    pymongo has no public API for how many connections are open or checked
+    out, so the counts are kept from the events it publishes.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.pid = os.getpid()
+        self.open = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.lock = threading.Lock()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pid': self.pid,
+                'max_size': self.max_size,
+                'open': self.open,
+                'in_use': self.in_use,
+                'idle': self.open - self.in_use,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+            }
+
+    def _add(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def connection_created(self, event):
+        self._add('open')
+
+    def connection_closed(self, event):
+        self._add('open', -1)
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.in_use += 1
+            self.checkouts += 1
+
+    def connection_checked_in(self, event):
+        self._add('in_use', -1)
+
+    def connection_check_out_failed(self, event):
+        self._add('checkout_failures')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
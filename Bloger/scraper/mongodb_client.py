@@ -1,60 +1,496 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
+from asgiref.sync import sync_to_async
+import logging
 import os
+import threading
+import time
 from bson import ObjectId
-from datetime import datetime
+from django.conf import settings
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 import json
+from .content_storage import ContentStorage, LARGE_FIELDS, content_hash
+from .extraction import DEFAULT_FIELDS, FIELDS
+from .bulk_writer import BulkWriter
+from .mongo_pool import PoolMonitor, client_options
+from .metrics import log_event, observe_phase, record_error
+from .search import (ORDERS, RESULT_FIELDS, SEARCH_INDEX_NAME, SEARCH_WEIGHTS, UNUSED_KEYSET_INDEX,
+                     decode_cursor, encode_cursor, query_terms, search_fields, snippet, text_index)
+from .simhash import duplicate_policy, fingerprint_fields, from_stored, hamming_distance
+from .url_utils import normalize_url
+
+logger = logging.getLogger(__name__)
+
+# Fields shown in the history table; bodies are only loaded by detail()
+HISTORY_FIELDS = {'url': 1, 'title': 1, 'status': 1, 'created_at': 1}
+
+def open_database():
+    """Database named in the environment, on a new client using the pool settings.
+    
+    Returns (database, PoolMonitor).
+    """
+    mongodb_uri = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/ai_blog_db')
+    db_name = os.environ.get('MONGODB_NAME', 'ai_blog_db')
+    options = client_options()
+    monitor = PoolMonitor(options['maxPoolSize'])
+    client = MongoClient(mongodb_uri, event_listeners=[monitor], **options)
+    return client[db_name], monitor
+
+class MongoConnection:
+    """Client and collections opened by one process"""
+    
+    def __init__(self, db, monitor=None):
+        self.pid = os.getpid()
+        self.client = db.client
+        self.db = db
+        self.collection = db['scraped_data']
+        self.storage = ContentStorage(db)
+        self.monitor = monitor
+        # BulkWriter when saves are buffered
+        self.writer = None
 
 class MongoDBClient:
+    """Reads and writes scrape results in the scraped_data collection.
+    
+    The shared instance connects on first use in each process rather than
+    at import. A process forked from one that was already connected (gunicorn
+    workers, scrape_workers) opens its own pool instead of reusing sockets
+    it inherited, and the app starts even when MongoDB is down.
+    """
     _instance = None
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(MongoDBClient, cls).__new__(cls)
-            mongodb_uri = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/ai_blog_db')
-            cls._instance.client = MongoClient(mongodb_uri)
-            db_name = os.environ.get('MONGODB_NAME', 'ai_blog_db')
-            cls._instance.db = cls._instance.client[db_name]
-            cls._instance.collection = cls._instance.db['scraped_data']
+            cls._instance.setup(open_database, buffered=True)
         return cls._instance
     
-    def save_scraped_data(self, url, data_dict, status='success', error_message=''):
-        """Save scraped data directly to MongoDB"""
+    @classmethod
+    def for_database(cls, db):
+        """Client for another database, separate from the shared instance (e.g. benchmarks)"""
+        instance = super(MongoDBClient, cls).__new__(cls)
+        instance.setup(lambda: (db, None))
+        return instance
+    
+    def setup(self, connect, buffered=False):
+        # connect() returns (database, pool monitor or None)
+        self._connect = connect
+        # Whether SCRAPER_BUFFERED_WRITES applies to this client
+        self._buffered = buffered
+        self._connection = None
+        self._lock = threading.Lock()
+    
+    def connection(self):
+        """This process's MongoConnection, opened on first use"""
+        connection = self._connection
+        if connection is None or connection.pid != os.getpid():
+            with self._lock:
+                connection = self._connection
+                if connection is None or connection.pid != os.getpid():
+                    # Anything inherited from the parent process is left alone
+                    connection = self._connection = MongoConnection(*self._connect())
+                    if self._buffered and getattr(settings, 'SCRAPER_BUFFERED_WRITES', False):
+                        connection.writer = BulkWriter.from_settings(self)
+                    self.ensure_indexes()
+        return connection
+    
+    @property
+    def client(self):
+        return self.connection().client
+    
+    @property
+    def db(self):
+        return self.connection().db
+    
+    @property
+    def collection(self):
+        return self.connection().collection
+    
+    @property
+    def storage(self):
+        return self.connection().storage
+    
+    def health(self):
+        """Ping MongoDB and report this process's connection pool usage"""
+        report = {'pid': os.getpid()}
+        started = time.perf_counter()
+        try:
+            connection = self.connection()
+            connection.client.admin.command('ping')
+        except PyMongoError as e:
+            report.update(status='error', error=str(e))
+        else:
+            report.update(status='ok', ping_ms=round((time.perf_counter() - started) * 1000, 2))
+        connection = self._connection
+        monitor = connection.monitor if connection is not None else None
+        report['pool'] = monitor.stats() if monitor is not None else None
+        if connection is not None and connection.writer is not None:
+            report['buffered_documents'] = len(connection.writer.pending())
+        return report
+    
+    @contextmanager
+    def timed_operation(self, phase, operation, documents=1):
+        """Time a database call, count its failures and log writes"""
+        started = time.perf_counter()
+        try:
+            yield
+        except PyMongoError as e:
+            record_error('mongo', e)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            observe_phase(phase, elapsed)
+            if phase == 'mongo_write':
+                log_event('mongo_write', operation=operation, documents=documents,
+                          ms=round(elapsed * 1000, 2))
+    
+    def ensure_indexes(self):
+        """Create the indexes the history and job queries rely on"""
+        try:
+            self.collection.create_index([('created_at', DESCENDING)])
+            self.collection.create_index([('url', ASCENDING)])
+            # Also serves plain status lookups
+            self.collection.create_index([('status', ASCENDING), ('created_at', ASCENDING)])
+            # Freshness lookups: latest success for a URL, whatever its spelling
+            self.collection.create_index(
+                [('normalized_url', ASCENDING), ('status', ASCENDING), ('created_at', DESCENDING)])
+            # Near-duplicate lookups match any one band of the content fingerprint
+            self.collection.create_index([('simhash_bands', ASCENDING)], sparse=True)
+            # Search; both orders sort the matches the text index returns
+            self.collection.create_index(text_index(), weights=SEARCH_WEIGHTS, name=SEARCH_INDEX_NAME)
+            if UNUSED_KEYSET_INDEX in self.collection.index_information():
+                self.collection.drop_index(UNUSED_KEYSET_INDEX)
+        except PyMongoError as e:
+            # Don't take the app down; queries still work without indexes
+            logger.warning('Could not create MongoDB indexes: %s', e)
+    
+    def build_document(self, url, data_dict, status='success', error_message=''):
+        """Build the document stored for a scrape result"""
+        # Large fields are compressed (or moved to GridFS) transparently
+        content, blobs = self.storage.pack(data_dict) if data_dict else ({}, None)
         document = {
             'url': url,
+            'normalized_url': normalize_url(url) if url else '',
             'title': data_dict.get('title', 'No title')[:200] if data_dict else '',
-            'scraped_content': json.dumps(data_dict) if data_dict else '{}',
+            # Stored as a subdocument so fields can be queried and projected
+            'scraped_content': content,
             'status': status,
             'error_message': error_message,
             'created_at': datetime.now(),
             'word_count': len(data_dict.get('main_content', '').split()) if data_dict and 'main_content' in data_dict else 0,
             'content_preview': data_dict.get('main_content', '')[:500] + '...' if data_dict and 'main_content' in data_dict and len(data_dict.get('main_content', '')) > 500 else data_dict.get('main_content', '')[:500] if data_dict else ''
         }
+        if blobs:
+            document['content_blobs'] = blobs
+        if data_dict:
+            # Uncompressed copy of the searchable text, for the text index
+            document['search'] = search_fields(data_dict)
+            document.update(fingerprint_fields(data_dict))
+            # Scrapes can extract a subset of the fields; record which ones
+            document['fields'] = [field for field in FIELDS if field in data_dict]
+        # Lets downloads answer conditional requests without loading the content
+        document['content_hash'] = content_hash(content, blobs)
+        return document
+
+    def prepare_document(self, document):
+        """Add the fields the templates expect to a stored document"""
+        # Convert ObjectId to string for the template
+        document['id'] = str(document['_id'])
+        if 'scraped_content' in document:
+            document['json_content'] = self.load_content(
+                document['scraped_content'], document.get('content_blobs'))
+        return document
+
+    def load_content(self, scraped_content, blobs=None):
+        """Scraped content as a dict, whether stored natively or as a legacy JSON string.
+        
+        Compressed fields are only decompressed when they are accessed.
+        """
+        if isinstance(scraped_content, str):
+            try:
+                return json.loads(scraped_content)
+            except ValueError:
+                return {}
+        return self.storage.unpack(scraped_content or {}, blobs)
+
+    def save_scraped_data(self, url, data_dict, status='success', error_message=''):
+        """Save scraped data to MongoDB and return its id.
+        
+        With SCRAPER_BUFFERED_WRITES the document is queued for the next
+        bulk insert instead; call flush_writes() before reading it back.
+        """
+        document = self.build_document(url, data_dict, status, error_message)
+        writer = self.connection().writer
+        original_id = self.skip_duplicate(document, pending=writer.pending() if writer else ())
+        if original_id:
+            return original_id
+        if writer is not None:
+            return writer.add(document)
         
-        result = self.collection.insert_one(document)
+        try:
+            with self.timed_operation('mongo_write', 'insert_one'):
+                result = self.collection.insert_one(document)
+        except (OperationFailure, InvalidDocument):
+            # Rejected, so nothing references its GridFS files
+            self.discard_document(document)
+            raise
         return str(result.inserted_id)
     
+    def flush_writes(self):
+        """Write documents still buffered by save_scraped_data, if any"""
+        writer = self.connection().writer
+        if writer is not None:
+            writer.flush()
+    
+    def save_many(self, documents):
+        """Insert documents built with build_document in one round trip.
+        
+        Returns the id of each document, or of the stored original for
+        near-duplicates that SCRAPER_DUPLICATES='skip' kept out.
+        """
+        if not documents:
+            return []
+        ids = []
+        kept = []
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+            # Also compared with the rest of the batch, which isn't stored yet
+            original_id = self.skip_duplicate(document, pending=kept)
+            if original_id:
+                ids.append(original_id)
+            else:
+                kept.append(document)
+                ids.append(str(document['_id']))
+        if kept:
+            # Unordered so one bad document doesn't stop the rest of the batch
+            try:
+                with self.timed_operation('mongo_write', 'insert_many', len(kept)):
+                    self.collection.insert_many(kept, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get('writeErrors', []):
+                    self.discard_document(kept[error['index']])
+                raise
+        return ids
+    
+    def discard_document(self, document):
+        """Remove the GridFS files build_document wrote for a document that won't be stored"""
+        try:
+            self.storage.delete(document.get('content_blobs'))
+        except PyMongoError as e:
+            logger.warning('Could not remove content files of %s: %s', document.get('url'), e)
+    
+    def find_near_duplicate(self, document, max_distance, pending=()):
+        """_id of an original scrape whose fingerprint is within max_distance bits of document's.
+        
+        Only documents sharing a fingerprint band are compared, so the
+        lookup uses the band index instead of scanning the collection.
+        """
+        fingerprint = from_stored(document['simhash'])
+        best_id, best_distance = None, max_distance + 1
+        for other in pending:
+            if 'simhash' in other and not other.get('duplicate_of'):
+                distance = hamming_distance(fingerprint, from_stored(other['simhash']))
+                if distance < best_distance:
+                    best_id, best_distance = other['_id'], distance
+        if best_distance == 0:
+            return best_id
+        
+        query = {'simhash_bands': {'$in': document['simhash_bands']}, 'status': 'success',
+                 'duplicate_of': None}
+        with self.timed_operation('mongo_read', 'find_near_duplicate'):
+            candidates = list(self.collection.find(query, {'simhash': 1}))
+        for candidate in candidates:
+            distance = hamming_distance(fingerprint, from_stored(candidate['simhash']))
+            if distance < best_distance:
+                best_id, best_distance = candidate['_id'], distance
+        return best_id
+    
+    def skip_duplicate(self, document, pending=()):
+        """Flag a near-duplicate scrape before it is saved.
+        
+        Sets duplicate_of on fingerprinted documents (the original's _id or
+        None). Returns the original's id as a string when SCRAPER_DUPLICATES
+        is 'skip' and the document should not be stored (its GridFS files
+        are removed), otherwise None.
+        """
+        mode, max_distance = duplicate_policy()
+        if mode == 'off' or 'simhash' not in document:
+            return None
+        if 'duplicate_of' not in document:
+            document['duplicate_of'] = self.find_near_duplicate(document, max_distance, pending)
+        if mode == 'skip' and document['duplicate_of']:
+            self.discard_document(document)
+            return str(document['duplicate_of'])
+        return None
+    
     def get_scraped_data(self, id_str):
         """Get a single document by ID"""
         try:
             object_id = ObjectId(id_str)
-            document = self.collection.find_one({'_id': object_id})
+            with self.timed_operation('mongo_read', 'find_one'):
+                document = self.collection.find_one({'_id': object_id})
             if document:
-                # Convert ObjectId to string for the template
-                document['id'] = str(document['_id'])
-                # Parse JSON content if needed
-                if isinstance(document.get('scraped_content'), str):
-                    try:
-                        document['json_content'] = json.loads(document['scraped_content'])
-                    except:
-                        document['json_content'] = {}
+                self.prepare_document(document)
             return document
         except:
             return None
     
+    def get_scraped_content(self, id_str, fields=None):
+        """Scraped content of a document, optionally only some of its fields"""
+        try:
+            object_id = ObjectId(id_str)
+        except Exception:
+            return None
+        
+        if fields:
+            projection = {f'scraped_content.{field}': 1 for field in fields}
+            large_fields = [field for field in fields if field in LARGE_FIELDS]
+            if large_fields:
+                # Only the compressed blobs that were asked for
+                projection.update({'content_blobs.codec': 1, 'content_blobs.fields': 1})
+                for field in large_fields:
+                    projection[f'content_blobs.data.{field}'] = 1
+                    projection[f'content_blobs.gridfs_ids.{field}'] = 1
+        else:
+            projection = {'scraped_content': 1, 'content_blobs': 1}
+        with self.timed_operation('mongo_read', 'find_one'):
+            document = self.collection.find_one({'_id': object_id}, projection)
+        if not document:
+            return None
+        
+        stored = document.get('scraped_content')
+        if fields and stored is None:
+            # Legacy JSON strings can't be projected server-side
+            document = self.collection.find_one({'_id': object_id}, {'scraped_content': 1}) or {}
+            content = self.load_content(document.get('scraped_content'))
+            return {field: content[field] for field in fields if field in content}
+        
+        content = self.load_content(stored, document.get('content_blobs'))
+        if fields:
+            return {field: content[field] for field in fields if field in content}
+        return content
+    
+    def find_fresh(self, url, max_age_seconds, fields=DEFAULT_FIELDS):
+        """ID of a successful scrape of url from the last max_age_seconds with all of fields, or None"""
+        query = {
+            'normalized_url': normalize_url(url),
+            'status': 'success',
+            'created_at': {'$gte': datetime.now() - timedelta(seconds=max_age_seconds)},
+            'fields': {'$all': list(fields)},
+        }
+        with self.timed_operation('mongo_read', 'find_one'):
+            document = self.collection.find_one(query, {'_id': 1}, sort=[('created_at', DESCENDING)])
+        return str(document['_id']) if document else None
+    
+    def get_content_hash(self, id_str):
+        """Content hash of a successful scrape, or None"""
+        try:
+            object_id = ObjectId(id_str)
+        except Exception:
+            return None
+        document = self.collection.find_one({'_id': object_id}, {'status': 1, 'content_hash': 1})
+        if not document or document.get('status') != 'success':
+            return None
+        if 'content_hash' not in document:
+            # Saved before hashes were stored
+            document = self.collection.find_one(
+                {'_id': object_id}, {'scraped_content': 1, 'content_blobs': 1}) or {}
+            return content_hash(document.get('scraped_content'), document.get('content_blobs'))
+        return document['content_hash']
+    
+    def iter_json(self, document):
+        """Stream a stored document's scraped content as JSON bytes"""
+        return self.storage.iter_json(document.get('scraped_content'), document.get('content_blobs'))
+    
     def get_recent_scrapes(self, limit=10):
         """Get recent scraping history"""
-        documents = list(self.collection.find().sort('created_at', -1).limit(limit))
+        # Only the columns the history table shows, never the scraped content
+        with self.timed_operation('mongo_read', 'find'):
+            documents = list(self.collection.find({}, HISTORY_FIELDS).sort('created_at', -1).limit(limit))
         for doc in documents:
             # Convert ObjectId to string for the template
             doc['id'] = str(doc['_id'])
-        return documents
\ No newline at end of file
+        return documents
+
+    def search(self, query, limit=20, cursor=None, order='relevance'):
+        """Successful scrapes matching a text query, one page at a time.
+        
+        Results are ranked by relevance (or newest first) and paginated by
+        keyset: pass the returned next_cursor to get the following page.
+        Returns (results, next_cursor); next_cursor is None on the last page.
+        Raises InvalidCursor for cursors search() didn't produce.
+        """
+        if order not in ORDERS:
+            raise ValueError(f'order must be one of {ORDERS}')
+        match = {'$text': {'$search': query}, 'status': 'success'}
+        after = decode_cursor(order, cursor) if cursor else None
+        
+        with self.timed_operation('mongo_read', 'search'):
+            if order == 'relevance':
+                pipeline = [
+                    {'$match': match},
+                    {'$project': {**RESULT_FIELDS, 'score': {'$meta': 'textScore'}}},
+                ]
+                if after:
+                    pipeline.append({'$match': after})
+                pipeline += [{'$sort': {'score': -1, '_id': -1}}, {'$limit': limit + 1}]
+                documents = list(self.collection.aggregate(pipeline))
+            else:
+                if after:
+                    match.update(after)
+                documents = list(
+                    self.collection.find(match, {**RESULT_FIELDS, 'score': {'$meta': 'textScore'}})
+                    .sort([('created_at', DESCENDING), ('_id', DESCENDING)])
+                    .limit(limit + 1)
+                )
+        
+        next_cursor = encode_cursor(order, documents[limit - 1]) if len(documents) > limit else None
+        terms = query_terms(query)
+        results = []
+        for document in documents[:limit]:
+            results.append({
+                'id': str(document['_id']),
+                'url': document.get('url'),
+                'title': document.get('title', ''),
+                'created_at': document.get('created_at'),
+                'score': round(document.get('score', 0), 4),
+                'snippet': snippet(document.get('search', {}).get('content', ''), terms),
+            })
+        return results, next_cursor
+
+class AsyncMongoDBClient:
+    """Awaitable access to MongoDBClient for async views.
+    
+    Each call runs on the shared thread pool rather than the event loop, so
+    the async views never block on a database round trip.
+    """
+    
+    def __init__(self, client=None):
+        self.client = client or MongoDBClient()
+    
+    async def save_scraped_data(self, url, data_dict, status='success', error_message=''):
+        return await sync_to_async(self.client.save_scraped_data, thread_sensitive=False)(
+            url, data_dict, status, error_message)
+    
+    async def flush_writes(self):
+        return await sync_to_async(self.client.flush_writes, thread_sensitive=False)()
+    
+    async def save_many(self, documents):
+        return await sync_to_async(self.client.save_many, thread_sensitive=False)(documents)
+    
+    async def get_scraped_data(self, id_str):
+        return await sync_to_async(self.client.get_scraped_data, thread_sensitive=False)(id_str)
+    
+    async def get_scraped_content(self, id_str, fields=None):
+        return await sync_to_async(self.client.get_scraped_content, thread_sensitive=False)(id_str, fields)
+    
+    async def find_fresh(self, url, max_age_seconds, fields=DEFAULT_FIELDS):
+        return await sync_to_async(self.client.find_fresh, thread_sensitive=False)(url, max_age_seconds, fields)
+    
+    async def get_recent_scrapes(self, limit=10):
+        return await sync_to_async(self.client.get_recent_scrapes, thread_sensitive=False)(limit)
+    
+    async def search(self, query, limit=20, cursor=None, order='relevance'):
+        return await sync_to_async(self.client.search, thread_sensitive=False)(query, limit, cursor, order)
@@ -0,0 +1,173 @@
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+from .extraction import parse_fields
+from .http_client import HttpClient
+from .metrics import replay
+from .politeness import HostQueue, host_of
+from .selector_profiles import SelectorProfiles
+from .utils import WebScraper, mark_truncated, parse_page
+
+# Marks the end of a stage's output
+DONE = object()
+
+
+class ScrapePipeline:
+    """Fetch pages on threads and extract them in a pool of processes.
+
+        urls -> fetch threads -> parse queue -> process pool -> result queue -> caller
+
+    Fetching is I/O bound and runs on threads; extraction is CPU bound and
+    runs in parse_workers processes, so it isn't serialized on the GIL. The
+    stages are joined by bounded queues, so a slow stage makes the one before
+    it wait instead of piling up downloaded pages in memory. With
+    parse_workers=0 the fetch threads parse pages themselves.
+
+    Worker processes are spawned rather than forked: the fetch threads and
+    the MongoDB client's monitor threads are already running, and a fork
+    could copy a lock one of them holds. Workers get each page's selector
+    profile with the page and never connect to MongoDB themselves.
+
+    per_host overrides SCRAPER_HTTP_PER_HOST with a client of the pipeline's
+    own; otherwise pages are fetched with the process-wide client.
+    """
+
+    def __init__(self, fetch_workers=16, parse_workers=None, queue_size=None, fields=None, per_host=None):
+        self.fetch_workers = max(1, fetch_workers)
+        self.http = HttpClient.from_settings(per_host=max(1, per_host)) if per_host else HttpClient.get_default()
+        # Fields extracted from each page (see extraction.FIELDS)
+        self.fields = parse_fields(fields)
+        self.parse_workers = (os.cpu_count() or 1) if parse_workers is None else max(0, parse_workers)
+        self.queue_size = queue_size or max(self.fetch_workers, self.parse_workers) * 2
+        self.stopping = threading.Event()
+
+    def run(self, urls):
+        """Scrape urls, yielding (url, data, error, size, not_modified) as pages finish"""
+        self.stopping.clear()
+        host_queue = HostQueue(urls)
+        lock = threading.Lock()
+        active = [self.fetch_workers]
+        parse_queue = queue.Queue(self.queue_size)
+        results = queue.Queue(self.queue_size)
+        pool = ProcessPoolExecutor(
+            self.parse_workers, mp_context=multiprocessing.get_context('spawn')) if self.parse_workers else None
+
+        def fetch_loop():
+            while not self.stopping.is_set():
+                with lock:
+                    url = host_queue.pop()
+                if url is None:
+                    break
+                result, response = self.fetch(url)
+                if result is not None:
+                    self.put(results, result)
+                elif pool is not None:
+                    self.put(parse_queue, (url, response))
+                else:
+                    self.put(results, self.parse(url, response))
+            with lock:
+                active[0] -= 1
+                last = active[0] == 0
+            if last:
+                self.put(parse_queue if pool is not None else results, DONE)
+
+        threads = [threading.Thread(target=fetch_loop, daemon=True) for _ in range(self.fetch_workers)]
+        if pool is not None:
+            threads.append(threading.Thread(target=self.dispatch, args=(pool, parse_queue, results), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                result = results.get()
+                if result is DONE:
+                    break
+                url, data, error, size, not_modified, scraper, response = result
+                if response is not None and not error:
+                    scraper.remember(response, data)
+                yield url, data, error, size, not_modified
+        finally:
+            # Also reached when the caller stops early; unblock every stage
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def fetch(self, url):
+        """Download url; returns (result, None) when no parse is needed, else (None, response)"""
+        scraper = WebScraper(url, fields=self.fields, http=self.http)
+        try:
+            response, data = scraper.revalidate()
+        except requests.exceptions.RequestException as e:
+            return (url, None, f"Request error: {str(e)}", 0, False, None, None), None
+        except Exception as e:
+            return (url, None, f"Scraping error: {str(e)}", 0, False, None, None), None
+
+        # Unchanged since the last run; the cached result was reused
+        if data is not None:
+            return (url, data, None, 0, True, None, None), None
+        return None, response
+
+    def parse(self, url, response):
+        scraper = WebScraper(url, fields=self.fields, http=self.http)
+        try:
+            data, error = scraper.parse(response.content, response.declared_encoding), None
+        except Exception as e:
+            data, error = None, f"Scraping error: {str(e)}"
+        return url, mark_truncated(data, response), error, len(response.content), False, scraper, response
+
+    def dispatch(self, pool, parse_queue, results):
+        """Feed downloaded pages to the process pool, at most queue_size at a time"""
+        in_flight = {}
+        finished = False
+        while in_flight or not finished:
+            if not finished and len(in_flight) < self.queue_size:
+                try:
+                    # Poll while extractions are running so their results go out promptly
+                    item = parse_queue.get(timeout=0.05 if in_flight else 0.5)
+                except queue.Empty:
+                    item = None
+                if item is DONE:
+                    finished = True
+                elif item is not None:
+                    url, response = item
+                    # The worker extracts with a copy of the host's selector profile
+                    profiles, host = SelectorProfiles.get_default(), host_of(url)
+                    profile = profiles.get(host) if profiles is not None and host else None
+                    future = pool.submit(parse_page, url, response.content, response.declared_encoding, self.fields, profile)
+                    in_flight[future] = item
+            if self.stopping.is_set():
+                return
+
+            if in_flight:
+                # Block for a result only when no more work can be taken
+                blocked = finished or len(in_flight) >= self.queue_size
+                done, _ = wait(in_flight, timeout=None if blocked else 0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url, response = in_flight.pop(future)
+                    try:
+                        data, error, profile, observations = future.result()
+                    except Exception as e:
+                        data, error, profile, observations = None, f"Scraping error: {str(e)}", None, ()
+                    # Parse timings were recorded in the worker process
+                    replay(observations)
+                    if profile is not None:
+                        SelectorProfiles.get_default().merge(host_of(url), profile)
+                    data = mark_truncated(data, response)
+                    self.put(results, (url, data, error, len(response.content), False, WebScraper(url, fields=self.fields, http=self.http), response))
+        self.put(results, DONE)
+
+    def put(self, target, item):
+        """Blocking put that gives up once the pipeline is stopping"""
+        while not self.stopping.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
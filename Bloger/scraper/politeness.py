@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlsplit
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+
+# Seconds between sweeps of expired per-host state
+SWEEP_INTERVAL = 60
+
+
+class RobotsDisallowed(requests.exceptions.RequestException):
+    """The site's robots.txt does not allow fetching this URL"""
+
+
+def host_of(url):
+    return urlsplit(url).netloc.lower()
+
+
+class RobotsCache:
+    """Parsed robots.txt rules per site, refetched after ttl seconds.
+
+    Missing robots.txt files (and sites that fail to serve one) allow
+    everything; 401 and 403 disallow everything, like RobotFileParser.read.
+    Expired rules and their locks are dropped every SWEEP_INTERVAL seconds,
+    so only sites fetched within the last ttl seconds are kept.
+    """
+
+    def __init__(self, fetch, user_agent, ttl):
+        self.fetch = fetch
+        self.user_agent = user_agent
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.site_locks = {}
+        self.next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def get(self, url):
+        parts = urlsplit(url)
+        site = f'{parts.scheme.lower()}://{parts.netloc.lower()}'
+        entry = self.entries.get(site)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+
+        with self.lock:
+            self.sweep()
+            site_lock = self.site_locks.setdefault(site, threading.Lock())
+        # Only one thread downloads a site's robots.txt; the others wait for it
+        with site_lock:
+            entry = self.entries.get(site)
+            if entry and entry[0] > time.monotonic():
+                return entry[1]
+            rules = self.load(site)
+            self.entries[site] = (time.monotonic() + self.ttl, rules)
+            return rules
+
+    def sweep(self):
+        """Drop expired rules and idle site locks; call with self.lock held"""
+        now = time.monotonic()
+        if now < self.next_sweep:
+            return
+        self.next_sweep = now + SWEEP_INTERVAL
+        for site, entry in list(self.entries.items()):
+            if entry[0] <= now:
+                del self.entries[site]
+        for site, site_lock in list(self.site_locks.items()):
+            # A held lock means its robots.txt is being downloaded
+            if site not in self.entries and not site_lock.locked():
+                del self.site_locks[site]
+
+    def load(self, site):
+        rules = RobotFileParser(f'{site}/robots.txt')
+        try:
+            response = self.fetch(f'{site}/robots.txt')
+        except requests.exceptions.RequestException:
+            rules.allow_all = True
+            return rules
+
+        if response.status_code in (401, 403):
+            rules.disallow_all = True
+        elif response.status_code >= 400:
+            rules.allow_all = True
+        else:
+            rules.parse(response.text.splitlines())
+        return rules
+
+    def allowed(self, url):
+        return self.get(url).can_fetch(self.user_agent, url)
+
+    def crawl_delay(self, url):
+        """Seconds between requests the site asks for (Crawl-delay / Request-rate)"""
+        rules = self.get(url)
+        delay = rules.crawl_delay(self.user_agent) or 0
+        rate = rules.request_rate(self.user_agent)
+        if rate and rate.requests:
+            delay = max(delay, rate.seconds / rate.requests)
+        return float(delay)
+
+
+class HostScheduler:
+    """Spaces out requests to each host and enforces robots.txt.
+
+    Each host gets one request slot every max(1 / rate, Crawl-delay)
+    seconds. Callers reserve the next slot and sleep until it comes round,
+    so a slow host only delays requests to itself. Slots already in the
+    past are forgotten every SWEEP_INTERVAL seconds. Time spent waiting is
+    counted for the max_hosts hosts requested most recently.
+    """
+
+    def __init__(self, rate, robots=None, max_delay=30, max_hosts=1000):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.robots = robots
+        self.max_delay = max_delay
+        self.max_hosts = max_hosts
+        self.next_slot = {}
+        self.waits = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_sweep = time.monotonic() + SWEEP_INTERVAL
+
+    def reserve(self, url):
+        """Claim the host's next request slot; returns the seconds to wait for it"""
+        interval = self.interval
+        if self.robots is not None:
+            if not self.robots.allowed(url):
+                raise RobotsDisallowed(f'Blocked by robots.txt: {url}')
+            interval = max(interval, min(self.robots.crawl_delay(url), self.max_delay))
+
+        host = host_of(url)
+        now = time.monotonic()
+        with self.lock:
+            if now >= self.next_sweep:
+                self.next_sweep = now + SWEEP_INTERVAL
+                # A past slot means the host's next request can go straight away
+                self.next_slot = {name: slot for name, slot in self.next_slot.items() if slot > now}
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + interval
+        return slot - now
+
+    def acquire(self, url):
+        """Block until url may be requested"""
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def record_wait(self, url, seconds):
+        host = host_of(url)
+        with self.lock:
+            counters = self.waits.setdefault(host, {'requests': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0})
+            counters['requests'] += 1
+            counters['wait_seconds'] += seconds
+            counters['max_wait_seconds'] = max(counters['max_wait_seconds'], seconds)
+            self.waits.move_to_end(host)
+            while len(self.waits) > self.max_hosts:
+                self.waits.popitem(last=False)
+
+    def stats(self):
+        """Queue wait counters per host"""
+        with self.lock:
+            return {host: dict(counters) for host, counters in self.waits.items()}
+
+
+class HostQueue:
+    """URLs grouped by host and handed out with the hosts taking turns.
+
+    Feeding workers in this order keeps them spread over many hosts instead
+    of queueing behind one host's rate limit.
+    """
+
+    def __init__(self, urls=()):
+        self.queues = OrderedDict()
+        for url in urls:
+            self.add(url)
+
+    def add(self, url):
+        self.queues.setdefault(host_of(url), deque()).append(url)
+
+    def pop(self):
+        """Next URL, or None when empty"""
+        if not self.queues:
+            return None
+        host, queue = next(iter(self.queues.items()))
+        url = queue.popleft()
+        if queue:
+            self.queues.move_to_end(host)
+        else:
+            del self.queues[host]
+        return url
+
+    def __iter__(self):
+        while self.queues:
+            yield self.pop()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
@@ -0,0 +1,87 @@
+import base64
+import json
+import re
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.conf import settings
+from pymongo import TEXT
+
+# Titles count most towards a match, then headings, then the page text
+SEARCH_WEIGHTS = {'search.title': 10, 'search.headings': 5, 'search.content': 1}
+SEARCH_INDEX_NAME = 'search_text'
+
+ORDERS = ('relevance', 'newest')
+
+# (created_at, _id) index built by earlier versions for newest-first pages. A
+# $text query can only use the text index, so it was never used
+UNUSED_KEYSET_INDEX = 'created_at_-1__id_-1'
+
+# Fields search results are built from; never the scraped content itself
+RESULT_FIELDS = {'url': 1, 'title': 1, 'created_at': 1, 'search.content': 1}
+
+SNIPPET_CHARS = 240
+
+
+class InvalidCursor(ValueError):
+    """A pagination cursor that wasn't produced by search()"""
+
+
+def search_fields(data_dict):
+    """Text indexed for search, kept next to the (possibly compressed) content"""
+    max_chars = getattr(settings, 'SCRAPER_SEARCH_CONTENT_CHARS', 20000)
+    headings = data_dict.get('headings') or {}
+    return {
+        'title': data_dict.get('title', ''),
+        'headings': '\n'.join(text for level in sorted(headings) for text in headings[level]),
+        'content': data_dict.get('main_content', '')[:max_chars],
+    }
+
+
+def text_index():
+    return [(field, TEXT) for field in SEARCH_WEIGHTS]
+
+
+def encode_cursor(order, document):
+    """Opaque cursor pointing just after document in the given order"""
+    key = document['score'] if order == 'relevance' else document['created_at'].isoformat()
+    payload = json.dumps([order, key, str(document['_id'])]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(order, cursor):
+    """Filter matching the documents after cursor"""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_order, key, id_str = json.loads(payload)
+        object_id = ObjectId(id_str)
+    except (ValueError, TypeError, InvalidId) as e:
+        raise InvalidCursor('Malformed cursor') from e
+    if cursor_order != order:
+        raise InvalidCursor('Cursor belongs to a different sort order')
+    try:
+        key = datetime.fromisoformat(key) if order == 'newest' else float(key)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Malformed cursor') from e
+
+    field = 'score' if order == 'relevance' else 'created_at'
+    # Keyset pagination: strictly after the last (key, _id) pair seen
+    return {'$or': [{field: {'$lt': key}}, {field: key, '_id': {'$lt': object_id}}]}
+
+
+def query_terms(query):
+    """Words of a search query, without quotes or negated terms"""
+    return [term for term in re.findall(r'-?[\w\']+', query) if not term.startswith('-')]
+
+
+def snippet(text, terms, length=SNIPPET_CHARS):
+    """Part of text around the first query term it contains"""
+    if not text:
+        return ''
+    match = None
+    if terms:
+        match = re.search('|'.join(re.escape(term) for term in terms), text, re.IGNORECASE)
+    start = max(0, match.start() - length // 3) if match else 0
+    part = ' '.join(text[start:start + length].split())
+    return ('...' if start else '') + part + ('...' if start + length < len(text) else '')
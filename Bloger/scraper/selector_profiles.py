@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from django.conf import settings
+from pymongo.errors import PyMongoError
+from .metrics import Counter
+from .mongodb_client import MongoDBClient
+
+PROFILE_LOOKUPS = Counter(
+    'scraper_selector_profile_total', 'Main content selector profile outcomes', ['result'])
+
+# Pages in a row the learned selector may fail on before it is replaced
+MAX_MISSES = 3
+
+# Seconds profiles are kept in memory only after MongoDB fails
+OFFLINE_SECONDS = 60
+
+
+class SelectorProfiles:
+    """Per-host record of the selector that finds a site's main content.
+
+    Pages from one site nearly always match the same selector, so once a
+    selector has produced enough text for a host, later pages try it first
+    instead of every selector in MAIN_SELECTORS. Profiles are kept in an
+    LRU of max_entries hosts and, when a collection is given, persisted to
+    MongoDB so other processes and restarts start warm. A profile whose
+    selector fails on MAX_MISSES pages in a row is replaced by what the full
+    selector scan finds (or dropped when the scan finds nothing either).
+
+    MongoDB is only reached on the first lookup, and while it is failing
+    the profiles work from memory, so an outage never fails a scrape.
+    """
+    _instance = None
+
+    def __init__(self, collection=None, max_entries=1000, mongo_client=None):
+        self.collection = collection
+        # Gives the collection on first use when none was passed
+        self.mongo_client = mongo_client
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.offline_until = 0
+
+    @classmethod
+    def get_default(cls):
+        """Process-wide profiles configured in settings, or None if disabled"""
+        if not getattr(settings, 'SCRAPER_SELECTOR_PROFILES', True):
+            return None
+        # Rebuilt in forked processes, which open their own MongoDB connection
+        if cls._instance is None or cls._instance.pid != os.getpid():
+            cls._instance = cls(
+                max_entries=getattr(settings, 'SCRAPER_SELECTOR_PROFILES_SIZE', 1000),
+                mongo_client=MongoDBClient(),
+            )
+        return cls._instance
+
+    def get(self, host):
+        """Profile for host ({'selector': ..., 'misses': ...}), loading it from MongoDB once"""
+        with self.lock:
+            if host in self.entries:
+                self.entries.move_to_end(host)
+                return self.entries[host]
+
+        profile = self._load(host)
+        with self.lock:
+            self.entries[host] = profile
+            self.entries.move_to_end(host)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return profile
+
+    @classmethod
+    def detached(cls, host, profile):
+        """In-memory profiles holding one host's profile, for extraction in a worker process"""
+        profiles = cls()
+        profiles.entries[host] = dict(profile)
+        return profiles
+
+    def merge(self, host, profile):
+        """Take over a profile updated by a worker process's detached copy"""
+        current = self.get(host)
+        with self.lock:
+            if profile == current:
+                return
+            current.update(profile)
+            saved = dict(current)
+        self._save(host, saved)
+
+    def preferred(self, host):
+        """Selector to try first for host, or None"""
+        return self.get(host)['selector']
+
+    def hit(self, host):
+        """The preferred selector found the page's main content"""
+        PROFILE_LOOKUPS.inc(result='hit')
+        profile = self.get(host)
+        with self.lock:
+            if not profile['misses']:
+                return
+            profile['misses'] = 0
+            saved = dict(profile)
+        self._save(host, saved)
+
+    def learn(self, host, selector):
+        """Result of a full selector scan; selector is None when none had enough text"""
+        profile = self.get(host)
+        # Other threads scrape the same host; each update starts from the latest profile
+        with self.lock:
+            if selector is not None and selector == profile['selector']:
+                # Found further into the page than the preferred lookup goes
+                results = ['hit']
+                changed = profile['misses'] != 0
+                profile['misses'] = 0
+            elif profile['selector'] is None:
+                if selector is None:
+                    return
+                results = ['learned']
+                changed = True
+                profile.update(selector=selector, misses=0)
+            else:
+                # The preferred selector failed on this page
+                results = ['miss']
+                changed = True
+                profile['misses'] += 1
+                if profile['misses'] >= MAX_MISSES:
+                    results.append('invalidated')
+                    profile.update(selector=selector, misses=0)
+            saved = dict(profile)
+        for result in results:
+            PROFILE_LOOKUPS.inc(result=result)
+        if changed:
+            self._save(host, saved)
+
+    def _collection(self):
+        """Collection profiles are stored in, or None while MongoDB is failing"""
+        if time.monotonic() < self.offline_until:
+            return None
+        if self.collection is None and self.mongo_client is not None:
+            self.collection = self.mongo_client.db['selector_profiles']
+        return self.collection
+
+    def _offline(self):
+        self.offline_until = time.monotonic() + OFFLINE_SECONDS
+
+    def _load(self, host):
+        profile = {'selector': None, 'misses': 0}
+        try:
+            collection = self._collection()
+            if collection is None:
+                return profile
+            stored = collection.find_one({'_id': host})
+        except PyMongoError:
+            # Profiles are only an optimization; work from memory
+            self._offline()
+            return profile
+        if stored:
+            profile.update(selector=stored.get('selector'), misses=stored.get('misses', 0))
+        return profile
+
+    def _save(self, host, profile):
+        try:
+            collection = self._collection()
+            if collection is None:
+                return
+            if profile['selector'] is None:
+                collection.delete_one({'_id': host})
+            else:
+                collection.update_one(
+                    {'_id': host},
+                    {'$set': {'selector': profile['selector'], 'misses': profile['misses'],
+                              'updated_at': datetime.now()}},
+                    upsert=True,
+                )
+        except PyMongoError:
+            self._offline()
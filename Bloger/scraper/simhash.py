@@ -0,0 +1,94 @@
+import re
+from collections import Counter
+from hashlib import blake2b
+
+from django.conf import settings
+
+FINGERPRINT_BITS = 64
+
+# The fingerprint is split into BANDS parts that are indexed separately.
+# Fingerprints within BANDS - 1 bits of each other share at least one part
+# exactly, so near-duplicates are found with an index lookup per band.
+BANDS = 4
+BAND_BITS = FINGERPRINT_BITS // BANDS
+MAX_DISTANCE = BANDS - 1
+
+# Words per shingle
+SHINGLE_SIZE = 3
+
+# Pages with fewer words aren't fingerprinted; short texts collide too easily
+MIN_WORDS = 30
+
+DUPLICATE_MODES = ('off', 'flag', 'skip')
+
+WORD_PATTERN = re.compile(r'\w+')
+
+_MASK = (1 << FINGERPRINT_BITS) - 1
+
+
+def simhash(text):
+    """64-bit SimHash of text's word shingles, or None for short texts.
+
+    Each shingle is hashed and votes on every bit of the fingerprint; texts
+    that share most of their shingles end up a few bits apart.
+    """
+    words = WORD_PATTERN.findall(text.lower()) if text else []
+    if len(words) < MIN_WORDS:
+        return None
+    digests = [
+        blake2b(' '.join(words[i:i + SHINGLE_SIZE]).encode('utf-8'), digest_size=8).digest()
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    ]
+
+    fingerprint = 0
+    half = len(digests) / 2
+    # Votes are counted per byte value, so the bit loop doesn't grow with the text
+    for position in range(8):
+        votes = [0] * 8
+        for value, count in Counter(digest[position] for digest in digests).items():
+            for bit in range(8):
+                if value >> bit & 1:
+                    votes[bit] += count
+        shift = (7 - position) * 8
+        for bit in range(8):
+            if votes[bit] > half:
+                fingerprint |= 1 << (shift + bit)
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin((a ^ b) & _MASK).count('1')
+
+
+def to_stored(fingerprint):
+    """Fingerprint as a signed 64-bit integer, which MongoDB can store"""
+    return fingerprint - (1 << FINGERPRINT_BITS) if fingerprint >> (FINGERPRINT_BITS - 1) else fingerprint
+
+
+def from_stored(value):
+    return value & _MASK
+
+
+def bands(fingerprint):
+    """Index keys of the fingerprint's parts, tagged with their position"""
+    mask = (1 << BAND_BITS) - 1
+    return [band << BAND_BITS | (fingerprint >> (band * BAND_BITS)) & mask for band in range(BANDS)]
+
+
+def fingerprint_fields(data_dict):
+    """Fields stored with a scrape for near-duplicate lookups, or {} for short pages"""
+    fingerprint = simhash(data_dict.get('main_content', ''))
+    if fingerprint is None:
+        return {}
+    return {'simhash': to_stored(fingerprint), 'simhash_bands': bands(fingerprint)}
+
+
+def duplicate_policy():
+    """(mode, max_distance) configured in settings"""
+    mode = getattr(settings, 'SCRAPER_DUPLICATES', 'flag')
+    distance = getattr(settings, 'SCRAPER_DUPLICATE_DISTANCE', MAX_DISTANCE)
+    if mode not in DUPLICATE_MODES:
+        raise ValueError(f'Unknown duplicate mode {mode!r}, expected one of {DUPLICATE_MODES}')
+    if not 0 <= distance <= MAX_DISTANCE:
+        raise ValueError(f'SCRAPER_DUPLICATE_DISTANCE must be between 0 and {MAX_DISTANCE}')
+    return mode, distance
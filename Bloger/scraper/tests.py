@@ -1,3 +1,879 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from bson import ObjectId
+from bs4 import BeautifulSoup
+from django.http import Http404, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from pymongo import DESCENDING
+from pymongo.errors import AutoReconnect
+from urllib3.exceptions import MaxRetryError
+from urllib3.response import HTTPResponse
+
+from . import metrics, views
+from .asgi import StreamingASGIHandler
+from .benchmarks.suite import load_fixtures
+from .bulk_writer import BufferFull, BulkWriter
+from .coalesce import SingleFlight
+from .crawler import PENDING, SiteCrawler
+from .extraction import DEFAULT_FIELDS, ExtractionEngine, parse_fields
+from .fetch_cache import FetchCache
+from .http_client import BodyLimit, CappedRetry, HttpClient, ResponseTooLarge, UnsupportedContentType
+from .jobs import JobQueue
+from .management.commands.scrape_workers import run_job
+from .mongodb_client import MongoDBClient
+from .pipeline import ScrapePipeline
+from .politeness import HostScheduler, RobotsCache
+from .search import InvalidCursor, decode_cursor, encode_cursor
+from .selector_profiles import MAX_MISSES, SelectorProfiles
+from .simhash import MAX_DISTANCE, bands, hamming_distance, simhash
+from .utils import WebScraper
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+
+def mock_client():
+    """MongoDBClient on an in-memory database, apart from the shared instance"""
+    return MongoDBClient.for_database(mongomock.MongoClient().db)
+
+
+@skipUnless(mongomock, 'mongomock is not installed')
+class BulkWriterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.mongo_client = mock_client()
+
+    def writer(self, **options):
+        writer = BulkWriter(self.mongo_client, **options)
+        self.addCleanup(writer.close)
+        return writer
+
+    def count(self):
+        return self.mongo_client.collection.count_documents({})
+
+    def test_writes_batch_when_full(self):
+        writer = self.writer(batch_size=3, flush_interval=60)
+        writer.add({'url': 'http://example.com/1'})
+        writer.add({'url': 'http://example.com/2'})
+        self.assertEqual(self.count(), 0)
+        self.assertEqual(len(writer.pending()), 2)
+
+        writer.add({'url': 'http://example.com/3'})
+        self.assertEqual(self.count(), 3)
+        self.assertEqual(writer.pending(), [])
+
+    def test_timer_writes_waiting_documents(self):
+        writer = self.writer(batch_size=100, flush_interval=0.05)
+        document_id = writer.add({'url': 'http://example.com/'})
+        deadline = time.monotonic() + 5
+        while not self.count() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(str(self.mongo_client.collection.find_one()['_id']), document_id)
+
+    def test_add_returns_id_before_write(self):
+        writer = self.writer(batch_size=100, flush_interval=60)
+        document_id = writer.add({'url': 'http://example.com/'})
+        self.assertIsNone(self.mongo_client.collection.find_one())
+        writer.flush()
+        self.assertEqual(str(self.mongo_client.collection.find_one()['_id']), document_id)
+
+    def test_flush_waits_for_batch_being_written(self):
+        writer = self.writer(batch_size=100, flush_interval=60)
+        started, release = threading.Event(), threading.Event()
+        write = writer.write
+
+        def slow_write(documents):
+            started.set()
+            release.wait(5)
+            return write(documents)
+
+        writer.write = slow_write
+        document_id = writer.add({'url': 'http://example.com/'})
+        # Another thread (the timer, in practice) takes the batch first
+        other = threading.Thread(target=writer.flush)
+        other.start()
+        self.assertTrue(started.wait(5))
+        # Still pending while its insert runs
+        self.assertEqual(len(writer.pending()), 1)
+
+        flushed = threading.Event()
+        caller = threading.Thread(target=lambda: (writer.flush(), flushed.set()))
+        caller.start()
+        self.assertFalse(flushed.wait(0.1))
+
+        release.set()
+        self.assertTrue(flushed.wait(5))
+        caller.join()
+        other.join()
+        self.assertEqual(str(self.mongo_client.collection.find_one()['_id']), document_id)
+
+    def test_close_writes_the_rest(self):
+        writer = self.writer(batch_size=100, flush_interval=60)
+        for i in range(5):
+            writer.add({'url': f'http://example.com/{i}'})
+        writer.close()
+        self.assertEqual(self.count(), 5)
+
+    def unreachable(self, writer):
+        """Make the next insert_many fail as if the server went away"""
+        collection = writer.collection
+
+        class Unreachable:
+            def insert_many(self, documents, ordered=True):
+                writer.collection = collection
+                raise AutoReconnect('connection closed')
+
+        writer.collection = lambda: Unreachable()
+
+    def test_connection_error_requeues_batch(self):
+        writer = self.writer(batch_size=100, flush_interval=60, retries=3)
+        retried = []
+        writer.retry = retried.append
+        self.unreachable(writer)
+        ids = [writer.add({'url': f'http://example.com/{i}'}) for i in range(3)]
+        writer.flush()
+        # Not retried one by one, kept in order for the next attempt
+        self.assertEqual(retried, [])
+        self.assertEqual([str(document['_id']) for document in writer.pending()], ids)
+        self.assertGreater(writer.retry_at, time.monotonic())
+
+        writer.flush()
+        self.assertEqual(self.count(), 3)
+        self.assertEqual(writer.pending(), [])
+        self.assertEqual(writer.failures, 0)
+
+    def test_add_waits_for_room(self):
+        writer = self.writer(batch_size=2, flush_interval=60, max_pending=2, max_wait=0.05)
+        self.unreachable(writer)
+        writer.add({'url': 'http://example.com/1'})
+        writer.add({'url': 'http://example.com/2'})
+        self.assertEqual(len(writer.pending()), 2)
+        # Backing off, so the add doesn't flush and the buffer stays full
+        with self.assertRaises(BufferFull):
+            writer.add({'url': 'http://example.com/3'})
+
+        added = threading.Event()
+        adder = threading.Thread(target=lambda: (writer.add({'url': 'http://example.com/3'}), added.set()))
+        writer.max_wait = 5
+        adder.start()
+        self.assertFalse(added.wait(0.1))
+        writer.flush()
+        self.assertTrue(added.wait(5))
+        adder.join()
+        self.assertEqual(self.count(), 2)
+        self.assertEqual(len(writer.pending()), 1)
+
+
+def random_text(words=500, seed=0):
+    vocabulary = [f'word{i}' for i in range(2000)]
+    chooser = random.Random(seed)
+    return ' '.join(chooser.choice(vocabulary) for _ in range(words))
+
+
+class FakeResponse:
+    """Just enough of a requests.Response for WebScraper"""
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.declared_encoding = None
+        self.truncated = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AssertionError(f'unexpected status {self.status_code}')
+
+
+@skipUnless(mongomock, 'mongomock is not installed')
+class JobQueueTests(SimpleTestCase):
+
+    def setUp(self):
+        self.queue = JobQueue(mock_client())
+
+    def test_claims_oldest_pending_job_once(self):
+        first = self.queue.enqueue('http://example.com/1')
+        second = self.queue.enqueue('http://example.com/2')
+
+        job = self.queue.claim('worker-a')
+        self.assertEqual(str(job['_id']), first)
+        self.assertEqual(job['status'], 'running')
+        self.assertEqual(job['worker_id'], 'worker-a')
+        self.assertEqual(str(self.queue.claim('worker-b')['_id']), second)
+        self.assertIsNone(self.queue.claim('worker-c'))
+        self.assertEqual(self.queue.depth(), {'pending': 0, 'running': 2})
+
+    def test_requeues_jobs_past_their_lease(self):
+        job_id = self.queue.enqueue('http://example.com/')
+        self.queue.claim('worker-a')
+        self.assertEqual(self.queue.requeue_stale(300), 0)
+
+        time.sleep(0.01)
+        self.assertEqual(self.queue.requeue_stale(0), 1)
+        job = self.queue.claim('worker-b')
+        self.assertEqual(str(job['_id']), job_id)
+        self.assertEqual(job['worker_id'], 'worker-b')
+
+    def test_complete_keeps_url(self):
+        job_id = self.queue.enqueue('http://example.com/')
+        self.queue.claim('worker-a')
+        self.queue.complete(job_id, {'title': 'Example', 'main_content': 'Hello'})
+        status = self.queue.get_status(job_id)
+        self.assertEqual(status['status'], 'success')
+        self.assertEqual(status['url'], 'http://example.com/')
+
+    @override_settings(SCRAPER_SELECTOR_PROFILES=False)
+    def test_worker_scrapes_requested_fields(self):
+        request = RequestFactory().post('/api/scrape/', json.dumps(
+            {'url': 'http://example.com/', 'async': True, 'fields': 'links,title'}), content_type='application/json')
+        with mock.patch.object(views, 'job_queue', self.queue):
+            response = views.api_scrape(request)
+        self.assertEqual(response.status_code, 202)
+
+        job = self.queue.claim('worker-a')
+        self.assertEqual(job['requested_fields'], ['title', 'links'])
+        page = b'<html><head><title>T</title></head><body><a href="/x">x</a></body></html>'
+        with mock.patch.object(WebScraper, 'request', return_value=FakeResponse(200, page)), \
+                mock.patch.object(FetchCache, 'get_default', return_value=None):
+            run_job(self.queue, job)
+        content = self.queue.mongo_client.get_scraped_content(json.loads(response.content)['id'])
+        self.assertEqual(set(content), {'url', 'scraped_at', 'title', 'links'})
+
+
+@skipUnless(mongomock, 'mongomock is not installed')
+@override_settings(SCRAPER_SELECTOR_PROFILES=False)
+class FetchCacheTests(SimpleTestCase):
+    url = 'http://example.com/page'
+    page = b'<html><head><title>Cached</title></head><body><main>' + b'Some text. ' * 40 + b'</main></body></html>'
+
+    def setUp(self):
+        self.cache = FetchCache(mongomock.MongoClient().db['fetch_cache'], max_bytes=10 ** 9, ttl_seconds=3600)
+        patcher = mock.patch.object(FetchCache, 'get_default', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self, response):
+        scraper = WebScraper(self.url)
+        with mock.patch.object(WebScraper, 'request', return_value=response) as request:
+            data, error = scraper.scrape()
+        self.assertIsNone(error)
+        return data, request.call_args
+
+    def test_not_modified_reuses_cached_result(self):
+        first, _ = self.scrape(FakeResponse(200, self.page, {'ETag': '"v1"'}))
+        self.assertEqual(self.cache.collection.count_documents({}), 1)
+
+        with mock.patch.object(WebScraper, 'parse') as parse:
+            second, call = self.scrape(FakeResponse(304))
+        parse.assert_not_called()
+        self.assertEqual(call.args[0], {'If-None-Match': '"v1"'})
+        self.assertEqual(second['title'], first['title'])
+        self.assertEqual(second['main_content'], first['main_content'])
+
+    def test_pages_without_validators_are_not_cached(self):
+        self.scrape(FakeResponse(200, self.page))
+        self.assertEqual(self.cache.collection.count_documents({}), 0)
+
+    def test_oversized_result_is_not_cached(self):
+        with mock.patch('scraper.fetch_cache.MAX_ENTRY_BYTES', 100):
+            self.cache.store(self.url, {'ETag': '"v1"'}, b'<html></html>', {'main_content': 'x' * 200}, 'parser')
+        self.assertEqual(self.cache.collection.count_documents({}), 0)
+
+
+class SimHashTests(SimpleTestCase):
+
+    def test_near_duplicates_share_a_band(self):
+        text = random_text()
+        words = text.split()
+        words[50] = 'changed'
+        original, edited = simhash(text), simhash(' '.join(words))
+        self.assertLessEqual(hamming_distance(original, edited), MAX_DISTANCE)
+        self.assertTrue(set(bands(original)) & set(bands(edited)))
+
+    def test_unrelated_texts_are_far_apart(self):
+        first, second = simhash(random_text(seed=1)), simhash(random_text(seed=2))
+        self.assertGreater(hamming_distance(first, second), MAX_DISTANCE)
+        self.assertFalse(set(bands(first)) & set(bands(second)))
+
+    def test_short_texts_are_not_fingerprinted(self):
+        self.assertIsNone(simhash('too short to tell'))
+
+    def test_bands_are_tagged_with_their_position(self):
+        # The same 16 bits in different positions must not match
+        self.assertEqual(len(set(bands(0))), len(bands(0)))
+
+    @skipUnless(mongomock, 'mongomock is not installed')
+    def test_saved_near_duplicate_is_flagged(self):
+        mongo_client = mock_client()
+        text = random_text()
+        original_id = mongo_client.save_scraped_data('http://a.example/', {'title': 'A', 'main_content': text})
+        copy_id = mongo_client.save_scraped_data('http://b.example/', {'title': 'B', 'main_content': text + ' footer'})
+        other_id = mongo_client.save_scraped_data('http://c.example/', {'title': 'C', 'main_content': random_text(seed=3)})
+
+        copy = mongo_client.get_scraped_data(copy_id)
+        self.assertEqual(str(copy['duplicate_of']), original_id)
+        self.assertIsNone(mongo_client.get_scraped_data(other_id)['duplicate_of'])
+
+        with override_settings(SCRAPER_DUPLICATES='skip'):
+            self.assertEqual(mongo_client.save_scraped_data('http://d.example/', {'main_content': text}), original_id)
+        self.assertEqual(mongo_client.collection.count_documents({}), 3)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_one_run(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        def call():
+            results.append(flights.do('key', work))
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Let every thread reach do() before the leader finishes
+        deadline = time.monotonic() + 5
+        while not calls and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ['result'] * 5)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True, True])
+
+    def test_errors_reach_every_caller_and_are_not_kept(self):
+        flights = SingleFlight()
+
+        def fail():
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            flights.do('key', fail)
+        self.assertEqual(flights.do('key', lambda: 'retried'), ('retried', False))
+
+
+@skipUnless(mongomock, 'mongomock is not installed')
+class SiteCrawlerTests(SimpleTestCase):
+    seed = 'http://example.com/0'
+
+    def setUp(self):
+        self.mongo_client = mock_client()
+        patcher = mock.patch.object(SiteCrawler, 'fetch', self.fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fetched = []
+
+    def fetch(self, entry):
+        # Page n links to pages 2n+1 and 2n+2
+        number = int(entry['url'].rsplit('/', 1)[1])
+        self.fetched.append(number)
+        links = [f'http://example.com/{number * 2 + 1}', f'http://example.com/{number * 2 + 2}']
+        return entry, {'title': f'Page {number}', 'main_content': 'Short page'}, None, links
+
+    def test_resume_continues_where_the_budget_ran_out(self):
+        crawler = SiteCrawler.create(self.seed, max_depth=5, max_pages=5, mongo_client=self.mongo_client)
+        crawl = crawler.run(workers=1)
+        self.assertEqual(crawl['status'], 'limited')
+        self.assertEqual(crawl['pages'], 5)
+
+        crawler = SiteCrawler.load(str(crawl['_id']), self.mongo_client)
+        crawler.extend(12)
+        crawl = crawler.run(workers=1)
+        self.assertEqual(crawl['pages'], 12)
+        # Breadth-first, and no page crawled twice
+        self.assertEqual(self.fetched, list(range(12)))
+        self.assertEqual(self.mongo_client.collection.count_documents({'crawl_id': crawl['_id']}), 12)
+
+    def test_unsaved_pages_are_crawled_again(self):
+        crawler = SiteCrawler.create(self.seed, max_depth=5, max_pages=3, mongo_client=self.mongo_client)
+        with mock.patch.object(self.mongo_client, 'save_many', side_effect=AutoReconnect('down')):
+            with self.assertRaises(AutoReconnect):
+                crawler.run(workers=1)
+
+        crawler = SiteCrawler.load(str(crawler.crawl_id), self.mongo_client)
+        self.assertEqual(set(crawler.frontier.distinct('status')), {PENDING})
+        self.fetched.clear()
+        crawler.run(workers=1)
+        self.assertEqual(self.fetched, [0, 1, 2])
+
+    def test_extend_grows_the_seen_set(self):
+        crawler = SiteCrawler.create(self.seed, max_depth=5, max_pages=5, mongo_client=self.mongo_client)
+        crawler.run(workers=1)
+        queued = crawler.frontier.distinct('url')
+        bits = crawler.seen.num_bits
+
+        crawler.extend(100000)
+        self.assertGreater(crawler.seen.num_bits, bits)
+        self.assertTrue(all(url in crawler.seen for url in queued))
+
+
+class LegacyExtractors:
+    """WebScraper's per-field extractors from before ExtractionEngine, which reparsed the page for each field"""
+
+    def __init__(self, is_navigation):
+        self.is_navigation = is_navigation
+
+    def title(self, soup):
+        title_tag = soup.find('title')
+        return title_tag.get_text().strip() if title_tag else ''
+
+    def headings(self, soup):
+        return {f'h{i}': [tag.get_text().strip() for tag in soup.find_all(f'h{i}')] for i in range(1, 7)}
+
+    def clean_paragraphs(self, soup):
+        soup_copy = BeautifulSoup(str(soup), 'html.parser')
+        for element in soup_copy(['nav', 'header', 'footer', 'aside', 'script', 'style', 'noscript']):
+            element.decompose()
+        for class_name in ['ad', 'advertisement', 'sidebar', 'navigation', 'nav', 'menu', 'footer', 'header']:
+            for element in soup_copy.find_all(class_=lambda x: x and class_name in str(x).lower()):
+                element.decompose()
+        paragraphs = []
+        for p in soup_copy.find_all('p'):
+            text = p.get_text().strip()
+            if len(text) > 20 and not self.is_navigation(text):
+                paragraphs.append(text)
+        return paragraphs
+
+    def main_content(self, soup):
+        soup_copy = BeautifulSoup(str(soup), 'html.parser')
+        selectors = ['main', 'article', '[role="main"]', '.content', '.main-content', '.article-content',
+                     '.post-content', '.entry-content', '.text', '#content', '.container .row .col']
+        main_content = ''
+        for selector in selectors:
+            content_area = soup_copy.select_one(selector)
+            if content_area:
+                for unwanted in content_area(['script', 'style', 'nav', 'aside', 'footer', 'header']):
+                    unwanted.decompose()
+                main_content = content_area.get_text(strip=True, separator='\n\n')
+                if len(main_content) > 100:
+                    break
+        if not main_content or len(main_content) < 100:
+            body = soup_copy.find('body')
+            if body:
+                for element in body(['nav', 'header', 'footer', 'aside', 'script', 'style']):
+                    element.decompose()
+                main_content = body.get_text(strip=True, separator='\n\n')
+        return main_content
+
+
+class ExtractionEngineTests(SimpleTestCase):
+    nested_pages = {
+        'unclosed_p': '<html><body><div><p>text<p>more text that is long enough</p></p></div></body></html>',
+        'deeply_unclosed': (
+            '<html><body><main><p>First paragraph with enough words in it<p>Second paragraph '
+            'with enough words in it<p>Third paragraph with enough words in it</main></body></html>'),
+        'nested_excluded': (
+            '<html><body><p>Outer paragraph with some words <aside><p>inside an aside with '
+            'words</p></aside> and more words after it</p><div class="sidebar"><p>Sidebar '
+            'paragraph that has enough words</p></div></body></html>'),
+    }
+
+    def setUp(self):
+        scraper = WebScraper('http://example.com/', use_cache=False)
+        self.engine = ExtractionEngine(is_navigation=scraper.is_likely_navigation, mode='heuristic')
+        self.legacy = LegacyExtractors(scraper.is_likely_navigation)
+
+    def assert_same_as_legacy(self, name, content):
+        soup = self.engine.parse(content)
+        extracted = self.engine.extract(soup, fields=('title', 'headings', 'paragraphs', 'main_content', 'word_count'))
+        expected = {
+            'title': self.legacy.title(soup),
+            'headings': self.legacy.headings(soup),
+            'paragraphs': self.legacy.clean_paragraphs(soup),
+            'main_content': self.legacy.main_content(soup),
+        }
+        expected['word_count'] = len(expected['main_content'].split())
+        for field, value in expected.items():
+            self.assertEqual(extracted[field], value, f'{field} differs on {name}')
+
+    def test_matches_legacy_extractors_on_benchmark_fixtures(self):
+        fixtures = load_fixtures()
+        self.assertTrue(fixtures)
+        for name, content in fixtures.items():
+            with self.subTest(fixture=name):
+                self.assert_same_as_legacy(name, content)
+
+    def test_matches_legacy_extractors_on_nested_paragraphs(self):
+        for name, content in self.nested_pages.items():
+            with self.subTest(page=name):
+                self.assert_same_as_legacy(name, content)
+
+    def test_nested_paragraphs_keep_document_order(self):
+        soup = self.engine.parse(self.nested_pages['unclosed_p'])
+        self.assertEqual(self.engine.walk(soup)[2], ['textmore text that is long enough', 'more text that is long enough'])
+
+
+class DensityClassifierTests(SimpleTestCase):
+    article = ''.join(f'<p>Paragraph {i} of the article has enough words to count as content.</p>' for i in range(10))
+
+    def setUp(self):
+        scraper = WebScraper('http://example.com/', use_cache=False)
+        self.engine = ExtractionEngine(is_navigation=scraper.is_likely_navigation, mode='density')
+
+    def extract(self, html):
+        return self.engine.extract(self.engine.parse(html), fields=('main_content', 'paragraphs'))
+
+    def test_page_wrapped_in_a_form_keeps_its_content(self):
+        extracted = self.extract(
+            '<html><body><form id="aspnetForm" method="post"><div id="content">'
+            f'{self.article}</div></form></body></html>')
+        self.assertIn('Paragraph 9 of the article', extracted['main_content'])
+        self.assertEqual(len(extracted['paragraphs']), 10)
+
+    def test_link_heavy_form_is_dropped(self):
+        menu = ''.join(f'<a href="/{i}">Category number {i}</a>' for i in range(20))
+        extracted = self.extract(f'<html><body><form>{menu}</form><article>{self.article}</article></body></html>')
+        self.assertNotIn('Category number', extracted['main_content'])
+
+    def test_runner_up_is_used_when_best_block_is_dropped(self):
+        # The biggest block sits inside an <aside>, which is dropped after it closes
+        sidebar = 'Sidebar text about something else entirely. ' * 30
+        extracted = self.extract(
+            f'<html><body><div class="post">{self.article}</div>'
+            f'<aside><div>{sidebar}</div></aside><p>Footer note that is short</p></body></html>')
+        self.assertTrue(extracted['main_content'].startswith('Paragraph 0 of the article'))
+        self.assertNotIn('Sidebar text', extracted['main_content'])
+        self.assertNotIn('Footer note', extracted['main_content'])
+
+
+class CappedRetryTests(SimpleTestCase):
+
+    def retry(self, **options):
+        return CappedRetry(total=3, backoff_factor=0.5, status_forcelist=(503,), max_retry_after=60, **options)
+
+    def response(self, retry_after):
+        return HTTPResponse(status=503, headers={'Retry-After': retry_after}, preload_content=False)
+
+    def test_gives_up_on_long_retry_after(self):
+        with self.assertRaises(MaxRetryError):
+            self.retry().increment('GET', '/', response=self.response('3600'))
+
+    def test_retries_short_retry_after(self):
+        retry = self.retry().increment('GET', '/', response=self.response('5'))
+        self.assertEqual(retry.total, 2)
+        # The limit survives urllib3 copying the Retry on each attempt
+        self.assertEqual(retry.max_retry_after, 60)
+
+    def test_next_wait_follows_the_same_policy(self):
+        retry = self.retry()
+        self.assertEqual(retry.next_wait(1), 0)
+        self.assertEqual(retry.next_wait(3), 2)
+        self.assertEqual(retry.next_wait(1, retry_after='5'), 5)
+        self.assertIsNone(retry.next_wait(1, retry_after='3600'))
+        self.assertIsNone(retry.next_wait(4))
+
+
+class BodyLimitTests(SimpleTestCase):
+
+    def test_rejects_declared_length_over_limit(self):
+        limit = BodyLimit('http://example.com/', max_bytes=100)
+        with self.assertRaises(ResponseTooLarge):
+            limit.check_headers(200, {'Content-Type': 'text/html', 'Content-Length': '101'})
+
+    def test_rejects_unsupported_content_type(self):
+        limit = BodyLimit('http://example.com/', max_bytes=100)
+        with self.assertRaises(UnsupportedContentType):
+            limit.check_headers(200, {'Content-Type': 'application/pdf'})
+        # Error pages are left for raise_for_status
+        limit.check_headers(404, {'Content-Type': 'application/pdf'})
+
+    def test_rejects_body_over_limit(self):
+        limit = BodyLimit('http://example.com/', max_bytes=100)
+        self.assertTrue(limit.add(b'x' * 60))
+        with self.assertRaises(ResponseTooLarge):
+            limit.add(b'x' * 60)
+
+    def test_truncates_body(self):
+        limit = BodyLimit('http://example.com/', max_bytes=100, truncate=True)
+        limit.check_headers(200, {'Content-Type': 'text/html', 'Content-Length': '500'})
+        self.assertTrue(limit.add(b'x' * 60))
+        self.assertFalse(limit.add(b'x' * 60))
+        self.assertEqual(limit.body, b'x' * 100)
+        self.assertTrue(limit.truncated)
+
+    def test_sniffs_charset_from_meta(self):
+        limit = BodyLimit('http://example.com/', max_bytes=10000)
+        limit.check_headers(200, {'Content-Type': 'text/html'})
+        limit.add(b'<html><head><meta charset="windows-1251">' + b' ' * 2000)
+        # Known once the first SNIFF_BYTES have arrived
+        self.assertEqual(limit.encoding, 'cp1251')
+
+
+@skipUnless(mongomock, 'mongomock is not installed')
+class DownloadJsonTests(SimpleTestCase):
+    data = {'title': 'Download', 'main_content': 'Some text. ' * 40, 'headings': {'h1': ['One'], 'h2': ['Two']}}
+
+    def setUp(self):
+        self.mongo_client = mock_client()
+        patcher = mock.patch.object(views, 'mongo_client', self.mongo_client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pk = self.mongo_client.save_scraped_data('http://example.com/', self.data)
+        self.factory = RequestFactory()
+
+    def download(self, **headers):
+        return views.download_json(self.factory.get(f'/download/{self.pk}/', **headers), pk=self.pk)
+
+    def test_streams_json_with_etag(self):
+        response = self.download()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'].startswith(f'W/"{self.pk}-'))
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), self.data)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.download()['ETag']
+        with mock.patch.object(self.mongo_client, 'iter_json') as iter_json:
+            response = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        iter_json.assert_not_called()
+        self.assertEqual(self.download(HTTP_IF_NONE_MATCH='W/"other"').status_code, 200)
+
+    def test_gzip_body_matches_plain(self):
+        response = self.download(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        # Same weak ETag for both encodings
+        self.assertEqual(response['ETag'], self.download()['ETag'])
+        self.assertEqual(json.loads(gzip.decompress(b''.join(response.streaming_content))), self.data)
+
+    def test_failed_scrape_has_no_download(self):
+        pk = self.mongo_client.save_scraped_data('http://example.com/', {}, status='error', error_message='boom')
+        with self.assertRaises(Http404):
+            views.download_json(self.factory.get(f'/download/{pk}/'), pk=pk)
+
+
+@skipUnless(mongomock, 'mongomock is not installed')
+class SearchCursorTests(SimpleTestCase):
+    """Keyset pages built from encode_cursor/decode_cursor, as search() builds them.
+
+    mongomock has no $text, so the score is stored instead of computed.
+    """
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db['pages']
+        created_at = datetime(2024, 1, 1)
+        # Repeated keys, so pages have to fall back to _id
+        self.collection.insert_many([
+            {'_id': ObjectId(), 'created_at': created_at + timedelta(minutes=i // 3), 'score': float(i % 4)}
+            for i in range(20)
+        ])
+
+    def pages(self, order, limit=3):
+        field = 'score' if order == 'relevance' else 'created_at'
+        cursor, seen = None, []
+        while True:
+            query = decode_cursor(order, cursor) if cursor else {}
+            documents = list(self.collection.find(query)
+                             .sort([(field, DESCENDING), ('_id', DESCENDING)]).limit(limit + 1))
+            seen += [document['_id'] for document in documents[:limit]]
+            if len(documents) <= limit:
+                return seen
+            cursor = encode_cursor(order, documents[limit - 1])
+
+    def test_pages_cover_every_document_once(self):
+        for order, field in (('relevance', 'score'), ('newest', 'created_at')):
+            expected = [document['_id'] for document in
+                        self.collection.find().sort([(field, DESCENDING), ('_id', DESCENDING)])]
+            self.assertEqual(self.pages(order), expected)
+
+    def test_rejects_foreign_cursors(self):
+        document = self.collection.find_one()
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('relevance', encode_cursor('newest', document))
+        for cursor in ('not a cursor', 'W10', encode_cursor('newest', document)[:-4]):
+            with self.assertRaises(InvalidCursor):
+                decode_cursor('newest', cursor)
+
+
+class ParseFieldsTests(SimpleTestCase):
+
+    def test_defaults_when_nothing_requested(self):
+        for value in (None, '', [], ' , '):
+            self.assertEqual(parse_fields(value), DEFAULT_FIELDS)
+
+    def test_returns_fields_in_canonical_order(self):
+        self.assertEqual(parse_fields('links, title'), ('title', 'links'))
+        self.assertEqual(parse_fields(['meta', 'title', 'meta']), ('title', 'meta'))
+
+    def test_rejects_unknown_and_malformed_fields(self):
+        with self.assertRaisesRegex(ValueError, 'Unknown fields body'):
+            parse_fields('title,body')
+        for value in ({'title': True}, ['title', 1], 5):
+            with self.assertRaises(ValueError):
+                parse_fields(value)
+
+    @override_settings(SCRAPER_SELECTOR_PROFILES=False)
+    def test_scrape_returns_requested_fields(self):
+        page = b'<html><head><title>T</title></head><body><a href="/x">x</a><p>' + b'Text. ' * 40 + b'</p></body></html>'
+        scraper = WebScraper('http://example.com/', use_cache=False, fields=parse_fields('title,links'))
+        with mock.patch.object(WebScraper, 'request', return_value=FakeResponse(200, page)):
+            data, error = scraper.scrape()
+        self.assertIsNone(error)
+        self.assertEqual(set(data), {'url', 'scraped_at', 'title', 'links'})
+        self.assertEqual(data['links'][0]['absolute_url'], 'http://example.com/x')
+
+    def test_api_rejects_unknown_fields(self):
+        request = RequestFactory().post('/api/scrape/', json.dumps({'url': 'http://example.com/', 'fields': ['body']}),
+                                        content_type='application/json')
+        with mock.patch.object(views, 'scrape_url') as scrape:
+            response = views.api_scrape(request)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unknown fields body', json.loads(response.content)['error'])
+        scrape.assert_not_called()
+
+
+class ScrapePipelineTests(SimpleTestCase):
+
+    @override_settings(SCRAPER_HTTP_PER_HOST=8)
+    def test_per_host_does_not_change_shared_client(self):
+        pipeline = ScrapePipeline(fetch_workers=2, parse_workers=0, per_host=3)
+        self.assertEqual(pipeline.http.host_limiter.per_host, 3)
+        self.assertEqual(HttpClient.get_default().host_limiter.per_host, 8)
+        self.assertIs(ScrapePipeline(parse_workers=0).http, HttpClient.get_default())
+
+
+class SelectorProfilesTests(SimpleTestCase):
+
+    def test_learns_and_invalidates_selector(self):
+        profiles = SelectorProfiles()
+        profiles.learn('example.com', 'article')
+        self.assertEqual(profiles.preferred('example.com'), 'article')
+        for _ in range(MAX_MISSES):
+            profiles.learn('example.com', 'main')
+        self.assertEqual(profiles.get('example.com'), {'selector': 'main', 'misses': 0})
+
+    @mock.patch('scraper.selector_profiles.MAX_MISSES', 100)
+    def test_concurrent_misses_are_all_counted(self):
+        profiles = SelectorProfiles()
+        profiles.learn('example.com', 'article')
+        # Slow down reading the count so unlocked updates would be lost
+        profile_class = type('SlowProfile', (dict,), {
+            '__getitem__': lambda self, key: (dict.__getitem__(self, key), key == 'misses' and time.sleep(0.01))[0]})
+        profiles.entries['example.com'] = profile = profile_class(profiles.get('example.com'))
+        threads = [threading.Thread(target=profiles.learn, args=('example.com', None)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(dict.__getitem__(profile, 'misses'), 10)
+        self.assertEqual(profile['selector'], 'article')
+
+    def test_mongodb_outage_does_not_fail_lookups(self):
+        mongo_client = mock.Mock()
+        mongo_client.db.__getitem__ = mock.Mock(return_value=mock.Mock(
+            find_one=mock.Mock(side_effect=AutoReconnect('down')),
+            update_one=mock.Mock(side_effect=AutoReconnect('down'))))
+        profiles = SelectorProfiles(mongo_client=mongo_client)
+        # Nothing is opened until a profile is needed
+        mongo_client.db.__getitem__.assert_not_called()
+
+        self.assertIsNone(profiles.preferred('a.example'))
+        profiles.learn('a.example', 'article')
+        self.assertEqual(profiles.preferred('a.example'), 'article')
+        # Offline now, so other hosts don't wait on the server either
+        self.assertIsNone(profiles.preferred('b.example'))
+        collection = mongo_client.db['selector_profiles']
+        self.assertEqual(collection.find_one.call_count, 1)
+
+
+@mock.patch('scraper.politeness.SWEEP_INTERVAL', 0)
+class PolitenessStateTests(SimpleTestCase):
+
+    def test_expired_robots_rules_are_dropped(self):
+        robots = RobotsCache(lambda url: FakeResponse(404), 'test', ttl=0)
+        robots.get('http://a.example/page')
+        robots.get('http://b.example/page')
+        self.assertEqual(set(robots.entries), {'http://b.example'})
+        self.assertEqual(set(robots.site_locks), {'http://b.example'})
+
+    def test_past_slots_are_dropped(self):
+        scheduler = HostScheduler(rate=1000)
+        scheduler.reserve('http://a.example/')
+        time.sleep(0.01)
+        scheduler.reserve('http://b.example/')
+        self.assertEqual(set(scheduler.next_slot), {'b.example'})
+
+    def test_wait_stats_keep_recent_hosts(self):
+        scheduler = HostScheduler(rate=0, max_hosts=2)
+        for host in ('a', 'b', 'a', 'c'):
+            scheduler.record_wait(f'http://{host}.example/', 0.5)
+        self.assertEqual(list(scheduler.stats()), ['a.example', 'c.example'])
+        self.assertEqual(scheduler.stats()['a.example']['requests'], 2)
+
+
+class StreamingASGIHandlerTests(SimpleTestCase):
+
+    def test_streams_parts_without_blocking_the_loop(self):
+        loop_thread = threading.get_ident()
+        part_threads = []
+
+        def parts():
+            for i in range(3):
+                part_threads.append(threading.get_ident())
+                # A blocking wait, like a scrape
+                time.sleep(0.05)
+                yield f'line {i}\n'
+
+        response = StreamingHttpResponse(parts(), content_type='application/x-ndjson')
+        messages = []
+        ticks = []
+
+        async def send(message):
+            messages.append(message)
+
+        async def tick():
+            while True:
+                ticks.append(len(messages))
+                await asyncio.sleep(0.01)
+
+        async def run():
+            ticker = asyncio.ensure_future(tick())
+            await StreamingASGIHandler().send_response(response, send)
+            ticker.cancel()
+
+        asyncio.run(run())
+        self.assertEqual(messages[0]['type'], 'http.response.start')
+        self.assertIn((b'Content-Type', b'application/x-ndjson'), messages[0]['headers'])
+        self.assertEqual([message.get('body') for message in messages[1:]],
+                         [b'line 0\n', b'line 1\n', b'line 2\n', None])
+        self.assertNotIn(loop_thread, part_threads)
+        # The loop kept running while each part was produced
+        self.assertGreater(len(ticks), 6)
+
+
+class MetricsTests(SimpleTestCase):
+
+    def test_collected_observations_replay_elsewhere(self):
+        counter = metrics.Counter('test_replay_total', 'Test counter', ['result'])
+        histogram = metrics.Histogram('test_replay_seconds', 'Test histogram', ['phase'])
+        self.addCleanup(lambda: [metrics.REGISTRY.remove(metric) for metric in (counter, histogram)])
+        with metrics.collect() as observations:
+            counter.inc(result='ok')
+            histogram.observe(0.2, phase='parse')
+        counter.inc(result='outside')
+        self.assertEqual(observations, [('test_replay_total', 1, {'result': 'ok'}),
+                                        ('test_replay_seconds', 0.2, {'phase': 'parse'})])
+
+        # As the parent process would after a worker sent them back
+        metrics.replay(observations)
+        self.assertEqual(counter.values[('ok',)], 2)
+        self.assertEqual(histogram.values[('parse',)][-1], 2)
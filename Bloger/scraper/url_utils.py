@@ -0,0 +1,35 @@
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """Canonical form of a URL so equivalent spellings share one key.
+
+    Lowercases scheme and host, drops default ports and fragments, sorts
+    query parameters and uses '/' for an empty path.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if ':' in host:
+        host = f'[{host}]'  # IPv6 literal
+
+    netloc = host
+    if parts.username:
+        userinfo = parts.username
+        if parts.password:
+            userinfo += f':{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+    if port and DEFAULT_PORTS.get(scheme) != port:
+        netloc += f':{port}'
+
+    path = parts.path or '/'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
@@ -1,12 +1,24 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import views, async_views
 
 app_name = 'scraper'
 
+# Under ASGI the scrape views can run as coroutines instead of holding a thread
+scrape_views = async_views if getattr(settings, 'SCRAPER_ASYNC_VIEWS', False) else views
+
 urlpatterns = [
-    path('', views.index, name='index'),
+    path('', scrape_views.index, name='index'),
     path('detail/<str:pk>/', views.detail, name='detail'),
     path('download/<str:pk>/', views.download_json, name='download'),
-    path('download/', views.index, name='download_empty'),
-    path('api/scrape/', views.api_scrape, name='api_scrape'),
+    path('download/', scrape_views.index, name='download_empty'),
+    path('search/', views.search, name='search'),
+    path('api/search/', views.api_search, name='api_search'),
+    path('api/scrape/', scrape_views.api_scrape, name='api_scrape'),
+    path('api/scrape/batch/', scrape_views.api_scrape_batch, name='api_scrape_batch'),
+    path('api/jobs/', views.queue_stats, name='queue_stats'),
+    path('api/jobs/<str:pk>/', views.job_status, name='job_status'),
+    path('api/hosts/', views.host_stats, name='host_stats'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('health/', views.health, name='health'),
 ]
\ No newline at end of file
@@ -2,42 +2,146 @@ import requests
 from bs4 import BeautifulSoup
 import json
 import os
+import time
 from urllib.parse import urljoin, urlparse
 from django.conf import settings
 from django.utils import timezone
+from bson.errors import InvalidDocument
+from pymongo.errors import PyMongoError
+from .extraction import ExtractionEngine, NAVIGATION_PATTERN, parse_fields
+from .fetch_cache import FetchCache
+from .http_client import HttpClient, USER_AGENT
+from .metrics import collect, finish_scrape, observe_extractor, record_error, timed, trace_scrape
+from .politeness import host_of
+from .selector_profiles import SelectorProfiles
 
 class WebScraper:
-    def __init__(self, url):
+    # Fields extracted by WebScraper itself rather than the engine
+    EXTRACTORS = {'links': 'extract_links', 'images': 'extract_images', 'meta': 'extract_meta_tags'}
+
+    def __init__(self, url, parser=None, use_cache=True, fields=None, http=None):
         self.url = url
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        })
+        self.engine = ExtractionEngine(parser=parser, is_navigation=self.is_likely_navigation,
+                                       profiles=self.selector_profiles(use_cache))
+        self.use_cache = use_cache
+        # Only these fields are extracted (see extraction.FIELDS)
+        self.fields = parse_fields(fields)
+        # Pooled client shared by all scrapers in this process, unless the
+        # caller has one of its own
+        self.http = http or HttpClient.get_default()
 
     def scrape(self):
+        with trace_scrape(self.url) as trace:
+            try:
+                response, data = self.revalidate()
+                if data is None:
+                    data = self.parse_response(response)
+                    self.remember(response, data)
+                    finish_scrape(trace, 'success')
+                else:
+                    finish_scrape(trace, 'not_modified')
+                return data, None
+                
+            except requests.exceptions.RequestException as e:
+                error = f"Request error: {str(e)}"
+                record_error('request', e)
+            except Exception as e:
+                error = f"Scraping error: {str(e)}"
+                record_error('scraping', e)
+            finish_scrape(trace, 'error', error)
+            return None, error
+
+    def request(self, headers=None):
+        return self.http.get(self.url, headers=headers)
+
+    def fetch(self):
+        """Download the page and return the raw response body"""
+        response = self.request()
+        response.raise_for_status()
+        return response.content
+
+    def revalidate(self):
+        """Conditional GET against the fetch cache.
+        
+        Returns (response, data). data is the cached result when the server
+        answers 304 Not Modified; otherwise it is None and response holds the
+        freshly downloaded page.
+        """
+        cached = self._cache_call('lookup', self.url)
+        headers = FetchCache.conditional_headers(cached)
+        response = self.request(headers)
+        
+        if cached and response.status_code == 304:
+            return response, self.reuse_cached(cached)
+        
+        response.raise_for_status()
+        return response, None
+
+    def reuse_cached(self, cached):
+        """Result for a page the server confirmed unchanged"""
+        result = cached.get('result')
+        if (cached.get('parser') == self.engine.cache_key and result
+                and all(field in result for field in self.fields)):
+            data = {'url': self.url}
+            data.update((field, result[field]) for field in self.fields)
+            if result.get('truncated'):
+                data['truncated'] = True
+            data['scraped_at'] = str(timezone.now())
+            self._cache_call('revalidated', cached)
+        else:
+            # Extraction settings changed since the page was cached, or it
+            # was cached without some of the requested fields
+            data = self.parse(FetchCache.body(cached))
+            self._cache_call('revalidated', cached, data, self.engine.cache_key)
+        return data
+
+    def remember(self, response, data):
+        """Store a downloaded page and its result in the fetch cache"""
+        self._cache_call('store', self.url, response.headers, response.content, data, self.engine.cache_key)
+
+    @staticmethod
+    def selector_profiles(use_cache):
+        # Like the fetch cache, learned selectors are skipped with use_cache=False
+        # so results only depend on the page
+        return SelectorProfiles.get_default() if use_cache else None
+
+    def _cache_call(self, method, *args):
+        # Cache problems should never fail a scrape
+        if not self.use_cache:
+            return None
         try:
-            response = self.session.get(self.url, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
-            # Extract various data points
-            data = {
-                    'url': self.url,
-                    'title': self.extract_title(soup),
-                    'main_content': self.extract_main_content(soup),
-                    'paragraphs': self.extract_clean_paragraphs(soup),
-                    'headings': self.extract_headings(soup),
-                    'word_count': self.count_words(soup),
-                    'scraped_at': str(timezone.now())
-                }
-            
-            return data, None
-            
-        except requests.exceptions.RequestException as e:
-            return None, f"Request error: {str(e)}"
-        except Exception as e:
-            return None, f"Scraping error: {str(e)}"
+            cache = FetchCache.get_default()
+            return getattr(cache, method)(*args) if cache else None
+        except (PyMongoError, InvalidDocument):
+            # InvalidDocument: an entry over the BSON size limit
+            return None
+
+    def parse_response(self, response):
+        """Build the scraped data dict from a response returned by request()"""
+        data = self.parse(response.content, response.declared_encoding)
+        return mark_truncated(data, response)
+
+    def parse(self, content, encoding=None):
+        """Build the scraped data dict from a downloaded page"""
+        # Parse once and extract the requested fields from the same tree
+        with timed('parse'):
+            soup = self.engine.parse(content, encoding)
+        with timed('extract'):
+            return self.extract_data(soup)
+
+    def extract_data(self, soup):
+        """Build the scraped data dict from an already parsed page, with only the requested fields"""
+        data = {'url': self.url}
+        data.update(self.engine.extract(soup, host_of(self.url), self.fields))
+        
+        for field in self.fields:
+            if field in self.EXTRACTORS:
+                started = time.perf_counter()
+                data[field] = getattr(self, self.EXTRACTORS[field])(soup)
+                observe_extractor(field, time.perf_counter() - started)
+        
+        data['scraped_at'] = str(timezone.now())
+        return data
 
     def extract_title(self, soup):
         title_tag = soup.find('title')
@@ -58,35 +162,15 @@ class WebScraper:
     def extract_paragraphs(self, soup=None):
         """Legacy method - delegates to extract_clean_paragraphs"""
         if soup is None:
-            response = self.session.get(self.url, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
+            response = self.request()
+            soup = self.engine.parse(response.content)
         
         return self.extract_clean_paragraphs(soup)
 
     def extract_clean_paragraphs(self, soup):
-        # Create a copy of soup to avoid modifying the original
-        soup_copy = BeautifulSoup(str(soup), 'html.parser')
-        
-        for element in soup_copy(['nav', 'header', 'footer', 'aside', 'script', 'style', 'noscript']):
-            element.decompose()
-        
-        # Remove common ad/navigation classes
-        ad_classes = ['ad', 'advertisement', 'sidebar', 'navigation', 'nav', 'menu', 'footer', 'header']
-        for class_name in ad_classes:
-            for element in soup_copy.find_all(class_=lambda x: x and class_name in str(x).lower()):
-                element.decompose()
-        
-        # Extract paragraphs
-        paragraphs = soup_copy.find_all('p')
-        clean_paragraphs = []
-        
-        for p in paragraphs:
-            text = p.get_text().strip()
-            # Filter out short, likely non-content paragraphs
-            if len(text) > 20 and not self.is_likely_navigation(text):
-                clean_paragraphs.append(text)
-        
-        return clean_paragraphs
+        # Navigation, ads and boilerplate are skipped while walking the tree,
+        # so the soup is left untouched
+        return self.engine.clean_paragraphs(soup)
 
     def extract_links(self, soup):
         links = []
@@ -132,17 +216,8 @@ class WebScraper:
     
     def is_likely_navigation(self, text):
         """Check if text is likely navigation/menu content"""
-        nav_keywords = [
-            'home', 'about', 'contact', 'login', 'register', 'subscribe',
-            'menu', 'navigation', 'skip to', 'breadcrumb', 'previous', 'next',
-            'share on', 'follow us', 'copyright', '©', 'privacy policy',
-            'terms of service', 'cookie policy', 'all rights reserved'
-        ]
-        
-        text_lower = text.lower()
-        
-        # Check for navigation keywords
-        if any(keyword in text_lower for keyword in nav_keywords):
+        # Check for navigation keywords, all at once
+        if NAVIGATION_PATTERN.search(text.lower()):
             return True
             
         # Check if text is very short (likely navigation)
@@ -156,44 +231,35 @@ class WebScraper:
         return False
     
     def extract_main_content(self, soup):
-        # Create a copy of soup to avoid modifying the original
-        soup_copy = BeautifulSoup(str(soup), 'html.parser')
-        
-        main_selectors = [
-            'main',
-            'article', 
-            '[role="main"]',
-            '.content',
-            '.main-content',
-            '.article-content',
-            '.post-content',
-            '.entry-content',
-            '.text',  # GfG specific
-            '#content',
-            '.container .row .col'  # Bootstrap pattern
-        ]
-        
-        main_content = ""
-        
-        for selector in main_selectors:
-            content_area = soup_copy.select_one(selector)
-            if content_area:
-                # Remove unwanted child elements
-                for unwanted in content_area(['script', 'style', 'nav', 'aside', 'footer', 'header']):
-                    unwanted.decompose()
-                
-                main_content = content_area.get_text(strip=True, separator='\n\n')
-                if len(main_content) > 100:  # Ensure we got substantial content
-                    break
-        
-        # Fallback: get content from body, excluding common non-content areas
-        if not main_content or len(main_content) < 100:
-            body = soup_copy.find('body')
-            if body:
-                # Remove navigation, sidebar, footer elements
-                for element in body(['nav', 'header', 'footer', 'aside', 'script', 'style']):
-                    element.decompose()
-                
-                main_content = body.get_text(strip=True, separator='\n\n')
-        
-        return main_content
\ No newline at end of file
+        # Tries the main content selectors in order, falling back to <body>
+        return self.engine.main_content(soup, host_of(self.url))
+
+
+def mark_truncated(data, response):
+    """Flag results extracted from a page cut off at SCRAPER_MAX_BODY_BYTES"""
+    if data is not None and response.truncated:
+        data['truncated'] = True
+    return data
+
+
+def parse_page(url, content, encoding=None, fields=None, profile=None):
+    """Extract scraped data from an already downloaded page in a worker process.
+
+    Module level so it can be sent to worker processes. It never touches
+    MongoDB: profile is the host's selector profile from the parent's
+    SelectorProfiles (None when they are disabled), and the updated copy is
+    returned for the parent to merge, like the metrics recorded while
+    parsing (see metrics.replay). Returns (data, error, profile, observations).
+    """
+    with collect() as observations:
+        scraper = WebScraper(url, use_cache=False, fields=fields)
+        host = host_of(url)
+        if profile is not None and host:
+            scraper.engine.profiles = SelectorProfiles.detached(host, profile)
+        try:
+            data, error = scraper.parse(content, encoding), None
+        except Exception as e:
+            data, error = None, f"Scraping error: {str(e)}"
+        if scraper.engine.profiles is not None:
+            profile = scraper.engine.profiles.get(host)
+    return data, error, profile, observations
@@ -1,15 +1,30 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse, Http404
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+from django.utils.text import compress_sequence
+from django.views.decorators.http import condition
 # Import direct MongoDB client instead of Django model
 from .mongodb_client import MongoDBClient
+from .search import ORDERS, InvalidCursor
 from .forms import URLForm
-from .utils import WebScraper
+from .coalesce import scrape_url, stored_fields
+from .extraction import parse_fields
+from .jobs import JobQueue
+from .batch import BatchScrape
+from .http_client import HttpClient, get_setting
+from . import metrics
+from pymongo.errors import PyMongoError
 import json
 
-# Initialize MongoDB client
+# Shared MongoDB client; it connects on first use in each worker process
 mongo_client = MongoDBClient()
+job_queue = JobQueue(mongo_client)
+
+# Same check Django's GZipMiddleware uses
+re_accepts_gzip = _lazy_re_compile(r'\bgzip\b')
 
 def index(request):
     if request.method == 'POST':
@@ -17,9 +32,8 @@ def index(request):
         if form.is_valid():
             url = form.cleaned_data['url']
             
-            # Perform scraping
-            scraper = WebScraper(url)
-            data, error = scraper.scrape()
+            # Scrape and save, or reuse a recent or in-flight scrape of the same page
+            document_id, data, error, reused = scrape_url(url, mongo_client)
             
             if error:
                 # Save error to MongoDB
@@ -30,14 +44,9 @@ def index(request):
                     error_message=error
                 )
                 messages.error(request, f'Error scraping URL: {error}')
-            else:
-                # Save data to MongoDB
-                document_id = mongo_client.save_scraped_data(
-                    url=url,
-                    data_dict=data,
-                    status='success'
-                )
-                
+            # The history and detail pages read the result back straight away
+            mongo_client.flush_writes()
+            if not error:
                 messages.success(request, 'Data scraped successfully!')
                 return redirect('scraper:detail', pk=document_id)
     else:
@@ -46,9 +55,6 @@ def index(request):
     # Get recent scraping history
     recent_scrapes = mongo_client.get_recent_scrapes(10)
     
-    for scrape in recent_scrapes:
-        print(f"Scrape ID: '{scrape.get('id', 'MISSING')}', Type: {type(scrape.get('id', ''))}")
-    
     context = {
         'form': form,
         'recent_scrapes': recent_scrapes
@@ -67,6 +73,13 @@ def detail(request, pk):
     }
     return render(request, 'scraper/detail.html', context)
 
+def download_etag(request, pk):
+    """ETag for a download, from the document id and its content hash"""
+    digest = mongo_client.get_content_hash(pk)
+    # Weak, since gzipped and plain bodies are equivalent but not byte-identical
+    return f'W/"{pk}-{digest}"' if digest else None
+
+@condition(etag_func=download_etag)
 def download_json(request, pk):
     document = mongo_client.get_scraped_data(pk)
     
@@ -74,22 +87,71 @@ def download_json(request, pk):
         raise Http404("JSON data not found")
     
     try:
-        # Get JSON content
-        if 'json_content' in document:
-            json_content = json.dumps(document['json_content'], indent=2, ensure_ascii=False)
+        # Streamed in chunks so large documents never sit in memory as one string
+        content = mongo_client.iter_json(document)
+        if re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response = StreamingHttpResponse(compress_sequence(content), content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
         else:
-            json_content = document.get('scraped_content', '{}')
-        
-        response = HttpResponse(
-            json_content,
-            content_type='application/json'
-        )
+            response = StreamingHttpResponse(content, content_type='application/json')
+        patch_vary_headers(response, ('Accept-Encoding',))
         filename = f"scraped_data_{pk}.json"
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
     except Exception as e:
         raise Http404(f"Error accessing data: {str(e)}")
 
+# Largest page of search results a client may ask for
+MAX_SEARCH_LIMIT = 100
+
+def run_search(params):
+    """Search from request parameters.
+    
+    Returns (query, order, results, next_cursor, error, status); status is
+    the HTTP status an error should be reported with.
+    """
+    query = params.get('q', '').strip()
+    order = params.get('order') or 'relevance'
+    if not query:
+        return query, order, [], None, 'q is required', 400
+    if order not in ORDERS:
+        return query, order, [], None, f'order must be one of: {", ".join(ORDERS)}', 400
+    try:
+        limit = min(max(int(params.get('limit', 20)), 1), MAX_SEARCH_LIMIT)
+    except ValueError:
+        return query, order, [], None, 'limit must be a number', 400
+    
+    try:
+        results, next_cursor = mongo_client.search(query, limit, params.get('cursor') or None, order)
+    except InvalidCursor as e:
+        return query, order, [], None, str(e), 400
+    except PyMongoError as e:
+        return query, order, [], None, f'Search failed: {e}', 503
+    return query, order, results, next_cursor, None, 200
+
+def search(request):
+    """Search page over previously scraped titles, headings and content"""
+    query, order, results, next_cursor, error, status = run_search(request.GET)
+    if error and query:
+        messages.error(request, error)
+    context = {
+        'query': query,
+        'order': order,
+        'orders': ORDERS,
+        'results': results,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'scraper/search.html', context)
+
+def api_search(request):
+    """Search results as JSON; pass next_cursor back as cursor for the next page"""
+    query, order, results, next_cursor, error, status = run_search(request.GET)
+    if error:
+        return JsonResponse({'error': error}, status=status)
+    for result in results:
+        result['detail_url'] = reverse('scraper:detail', kwargs={'pk': result['id']})
+    return JsonResponse({'query': query, 'order': order, 'results': results, 'next_cursor': next_cursor})
+
 def api_scrape(request):
     """API endpoint for scraping"""
     if request.method == 'POST':
@@ -100,23 +162,34 @@ def api_scrape(request):
             if not url:
                 return JsonResponse({'error': 'URL is required'}, status=400)
             
-            # Perform scraping
-            scraper = WebScraper(url)
-            scraped_content, error = scraper.scrape()
+            try:
+                fields = parse_fields(data.get('fields'))
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            
+            # Queue the job for the scrape workers and return immediately
+            if data.get('async'):
+                job_id = job_queue.enqueue(url, fields)
+                return JsonResponse({
+                    'success': True,
+                    'id': job_id,
+                    'status': 'pending',
+                    'status_url': reverse('scraper:job_status', kwargs={'pk': job_id})
+                }, status=202)
+            
+            # Scrape and save, or reuse a recent or in-flight scrape of the same page
+            document_id, scraped_content, error, reused = scrape_url(url, mongo_client, fields)
             
             if error:
                 return JsonResponse({'error': error}, status=400)
-            
-            # Save to MongoDB
-            document_id = mongo_client.save_scraped_data(
-                url=url,
-                data_dict=scraped_content,
-                status='success'
-            )
+            if scraped_content is None:
+                # Fresh enough copy already stored; only the requested fields are read
+                scraped_content = mongo_client.get_scraped_content(document_id, stored_fields(fields))
             
             return JsonResponse({
                 'success': True,
                 'id': document_id,
+                'reused': reused,
                 'data': scraped_content
             })
             
@@ -125,4 +198,80 @@ def api_scrape(request):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
-    return JsonResponse({'error': 'Method not allowed'}, status=405)
\ No newline at end of file
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+def batch_from_request(request):
+    """BatchScrape for a batch API request; returns (batch, error_response)"""
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return None, JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    urls = data.get('urls') if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        return None, JsonResponse({'error': 'urls must be a list of URLs'}, status=400)
+    urls = [url.strip() for url in urls if url.strip()]
+    if not urls:
+        return None, JsonResponse({'error': 'URL is required'}, status=400)
+    
+    max_urls = get_setting('SCRAPER_BATCH_MAX_URLS', 500)
+    if len(urls) > max_urls:
+        return None, JsonResponse({'error': f'At most {max_urls} URLs per batch'}, status=400)
+    
+    # Clients may ask for less concurrency, never more than the server allows
+    max_concurrency = get_setting('SCRAPER_BATCH_CONCURRENCY', 16)
+    try:
+        concurrency = min(int(data.get('concurrency', max_concurrency)), max_concurrency)
+    except (TypeError, ValueError):
+        return None, JsonResponse({'error': 'concurrency must be a number'}, status=400)
+    
+    return BatchScrape(urls, concurrency, mongo_client), None
+
+def api_scrape_batch(request):
+    """Scrape a list of URLs concurrently, streaming one JSON line per result"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+    
+    batch, error_response = batch_from_request(request)
+    if error_response:
+        return error_response
+    
+    # Under ASGI, Bloger.asgi's handler reads each line on a worker thread
+    return StreamingHttpResponse(batch.iter_ndjson(), content_type='application/x-ndjson')
+
+def job_status(request, pk):
+    """Status of a queued scrape job"""
+    job = job_queue.get_status(pk)
+    
+    if not job:
+        return JsonResponse({'error': 'Job not found'}, status=404)
+    
+    response = {
+        'id': job['id'],
+        'url': job.get('url'),
+        'status': job.get('status'),
+        'error': job.get('error_message', ''),
+        'created_at': job.get('created_at'),
+        'completed_at': job.get('completed_at'),
+    }
+    if job.get('status') == 'success':
+        response['detail_url'] = reverse('scraper:detail', kwargs={'pk': job['id']})
+        response['download_url'] = reverse('scraper:download', kwargs={'pk': job['id']})
+    return JsonResponse(response)
+
+def queue_stats(request):
+    """Number of scrape jobs waiting and in progress"""
+    return JsonResponse(job_queue.depth())
+
+def host_stats(request):
+    """Time fetches spent queued for each host in this process"""
+    return JsonResponse(HttpClient.get_default().scheduler.stats())
+
+def health(request):
+    """MongoDB reachability and connection pool usage of this worker process"""
+    report = mongo_client.health()
+    return JsonResponse(report, status=200 if report['status'] == 'ok' else 503)
+
+def metrics_view(request):
+    """Scrape timings and error counts in the Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
\ No newline at end of file